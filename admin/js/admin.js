@@ -4,6 +4,11 @@
 let currentProductId = null;
 let currentUserId = null;
 let currentOrderId = null;
+let ordersCursor = null;
+let ordersLoading = false;
+let ordersRequestId = 0;
+let ordersTotalHint = null;
+let ordersObserver = null;
 
 // Initialize the admin dashboard
 document.addEventListener('DOMContentLoaded', function() {
@@ -691,12 +696,11 @@ async function uploadImageForProduct(productId, imageFile) {
         if (!result.success) {
             console.error('Image upload failed:', result.message);
         } else {
-            // Force refresh any existing product images in the table
+            // Point existing product images at the new content-hashed URL
             setTimeout(() => {
                 const productImages = document.querySelectorAll(`img[src*="/api/product-image/${productId}"]`);
                 productImages.forEach(img => {
-                    const originalSrc = img.src.split('?')[0]; // Remove any existing cache busting
-                    img.src = originalSrc + '?t=' + Date.now();
+                    img.src = result.image_url;
                 });
             }, 100);
         }
@@ -1008,38 +1012,86 @@ function deleteUser(userId) {
 }
 
 // Order management functions
-async function loadOrders() {
-    console.log('LoadOrders function called');
+// Orders are fetched a page at a time; pass append=true to fetch the next page.
+// A fresh load (e.g. after a filter change) supersedes one still in flight.
+async function loadOrders(append = false) {
+    if (append && (ordersLoading || !ordersCursor)) return;
+    ordersLoading = true;
+    // Responses from superseded requests are ignored
+    const requestId = ++ordersRequestId;
+    
     try {
-        console.log('Fetching orders from /api/admin/orders');
-        const response = await fetch('/api/admin/orders');
-        console.log('Response received:', response);
-        console.log('Response status:', response.status);
-        console.log('Response ok:', response.ok);
+        const params = new URLSearchParams({ limit: '50' });
+        const statusFilter = document.getElementById('order-status-filter');
+        if (statusFilter && statusFilter.value) {
+            params.set('status', statusFilter.value);
+        }
+        if (append) {
+            params.set('cursor', ordersCursor);
+        }
         
+        const response = await fetch(`/api/admin/orders?${params.toString()}`);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         
         const data = await response.json();
-        console.log('Data parsed:', data);
-        
+        if (requestId !== ordersRequestId) return;
         if (data.success) {
-            console.log('Orders loaded successfully, calling displayOrders');
-            displayOrders(data.orders);
+            ordersCursor = data.next_cursor;
+            if (!append) {
+                ordersTotalHint = data.total_count === null ? null : {
+                    count: data.total_count,
+                    capped: data.total_count_capped
+                };
+            }
+            displayOrders(data.orders, append);
+            updateOrdersPagination();
         } else {
             console.error('Server returned error:', data.message);
             showError('Failed to load orders: ' + data.message);
         }
     } catch (error) {
+        if (requestId !== ordersRequestId) return;
         console.error('Error loading orders:', error);
         showError('Failed to load orders: ' + error.message);
+    } finally {
+        if (requestId === ordersRequestId) {
+            ordersLoading = false;
+        }
     }
 }
 
-function displayOrders(orders) {
-    console.log('DisplayOrders called with:', orders);
-    
+function updateOrdersPagination() {
+    const pagination = document.getElementById('orders-pagination');
+    const loadMoreBtn = document.getElementById('orders-load-more');
+    const countHint = document.getElementById('orders-count-hint');
+    if (!pagination || !loadMoreBtn) return;
+    
+    const shown = document.querySelectorAll('#orders-table-body tr[data-order-id]').length;
+    if (countHint && ordersTotalHint) {
+        const total = ordersTotalHint.count.toLocaleString('en-IN') + (ordersTotalHint.capped ? '+' : '');
+        countHint.textContent = `Showing ${shown} of ${total} orders`;
+    }
+    pagination.style.display = ordersCursor || shown ? 'block' : 'none';
+    loadMoreBtn.style.display = ordersCursor ? '' : 'none';
+    
+    if (!loadMoreBtn.dataset.bound) {
+        loadMoreBtn.dataset.bound = 'true';
+        loadMoreBtn.addEventListener('click', () => loadOrders(true));
+        // Lazily fetch the next page when the button scrolls into view
+        if ('IntersectionObserver' in window) {
+            ordersObserver = new IntersectionObserver(entries => {
+                if (entries.some(entry => entry.isIntersecting)) {
+                    loadOrders(true);
+                }
+            });
+            ordersObserver.observe(loadMoreBtn);
+        }
+    }
+}
+
+function displayOrders(orders, append = false) {
     const tableBody = document.getElementById('orders-table-body');
     const mobileCardsContainer = document.getElementById('orders-mobile-cards');
     
@@ -1048,7 +1100,7 @@ function displayOrders(orders) {
         return;
     }
     
-    if (orders.length === 0) {
+    if (orders.length === 0 && !append) {
         tableBody.innerHTML = '<tr><td colspan="7" class="text-center">No orders found</td></tr>';
         if (mobileCardsContainer) {
             mobileCardsContainer.innerHTML = '<div class="no-data">No orders found</div>';
@@ -1056,14 +1108,11 @@ function displayOrders(orders) {
         return;
     }
     
-    console.log(`Displaying ${orders.length} orders`);
-    
     // Create desktop table rows
     const fragment = document.createDocumentFragment();
-    orders.forEach((order, index) => {
-        console.log(`Processing order ${index}:`, order);
-        
+    orders.forEach(order => {
         const tr = document.createElement('tr');
+        tr.setAttribute('data-order-id', order.id);
         tr.innerHTML = `
             <td>#${order.id || 'N/A'}</td>
             <td>
@@ -1095,13 +1144,16 @@ function displayOrders(orders) {
         fragment.appendChild(tr);
     });
     
-    tableBody.innerHTML = '';
+    if (!append) {
+        tableBody.innerHTML = '';
+    }
     tableBody.appendChild(fragment);
     
     // Create mobile cards if container exists
     if (mobileCardsContainer) {
-        console.log('Creating mobile cards');
-        mobileCardsContainer.innerHTML = '';
+        if (!append) {
+            mobileCardsContainer.innerHTML = '';
+        }
         orders.forEach(order => {
             const mobileCard = document.createElement('div');
             mobileCard.className = 'mobile-card';
@@ -1153,8 +1205,6 @@ function displayOrders(orders) {
             mobileCardsContainer.style.display = 'none';
         }
     }
-    
-    console.log('Orders display completed');
 }
 
 // Delete order function
@@ -1184,53 +1234,10 @@ function deleteOrder(orderId) {
     });
 }
 
+// Status filtering runs on the server so every page respects it
 function filterOrders() {
-    const statusFilter = document.getElementById('order-status-filter').value.toLowerCase();
-    console.log('Filtering orders by status:', statusFilter);
-    
-    // Filter table rows
-    const rows = document.querySelectorAll('#orders-table-body tr');
-    console.log('Found', rows.length, 'rows to filter');
-    
-    rows.forEach((row, index) => {
-        const cells = row.querySelectorAll('td');
-        if (cells.length < 6) {
-            console.log(`Row ${index}: Skipping (${cells.length} cells)`);
-            return; // Skip loading/empty rows
-        }
-
-        // Get status from the status badge in the Status column (5th column, index 4)
-        // Table structure: Order ID | Customer | Products | Total | Status | Date | Actions
-        const statusBadge = cells[4].querySelector('.status-badge');
-        const status = statusBadge ? statusBadge.textContent.trim().toLowerCase() : '';
-        console.log(`Row ${index}: Status found = "${status}"`);
-
-        if (!statusFilter || status === statusFilter) {
-            row.style.display = '';
-            console.log(`Row ${index}: Showing (matches filter)`);
-        } else {
-            row.style.display = 'none';
-            console.log(`Row ${index}: Hiding (doesn't match filter)`);
-        }
-    });
-    
-    // Filter mobile cards
-    const mobileCards = document.querySelectorAll('#orders-mobile-cards .mobile-card');
-    console.log('Found', mobileCards.length, 'mobile cards to filter');
-    
-    mobileCards.forEach((card, index) => {
-        const statusElement = card.querySelector('.status-badge');
-        const status = statusElement ? statusElement.textContent.trim().toLowerCase() : '';
-        console.log(`Mobile card ${index}: Status = "${status}"`);
-
-        if (!statusFilter || status === statusFilter) {
-            card.style.display = '';
-        } else {
-            card.style.display = 'none';
-        }
-    });
-    
-    console.log('Filter completed');
+    ordersCursor = null;
+    loadOrders();
 }
 
 function viewOrder(orderId) {
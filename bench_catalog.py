@@ -0,0 +1,86 @@
+"""
+Catalog listing benchmark.
+
+Populates a throwaway database with a fixed number of products and grows the
+size of every product image between runs. Both the keyset listing query
+behind GET /api/products?limit= and a reload of the in-memory catalog
+snapshot (what the first GET /api/products after a catalog write pays)
+should stay flat, since product rows only hold the image hash and the bytes
+live in the image store.
+
+Usage:
+    python bench_catalog.py [--products 200] [--requests 50]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+IMAGE_SIZES_KB = [0, 16, 128, 512, 1024]
+
+
+def populate(server, product_count, image_kb):
+    conn = server.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM products')
+    image_hash = server.image_store.put(os.urandom(image_kb * 1024)) if image_kb else None
+    for i in range(product_count):
+        cursor.execute('''
+            INSERT INTO products (title, category, gender, price, description, volume, longevity)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (f'Perfume {i}', 'Perfume', 'Unisex', 1999.0, 'Benchmark product', '100ml', '8h'))
+        if image_hash:
+            server.save_product_image(cursor, cursor.lastrowid, image_hash, 'bench.jpg', 'image/jpeg')
+    # Publish like the admin routes do, so no worker keeps serving the previous catalog
+    server.catalog_cache.bump_version(cursor)
+    conn.commit()
+    conn.close()
+    server.catalog_cache.publish()
+
+
+def timed(run, request_count):
+    timings = []
+    for _ in range(request_count):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fajr-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    os.environ['FAJR_DB'] = db_path
+
+    import server  # imported after FAJR_DB is set so init_db() targets the temp file
+    client = server.app.test_client()
+    page_url = f'/api/products?limit={server.MAX_PAGE_SIZE}'
+
+    def list_page():
+        # Bypasses the per-snapshot query cache so every call runs the listing SQL
+        products, _ = server.query_products({'limit': str(server.MAX_PAGE_SIZE)})
+        assert len(products) == min(args.products, server.MAX_PAGE_SIZE)
+
+    def reload_snapshot():
+        server.catalog_cache.publish()
+        assert len(server.catalog_cache.snapshot()['products']) == args.products
+
+    print(f"{'image size':>12} {'db size':>10} {'query ms':>10} {'max ms':>10} {'reload ms':>10} {'max ms':>10}")
+    for image_kb in IMAGE_SIZES_KB:
+        populate(server, args.products, image_kb)
+        assert client.get(page_url).status_code == 200
+        query_ms, query_max = timed(list_page, args.requests)
+        reload_ms, reload_max = timed(reload_snapshot, args.requests)
+        db_mb = sum(os.path.getsize(path) for path in (db_path, db_path + '-wal') if os.path.exists(path)) / (1024 * 1024)
+        print(f"{image_kb:>9} KB {db_mb:>7.1f} MB {query_ms:>10.2f} {query_max:>10.2f} "
+              f"{reload_ms:>10.2f} {reload_max:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
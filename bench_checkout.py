@@ -0,0 +1,114 @@
+"""
+Checkout duplicate-submit benchmark.
+
+Fires the same /api/place-order request, carrying one Idempotency-Key, from
+many threads at once and checks that exactly one order was written and every
+caller got its id back. Then times replays of that key, which are answered
+from the key table without taking the write lock.
+
+Usage:
+    python bench_checkout.py [--threads 16] [--rounds 5] [--replays 200]
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+
+
+def populate(db_path, product_count=20):
+    conn = sqlite3.connect(db_path)
+    for i in range(product_count):
+        conn.execute('''
+            INSERT INTO products (title, category, gender, price, description, volume, longevity)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (f'Perfume {i}', 'Perfume', 'Unisex', 1999.0, 'Benchmark product', '100ml', '8h'))
+    conn.commit()
+    conn.close()
+
+
+def logged_in_client(app):
+    client = app.test_client()
+    response = client.post('/api/login', json={'email': 'bench@example.com', 'password': 'bench-password'})
+    assert response.status_code == 200, response.get_json()
+    return client
+
+
+def fire_in_parallel(clients, payload, key):
+    barrier = threading.Barrier(len(clients))
+    results = [None] * len(clients)
+
+    def submit(index, client):
+        barrier.wait()
+        response = client.post('/api/place-order', json=payload, headers={'Idempotency-Key': key})
+        results[index] = (response.status_code, response.get_json())
+
+    threads = [threading.Thread(target=submit, args=(i, c)) for i, c in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--replays', type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fajr-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    os.environ['FAJR_DB'] = db_path
+
+    import server  # imported after FAJR_DB is set so init_db() targets the temp file
+    # Every client signs in as the same user from the same address; lift the
+    # login rate limits so they measure checkout, not the limiter
+    server.rate_limiter.limits.update({name: (10000, 10000) for name in server.rate_limiter.limits})
+    populate(db_path)
+    server.app.test_client().post('/api/register', json={
+        'first_name': 'Bench', 'last_name': 'User',
+        'email': 'bench@example.com', 'password': 'bench-password'
+    })
+    clients = [logged_in_client(server.app) for _ in range(args.threads)]
+    payload = {
+        'items': [{'product_id': 1, 'quantity': 2}, {'product_id': 2, 'quantity': 1}],
+        'payment_method': 'cod'
+    }
+
+    for round_number in range(1, args.rounds + 1):
+        key = str(uuid.uuid4())
+        results = fire_in_parallel(clients, payload, key)
+        statuses = {status for status, _ in results}
+        order_ids = {body['order_id'] for _, body in results}
+        replayed = sum(1 for _, body in results if body.get('replayed'))
+        assert statuses == {200}, results
+        assert len(order_ids) == 1, f'duplicate orders for one key: {sorted(order_ids)}'
+        print(f'round {round_number}: {len(results)} parallel submits -> order {order_ids.pop()} '
+              f'({replayed} replayed)')
+
+    conn = sqlite3.connect(db_path)
+    order_count = conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+    conn.close()
+    assert order_count == args.rounds, f'expected {args.rounds} orders, found {order_count}'
+    print(f'{order_count} orders written for {args.rounds * args.threads} submits')
+
+    conflict = clients[0].post('/api/place-order', json=dict(payload, payment_method='razorpay'),
+                               headers={'Idempotency-Key': key})
+    assert conflict.status_code == 422, conflict.get_json()
+
+    timings = []
+    for _ in range(args.replays):
+        start = time.perf_counter()
+        response = clients[0].post('/api/place-order', json=payload, headers={'Idempotency-Key': key})
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.get_json().get('replayed')
+    print(f'replay latency: median {statistics.median(timings):.2f} ms, max {max(timings):.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
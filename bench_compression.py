@@ -0,0 +1,108 @@
+"""
+Response compression benchmark.
+
+Fills a throwaway database with products, users and orders, then requests the
+largest JSON listings with each Accept-Encoding and reports the bytes on the
+wire and the CPU time per request. The catalog is measured twice for each
+encoding: once normally, where repeat hits are served from the compressed
+body cache, and once with that cache emptied before every request.
+
+Usage:
+    python bench_compression.py [--products 500] [--orders 2000] [--requests 50]
+                                [--gzip-level 6] [--brotli-quality 4]
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+ENDPOINTS = ['/api/products', '/api/admin/orders?limit=100', '/api/admin/users']
+
+
+def populate(db_path, product_count, order_count):
+    conn = sqlite3.connect(db_path)
+    for i in range(product_count):
+        conn.execute('''
+            INSERT INTO products (title, category, gender, price, description, volume, longevity)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (f'Perfume {i}', 'Perfume', ('Men', 'Women', 'Unisex')[i % 3], 999.0 + i,
+              f'Notes of oud, amber and rose. Batch {i} of the house signature blend.', '100ml', '8h'))
+    user_count = max(1, order_count // 4)
+    for i in range(user_count):
+        conn.execute('''
+            INSERT INTO users (first_name, last_name, email, phone, gender)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (f'First{i}', f'Last{i}', f'user{i}@example.com', f'98{i:08d}', 'Unisex'))
+    for i in range(order_count):
+        product_id = i % product_count + 1
+        cursor = conn.execute('''
+            INSERT INTO orders (user_id, total_amount, item_count, order_status, payment_method, shipping_address)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (i % user_count + 1, 1999.0, 2, 'pending', 'cod', f'{i} Marine Drive, Mumbai 400020'))
+        conn.execute('''
+            INSERT INTO order_items (order_id, product_id, product_title, unit_price, quantity, line_total)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (cursor.lastrowid, product_id, f'Perfume {product_id - 1}', 999.5, 2, 1999.0))
+    conn.commit()
+    conn.close()
+
+
+def measure(client, url, encoding, request_count, before_each=None):
+    """(bytes on the wire, median CPU ms, median wall ms) per request"""
+    headers = {'Accept-Encoding': encoding}
+    cpu_times, wall_times, size = [], [], None
+    for _ in range(request_count):
+        if before_each:
+            before_each()
+        # The test client runs the request in this thread, so thread time is its CPU cost
+        cpu_start, wall_start = time.thread_time(), time.perf_counter()
+        response = client.get(url, headers=headers)
+        cpu_times.append((time.thread_time() - cpu_start) * 1000)
+        wall_times.append((time.perf_counter() - wall_start) * 1000)
+        assert response.status_code == 200, response.status_code
+        assert response.headers.get('Content-Encoding', 'identity') == encoding
+        size = len(response.data)
+    return size, statistics.median(cpu_times), statistics.median(wall_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--gzip-level', type=int)
+    parser.add_argument('--brotli-quality', type=int)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fajr-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    os.environ['FAJR_DB'] = db_path
+    if args.gzip_level is not None:
+        os.environ['FAJR_GZIP_LEVEL'] = str(args.gzip_level)
+    if args.brotli_quality is not None:
+        os.environ['FAJR_BROTLI_QUALITY'] = str(args.brotli_quality)
+
+    import server  # imported after FAJR_DB is set so init_db() targets the temp file
+    populate(db_path, args.products, args.orders)
+    client = server.app.test_client()
+    encodings = ['identity'] + server.COMPRESSION_ENCODINGS
+    print(f'gzip level {server.GZIP_LEVEL}, brotli quality '
+          f'{server.BROTLI_QUALITY if "br" in encodings else "n/a (brotli not installed)"}')
+
+    print(f"{'endpoint':<30} {'encoding':<16} {'bytes':>9} {'ratio':>6} {'cpu ms':>8} {'wall ms':>8}")
+    for url in ENDPOINTS:
+        runs = [(encoding, encoding, None) for encoding in encodings]
+        if url == '/api/products':
+            runs += [(encoding, f'{encoding} uncached', server.compressed_bodies.clear)
+                     for encoding in server.COMPRESSION_ENCODINGS]
+        identity_size = None
+        for encoding, label, before_each in runs:
+            size, cpu_ms, wall_ms = measure(client, url, encoding, args.requests, before_each)
+            identity_size = identity_size or size
+            print(f'{url:<30} {label:<16} {size:>9} {identity_size / size:>5.1f}x {cpu_ms:>8.2f} {wall_ms:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Product search benchmark.
+
+Fills a throwaway database with a synthetic catalog (100k products by
+default) and measures p50/p99 latency of the FTS5-backed search query,
+bypassing the per-snapshot result cache so every query hits SQLite.
+
+Usage:
+    python bench_search.py [--products 100000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+NOTES = [
+    'oud', 'amber', 'rose', 'musk', 'vanilla', 'citrus', 'bergamot', 'sandalwood',
+    'jasmine', 'leather', 'saffron', 'vetiver', 'patchouli', 'iris', 'neroli', 'cedar',
+    'tobacco', 'incense', 'lavender', 'pepper', 'fig', 'tonka', 'orchid', 'marine'
+]
+SYLLABLES = ['al', 'ba', 'ce', 'dor', 'el', 'fa', 'gi', 'ha', 'ir', 'ka', 'lu', 'ma',
+             'no', 'or', 'pa', 'qu', 'ri', 'sa', 'ta', 'um', 'va', 'wi', 'xe', 'za']
+FAMILIES = ['Woody', 'Floral', 'Oriental', 'Fresh', 'Citrus', 'Gourmand', 'Chypre']
+CONCENTRATIONS = ['Eau de Parfum', 'Eau de Toilette', 'Extrait de Parfum', 'Attar']
+
+
+def make_vocabulary(rng, size=20000):
+    # Zipf-ish vocabulary: a few common fragrance notes plus many rarer words
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return NOTES + sorted(words)
+
+
+def pick_word(rng, vocabulary):
+    return vocabulary[min(int(rng.paretovariate(1.0)) - 1, len(vocabulary) - 1)]
+
+
+def populate(db_path, product_count, vocabulary):
+    import sqlite3
+    rng = random.Random(42)
+    conn = sqlite3.connect(db_path)
+    rows = []
+    for i in range(product_count):
+        title = ' '.join(pick_word(rng, vocabulary) for _ in range(3)).title()
+        description = ' '.join(pick_word(rng, vocabulary) for _ in range(30))
+        rows.append((title, 'Perfume', rng.choice(['Men', 'Women', 'Unisex']), rng.randint(5, 200) * 100.0,
+                     description, rng.choice(FAMILIES), rng.choice(CONCENTRATIONS)))
+    conn.executemany('''
+        INSERT INTO products (title, category, gender, price, description, fragrance_family, concentration)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fajr-bench-')
+    os.environ['FAJR_DB'] = os.path.join(workdir, 'bench.db')
+
+    import server  # imported after FAJR_DB is set so init_db() targets the temp file
+
+    vocabulary = make_vocabulary(random.Random(1))
+    start = time.perf_counter()
+    populate(os.environ['FAJR_DB'], args.products, vocabulary)
+    print(f"Indexed {args.products} products in {time.perf_counter() - start:.1f}s")
+
+    rng = random.Random(7)
+    queries = []
+    for _ in range(args.queries):
+        kind = rng.random()
+        word = rng.choice(vocabulary)
+        if kind < 0.4:
+            queries.append(word[:rng.randint(3, 5)])  # typeahead prefix
+        elif kind < 0.8:
+            queries.append(f"{rng.choice(NOTES)} {word}")
+        else:
+            queries.append(f"{rng.choice(FAMILIES)} {word}")
+
+    timings = []
+    with server.app.app_context():
+        for text in queries:
+            fts_query = server.build_fts_query(text)
+            t0 = time.perf_counter()
+            server.search_products(fts_query, server.SEARCH_DEFAULT_LIMIT)
+            timings.append((time.perf_counter() - t0) * 1000)
+
+    timings.sort()
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f"queries: {len(timings)}  p50: {statistics.median(timings):.2f} ms  "
+          f"p99: {p99:.2f} ms  max: {timings[-1]:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
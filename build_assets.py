@@ -0,0 +1,390 @@
+"""
+Static asset build.
+
+Copies client/ and admin/ into an output directory (dist/ by default) ready to
+be served with FAJR_ASSET_DIR=dist:
+
+- CSS and JS are minified. The JS pass only drops comments and indentation and
+  keeps line breaks, so automatic semicolon insertion is unaffected.
+- Raster images wider than MAX_IMAGE_WIDTH are downscaled and recompressed, and
+  opaque PNGs become JPEGs (needs Pillow; without it images are copied as-is).
+- Every asset also gets a content-hashed name (style.3f2a9c01de.css). HTML and
+  CSS references are rewritten to those names, which the server caches as
+  immutable. The unhashed names stay available for references built in JS.
+- Text files get .gz and .br siblings (.br needs the brotli package), which
+  the server sends when the client's Accept-Encoding allows.
+
+Usage:
+    python build_assets.py [--out dist]
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import posixpath
+import re
+import shutil
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOTS = ('client', 'admin')
+HASH_LENGTH = 10
+MAX_IMAGE_WIDTH = 1600
+JPEG_QUALITY = 82
+# Opaque PNGs larger than this are photos in practice; JPEG is far smaller
+PNG_TO_JPEG_MIN_BYTES = 100 * 1024
+TEXT_EXTENSIONS = {'.html', '.css', '.js', '.svg', '.txt', '.xml', '.json'}
+RASTER_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+# Precompressed siblings are only kept if they are this much smaller
+MIN_COMPRESSION_RATIO = 0.9
+MIN_COMPRESS_BYTES = 256
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+HTML_REFERENCE = re.compile(r'''\b(src|href)=(["'])([^"'<>]+)\2''')
+JS_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+JS_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete',
+                     'void', 'throw', 'instanceof', 'yield', 'await'}
+
+
+def minify_css(source):
+    """Drop comments and collapse whitespace, leaving strings untouched"""
+    out = []
+    # Strings are swapped for placeholders while the punctuation passes run
+    strings = []
+    i, n = 0, len(source)
+    while i < n:
+        char = source[i]
+        if char in '"\'':
+            end = i + 1
+            while end < n and source[end] != char:
+                end += 2 if source[end] == '\\' else 1
+            out.append(f'\x00{len(strings)}\x00')
+            strings.append(source[i:end + 1])
+            i = end + 1
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            out.append(' ')
+        elif char.isspace():
+            while i < n and source[i].isspace():
+                i += 1
+            out.append(' ')
+        else:
+            out.append(char)
+            i += 1
+    css = re.sub(r' +', ' ', ''.join(out))
+    # Only around punctuation where whitespace is never significant; spaces
+    # before ':' (descendant pseudo-classes) and '(' (media queries) stay
+    css = re.sub(r' ?([{};,]) ?', r'\1', css)
+    css = re.sub(r': ', ':', css)
+    css = css.replace(';}', '}')
+    return re.sub(r'\x00(\d+)\x00', lambda m: strings[int(m.group(1))], css).strip()
+
+
+def minify_js(source):
+    """Drop comments, indentation and blank lines; literals are copied byte for byte.
+
+    Line breaks are kept, so the result parses exactly like the source.
+    """
+    out = []
+    # One entry per open template literal: depth of ${ ... } braces inside it
+    templates = []
+    i, n = 0, len(source)
+
+    def last_significant():
+        for chunk in reversed(out):
+            stripped = chunk.rstrip()
+            if stripped:
+                return stripped
+        return ''
+
+    def regex_allowed():
+        previous = last_significant()
+        if not previous:
+            return True
+        if previous[-1] in JS_REGEX_PRECEDERS:
+            return True
+        word = re.search(r'[A-Za-z_$][\w$]*$', previous)
+        return bool(word) and word.group(0) in JS_REGEX_KEYWORDS
+
+    def scan_template(start):
+        """Copy template text from start up to and including '`' or '${'; returns the new index"""
+        end = start
+        while end < n:
+            if source[end] == '\\':
+                end += 2
+            elif source[end] == '`':
+                out.append(source[start:end + 1])
+                templates.pop()
+                return end + 1
+            elif source.startswith('${', end):
+                out.append(source[start:end + 2])
+                templates[-1] = 1
+                return end + 2
+            else:
+                end += 1
+        out.append(source[start:])
+        return n
+
+    while i < n:
+        char = source[i]
+        if char in '"\'':
+            end = i + 1
+            while end < n and source[end] != char and source[end] != '\n':
+                end += 2 if source[end] == '\\' else 1
+            out.append(source[i:end + 1])
+            i = end + 1
+        elif char == '`':
+            templates.append(0)
+            i = scan_template(i)
+        elif char == '{' and templates and templates[-1]:
+            templates[-1] += 1
+            out.append(char)
+            i += 1
+        elif char == '}' and templates and templates[-1]:
+            templates[-1] -= 1
+            if templates[-1]:
+                out.append(char)
+                i += 1
+            else:
+                # End of ${ ... }: back inside the template text
+                out.append(char)
+                i = scan_template(i + 1)
+        elif source.startswith('//', i):
+            end = source.find('\n', i)
+            i = n if end == -1 else end
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            comment = source[i:n if end == -1 else end + 2]
+            # A multi-line comment counts as a line break for ASI
+            out.append('\n' if '\n' in comment else ' ')
+            i = n if end == -1 else end + 2
+        elif char == '/' and regex_allowed():
+            end = i + 1
+            in_class = False
+            while end < n and source[end] != '\n':
+                if source[end] == '\\':
+                    end += 2
+                    continue
+                if source[end] == '[':
+                    in_class = True
+                elif source[end] == ']':
+                    in_class = False
+                elif source[end] == '/' and not in_class:
+                    break
+                end += 1
+            end += 1
+            while end < n and (source[end].isalnum() or source[end] == '_'):
+                end += 1  # flags
+            out.append(source[i:end])
+            i = end
+        elif char == '\n':
+            out.append('\n')
+            i += 1
+        elif char in ' \t\r':
+            while i < n and source[i] in ' \t\r':
+                i += 1
+            out.append(' ')
+        else:
+            out.append(char)
+            i += 1
+
+    # Trim each line and drop the empty ones; literals spanning lines (templates)
+    # were appended as single chunks, so their inner lines are not touched here
+    lines = []
+    current = []
+    for chunk in out:
+        if chunk == '\n':
+            line = ''.join(current).strip(' ')
+            if line:
+                lines.append(line)
+            current = []
+        else:
+            current.append(chunk)
+    line = ''.join(current).strip(' ')
+    if line:
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def optimize_image(data, extension):
+    """Return (bytes, extension) for a raster image, or the input if it can't be improved"""
+    if Image is None:
+        return data, extension
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception:
+        return data, extension
+    resized = image.width > MAX_IMAGE_WIDTH
+    if resized:
+        height = round(image.height * MAX_IMAGE_WIDTH / image.width)
+        image = image.resize((MAX_IMAGE_WIDTH, height), Image.LANCZOS)
+    opaque = image.mode in ('RGB', 'L') or (image.mode == 'RGBA' and image.getextrema()[3][0] == 255)
+    buffer = io.BytesIO()
+    if extension in ('.jpg', '.jpeg') or (extension == '.png' and opaque and len(data) >= PNG_TO_JPEG_MIN_BYTES):
+        image.convert('RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        new_extension = extension if extension != '.png' else '.jpg'
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+        new_extension = extension
+    if not resized and new_extension == extension and buffer.tell() >= len(data):
+        return data, extension
+    return buffer.getvalue(), new_extension
+
+
+def fingerprinted_name(path, data, extension=None):
+    stem, original_extension = posixpath.splitext(path)
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    return f'{stem}.{digest}{extension or original_extension}'
+
+
+def rewrite_reference(reference, base_dir, manifest):
+    """Map a relative reference to its fingerprinted name, keeping any query or fragment"""
+    if reference.startswith(('http:', 'https:', '//', 'data:', '#', 'mailto:', 'tel:', '/')) or '${' in reference:
+        return reference
+    path, suffix = re.match(r'([^?#]*)(.*)', reference).groups()
+    target = posixpath.normpath(posixpath.join(base_dir, path))
+    if target not in manifest:
+        return reference
+    return posixpath.join(posixpath.dirname(path), posixpath.basename(manifest[target])) + suffix
+
+
+def rewrite_css_urls(css, base_dir, manifest):
+    return CSS_URL.sub(lambda m: f"url({m.group(1)}{rewrite_reference(m.group(2), base_dir, manifest)}{m.group(1)})", css)
+
+
+def rewrite_html(html, base_dir, manifest):
+    html = HTML_REFERENCE.sub(
+        lambda m: f'{m.group(1)}={m.group(2)}{rewrite_reference(m.group(3), base_dir, manifest)}{m.group(2)}', html)
+    return rewrite_css_urls(html, base_dir, manifest)
+
+
+def write(out_dir, path, data):
+    target = os.path.join(out_dir, *path.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(data)
+    return target
+
+
+def precompress(target, data):
+    """Write .gz (and .br) siblings when they are worth it; returns bytes saved by the best one"""
+    if len(data) < MIN_COMPRESS_BYTES:
+        return 0
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    best = 0
+    for suffix, compressed in variants.items():
+        if len(compressed) <= len(data) * MIN_COMPRESSION_RATIO:
+            with open(target + suffix, 'wb') as f:
+                f.write(compressed)
+            best = max(best, len(data) - len(compressed))
+    return best
+
+
+def collect(source_dir):
+    """Relative paths of every file under the asset roots, grouped by build stage"""
+    stages = {'raster': [], 'other': [], 'css': [], 'js': [], 'html': []}
+    for root in ROOTS:
+        for directory, _, filenames in os.walk(os.path.join(source_dir, root)):
+            for filename in filenames:
+                path = os.path.relpath(os.path.join(directory, filename), source_dir).replace(os.sep, '/')
+                extension = posixpath.splitext(filename)[1].lower()
+                if extension in RASTER_EXTENSIONS:
+                    stages['raster'].append(path)
+                elif extension in ('.css', '.js', '.html'):
+                    stages[extension[1:]].append(path)
+                else:
+                    stages['other'].append(path)
+    return stages
+
+
+def build(source_dir, out_dir):
+    stages = collect(source_dir)
+    manifest = {}
+    outputs = []  # (path written, bytes, original size)
+
+    def read(path):
+        with open(os.path.join(source_dir, *path.split('/')), 'rb') as f:
+            return f.read()
+
+    def emit(path, data, original_size, extension=None, same_format=True):
+        hashed = fingerprinted_name(path, data, extension)
+        manifest[path] = hashed
+        outputs.append((hashed, data, original_size))
+        # The unhashed name keeps serving references we can't rewrite (e.g. built in JS)
+        outputs.append((path, data if same_format else read(path), original_size))
+
+    for path in stages['raster']:
+        original = read(path)
+        extension = posixpath.splitext(path)[1].lower()
+        data, new_extension = optimize_image(original, extension)
+        emit(path, data, len(original), new_extension, same_format=new_extension == extension)
+    for path in stages['other']:
+        data = read(path)
+        emit(path, data, len(data))
+    # CSS after images so url() references can point at the hashed names
+    for path in stages['css']:
+        original = read(path)
+        css = rewrite_css_urls(original.decode('utf-8'), posixpath.dirname(path), manifest)
+        emit(path, minify_css(css).encode('utf-8'), len(original))
+    for path in stages['js']:
+        original = read(path)
+        emit(path, minify_js(original.decode('utf-8')).encode('utf-8'), len(original))
+    for path in stages['html']:
+        original = read(path)
+        html = rewrite_html(original.decode('utf-8'), posixpath.dirname(path), manifest)
+        outputs.append((path, html.encode('utf-8'), len(original)))
+
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    totals = {'source': 0, 'output': 0, 'compressed_saving': 0}
+    for path, data, original_size in outputs:
+        target = write(out_dir, path, data)
+        saving = 0
+        if posixpath.splitext(path)[1].lower() in TEXT_EXTENSIONS:
+            saving = precompress(target, data)
+        if path not in manifest:
+            # Count each asset once: under its hashed name, or as the page itself
+            totals['source'] += original_size
+            totals['output'] += len(data)
+            totals['compressed_saving'] += saving
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest, totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--out', default='dist', help='output directory (replaced on every build)')
+    args = parser.parse_args()
+
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    out_dir = os.path.abspath(args.out)
+    if out_dir == source_dir or any(out_dir == os.path.join(source_dir, root) for root in ROOTS):
+        parser.error('--out must be a separate directory')
+    if Image is None:
+        print('Pillow not installed: images are copied without recompression')
+    if brotli is None:
+        print('brotli not installed: only .gz variants are written')
+
+    manifest, totals = build(source_dir, out_dir)
+    print(f"{len(manifest)} assets fingerprinted into {out_dir}")
+    print(f"{totals['source'] / 1024:.0f} KB of sources -> {totals['output'] / 1024:.0f} KB "
+          f"({totals['compressed_saving'] / 1024:.0f} KB less again when sent precompressed)")
+
+
+if __name__ == '__main__':
+    main()
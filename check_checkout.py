@@ -0,0 +1,115 @@
+"""
+Concurrent checkout check.
+
+Starts several worker processes against one database, the way gunicorn runs
+the app, and has all of them submit the same /api/place-order request with
+one Idempotency-Key at the same moment. Unlike bench_checkout.py, whose
+threads share one process and one connection pool, each worker here has its
+own pool, so duplicates race on SQLite itself. Exits non-zero unless every
+key wrote exactly one order, every worker got that order back, and reusing a
+key for a different cart is refused with 422.
+
+Usage:
+    python check_checkout.py [--workers 8] [--rounds 10]
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import uuid
+
+EMAIL = 'check@example.com'
+PASSWORD = 'check-password'
+PAYLOAD = {
+    'items': [{'product_id': 1, 'quantity': 2}, {'product_id': 2, 'quantity': 1}],
+    'payment_method': 'cod'
+}
+
+
+def populate(db_path, product_count=5):
+    conn = sqlite3.connect(db_path)
+    for i in range(product_count):
+        conn.execute('''
+            INSERT INTO products (title, category, gender, price, description, volume, longevity)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (f'Perfume {i}', 'Perfume', 'Unisex', 1999.0, 'Check product', '100ml', '8h'))
+    conn.commit()
+    conn.close()
+
+
+def login(app):
+    client = app.test_client()
+    response = client.post('/api/login', json={'email': EMAIL, 'password': PASSWORD})
+    assert response.status_code == 200, response.get_json()
+    return client
+
+
+def worker(db_path, keys, barrier, results):
+    os.environ['FAJR_DB'] = db_path
+    import server
+    client = login(server.app)
+    for key in keys:
+        barrier.wait()
+        response = client.post('/api/place-order', json=PAYLOAD, headers={'Idempotency-Key': key})
+        body = response.get_json() or {}
+        results.put((key, os.getpid(), response.status_code, body.get('order_id')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fajr-check-')
+    db_path = os.path.join(workdir, 'check.db')
+    os.environ['FAJR_DB'] = db_path
+
+    import server  # imported after FAJR_DB is set so init_db() targets the temp file
+    populate(db_path)
+    server.app.test_client().post('/api/register', json={
+        'first_name': 'Check', 'last_name': 'User', 'email': EMAIL, 'password': PASSWORD
+    })
+
+    # spawn, not fork: each worker imports the app and opens its own connections
+    context = multiprocessing.get_context('spawn')
+    keys = [str(uuid.uuid4()) for _ in range(args.rounds)]
+    barrier = context.Barrier(args.workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(db_path, keys, barrier, results))
+                 for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    submits = [results.get(timeout=120) for _ in range(args.workers * args.rounds)]
+    for process in processes:
+        process.join()
+
+    failures = []
+    if any(process.exitcode for process in processes):
+        failures.append('a worker process failed')
+    for key in keys:
+        answers = [(status, order_id) for submitted, _, status, order_id in submits if submitted == key]
+        if {status for status, _ in answers} != {200} or len({order_id for _, order_id in answers}) != 1:
+            failures.append(f'key {key}: {sorted(answers, key=str)}')
+
+    conn = sqlite3.connect(db_path)
+    order_count = conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+    conn.close()
+    if order_count != args.rounds:
+        failures.append(f'expected {args.rounds} orders, found {order_count}')
+
+    conflict = login(server.app).post('/api/place-order', json=dict(PAYLOAD, payment_method='razorpay'),
+                                      headers={'Idempotency-Key': keys[0]})
+    if conflict.status_code != 422:
+        failures.append(f'reused key for a different cart returned {conflict.status_code}')
+
+    print(f'{args.workers} worker processes x {args.rounds} keys: {order_count} orders written')
+    for failure in failures:
+        print(f'FAIL {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -583,13 +583,6 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 });
 
-// Helper to force-refresh images by appending a timestamp
-function withCacheBust(url) {
-    if (!url) return url;
-    const sep = url.includes('?') ? '&' : '?';
-    return url + sep + 't=' + Date.now();
-}
-
 // Product Details Page Initialization
 function initProductDetails() {
     // Get product ID from URL
@@ -674,7 +667,7 @@ function displayProductDetails(product) {
         const productDetailsHTML = `
             <div class="product-images">
                 <div class="main-image">
-                    <img src="${withCacheBust(product.image_url)}" alt="${product.title}" class="product-main-image">
+                    ${productImageHTML(product, PRODUCT_DETAIL_IMAGE_SIZES, `alt="${product.title}" class="product-main-image"`)}
                 </div>
             </div>
             <div class="product-info">
@@ -745,14 +738,14 @@ function displayProductDetails(product) {
             
             if (existingProduct) {
                 existingProduct.quantity += quantity;
-                // ensure latest image is used
-                existingProduct.image = withCacheBust(product.image_url);
+                // ensure latest image version is used
+                existingProduct.image = product.image_url;
             } else {
                 cart.push({
                     id: productId,
                     title: product.title,
                     price: product.price,
-                    image: withCacheBust(product.image_url),
+                    image: product.image_url,
                     quantity: quantity
                 });
             }
@@ -811,6 +804,11 @@ function showNotification(message) {
     }, 3000);
 }
 
+// Number of products requested per page on the perfumes page
+const PRODUCTS_PAGE_SIZE = 24;
+// Number of products shown in the featured section
+const FEATURED_PRODUCTS_COUNT = 4;
+
 // Function to load featured products on the index page
 function loadFeaturedProducts() {
     const featuredProductsContainer = document.getElementById('featured-products-container');
@@ -819,8 +817,8 @@ function loadFeaturedProducts() {
     // Show loading state
     featuredProductsContainer.innerHTML = '<div class="loading">Loading products...</div>';
     
-    // Fetch products from API
-    fetch('/api/products')
+    // Fetch only the products the featured section shows
+    fetch(`/api/products?limit=${FEATURED_PRODUCTS_COUNT}`)
         .then(response => response.json())
         .then(data => {
             const products = Array.isArray(data) ? data : (data.products || []);
@@ -828,10 +826,7 @@ function loadFeaturedProducts() {
                 // Clear loading state
                 featuredProductsContainer.innerHTML = '';
                 
-                // Display only the first 3 products for featured section
-                const featuredProducts = products.slice(0, 3);
-                
-                featuredProducts.forEach(product => {
+                products.forEach(product => {
                     const productCard = createProductCard(product);
                     featuredProductsContainer.appendChild(productCard);
                 });
@@ -845,41 +840,100 @@ function loadFeaturedProducts() {
         });
 }
 
-// Function to load all products on the perfumes page
-function loadAllProducts() {
+// Function to load all products on the perfumes page, one page at a time.
+// Filtering by gender happens on the server; pass append=true for the next page.
+const productListState = { gender: 'all', cursor: null, loading: false, requestId: 0 };
+
+function loadAllProducts(append = false) {
     const productsContainer = document.getElementById('products-container');
     if (!productsContainer) return;
+    if (productListState.loading || (append && !productListState.cursor)) return;
+    productListState.loading = true;
+    // Responses from superseded requests (e.g. after a filter change) are ignored
+    const requestId = ++productListState.requestId;
     
-    // Show loading state
-    productsContainer.innerHTML = '<div class="loading">Loading products...</div>';
+    if (!append) {
+        // Show loading state
+        productsContainer.innerHTML = '<div class="loading">Loading products...</div>';
+        productListState.cursor = null;
+        setupGenderFilter(productsContainer);
+    }
     
-    // Fetch products from API
-    fetch('/api/products')
+    const params = new URLSearchParams({ limit: String(PRODUCTS_PAGE_SIZE) });
+    if (productListState.gender !== 'all') {
+        params.set('gender', productListState.gender);
+    }
+    if (append) {
+        params.set('cursor', productListState.cursor);
+    }
+    
+    fetch(`/api/products?${params.toString()}`)
         .then(response => response.json())
         .then(data => {
+            if (requestId !== productListState.requestId) return;
             const products = Array.isArray(data) ? data : (data.products || []);
-            if (products.length > 0) {
+            productListState.cursor = data.next_cursor || null;
+            
+            if (!append) {
                 // Clear loading state
                 productsContainer.innerHTML = '';
-                
-                // Display all products
-                products.forEach(product => {
-                    const productCard = createProductCard(product);
-                    productsContainer.appendChild(productCard);
-                });
-                
-                // Set up gender filter functionality
-                setupGenderFilter(products, productsContainer);
-            } else {
-                productsContainer.innerHTML = '<div class="no-products">No products available at the moment.</div>';
+                if (products.length === 0) {
+                    productsContainer.innerHTML = '<div class="no-products">No products available at the moment.</div>';
+                }
             }
+            
+            products.forEach(product => {
+                const productCard = createProductCard(product);
+                productsContainer.appendChild(productCard);
+            });
+            updateLoadMoreButton(productsContainer);
         })
         .catch(error => {
+            if (requestId !== productListState.requestId) return;
             console.error('Error fetching products:', error);
             productsContainer.innerHTML = '<div class="error">Failed to load products. Please try again later.</div>';
+        })
+        .finally(() => {
+            if (requestId === productListState.requestId) {
+                productListState.loading = false;
+            }
         });
 }
 
+// Show a "Load more" button below the grid while the server has more pages
+function updateLoadMoreButton(container) {
+    let button = document.getElementById('load-more-products');
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'load-more-products';
+        button.className = 'filter-btn';
+        button.textContent = 'Load more';
+        button.style.display = 'block';
+        button.style.margin = '30px auto 0';
+        button.addEventListener('click', () => loadAllProducts(true));
+        container.insertAdjacentElement('afterend', button);
+    }
+    button.hidden = !productListState.cursor;
+}
+
+// Rendered widths of product images, matching the grid breakpoints in responsive.css
+const PRODUCT_CARD_IMAGE_SIZES = '(max-width: 575px) 100vw, (max-width: 991px) 50vw, (max-width: 1199px) 320px, 300px';
+const PRODUCT_DETAIL_IMAGE_SIZES = '(max-width: 991px) 100vw, 50vw';
+
+// Product image markup: a <picture> with WebP/JPEG srcsets once the server has
+// resized derivatives, otherwise a plain <img> of the original
+function productImageHTML(product, sizes, attributes) {
+    const src = product.image_url || 'img/placeholder.svg';
+    const srcset = product.image_srcset;
+    if (!srcset) {
+        return `<img src="${src}" ${attributes}>`;
+    }
+    return `<picture>
+            <source type="image/webp" srcset="${srcset.webp}" sizes="${sizes}">
+            <img src="${src}" srcset="${srcset.jpeg}" sizes="${sizes}" ${attributes}>
+        </picture>`;
+}
+
 // Function to create a product card element
 function createProductCard(product) {
     const productCard = document.createElement('article');
@@ -897,7 +951,7 @@ function createProductCard(product) {
     
     productCard.innerHTML = `
         <div class="product-image">
-            <img src="${product.image_url || 'img/placeholder.svg'}" alt="${product.title || 'Product'}" loading="lazy">
+            ${productImageHTML(product, PRODUCT_CARD_IMAGE_SIZES, `alt="${product.title || 'Product'}" loading="lazy"`)}
             <div class="product-overlay">
                 <a href="product-details.html?id=${product.id}" class="overlay-btn">View Details</a>
             </div>
@@ -941,9 +995,10 @@ function genderLabel(key) {
 }
 
 // Function to set up gender filter on perfumes page
-function setupGenderFilter(products, container) {
+function setupGenderFilter(container) {
     const filterButtons = document.querySelectorAll('.gender-filter .filter-btn');
-    if (!filterButtons.length) return;
+    if (!filterButtons.length || container.dataset.genderFilterBound) return;
+    container.dataset.genderFilterBound = 'true';
     
     filterButtons.forEach(button => {
         button.addEventListener('click', function() {
@@ -955,17 +1010,10 @@ function setupGenderFilter(products, container) {
             this.classList.add('active');
             this.setAttribute('aria-pressed', 'true');
             
-            const gender = this.getAttribute('data-gender');
-            // Filter products
-            const productCards = container.querySelectorAll('.product-card');
-            productCards.forEach(card => {
-                const key = card.getAttribute('data-gender');
-                if (gender === 'all' || key === gender) {
-                    card.style.display = 'block';
-                } else {
-                    card.style.display = 'none';
-                }
-            });
+            // Reload the first page for the selected gender
+            productListState.gender = this.getAttribute('data-gender') || 'all';
+            productListState.loading = false;
+            loadAllProducts();
         });
     });
 }
@@ -1009,7 +1057,7 @@ function initCart() {
         el.className = 'cart-item';
         el.setAttribute('data-id', item.id);
         el.setAttribute('data-unit-price', String(unitPrice));
-        const imgSrc = item.image && item.image.includes('/api/product-image/') ? withCacheBust(item.image) : item.image;
+        const imgSrc = item.image;
         el.innerHTML = `
             <div class="custom-checkbox item-checkbox"></div>
             <img src="${imgSrc}" alt="${item.title}" class="cart-item-image">
@@ -1,122 +1,2297 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash, send_from_directory
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, session, flash, send_file, send_from_directory, g, has_app_context, has_request_context
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
 from flask_cors import CORS
+from werkzeug.datastructures import CallbackDict
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.utils import safe_join
+import click
 import sqlite3
 import os
+import sys
+import atexit
+import gzip
+import logging
+import logging.handlers
+import queue
 import hashlib
+import hmac
 import secrets
 import random
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import re
 from urllib.parse import urlparse, parse_qs
 import base64
+import html
+import io
+import json
+import math
 import mimetypes
+import itertools
+import bisect
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__, static_folder='client', static_url_path='')
 CORS(app, supports_credentials=True)
-app.secret_key = secrets.token_hex(16)
+app.secret_key = os.environ.get('FAJR_SECRET_KEY') or secrets.token_hex(16)
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
 app.config['SESSION_COOKIE_SAMESITE'] = None
 
-# --- Database Setup ---
-def get_db_connection():
+# --- Logging ---
+# Request threads only filter a record and put it on a bounded queue; a
+# listener thread per worker formats and writes it, so slow stdout never
+# stalls a request. Debug calls pass %-style arguments and are discarded by
+# the level check before any formatting unless FAJR_LOG_LEVEL=DEBUG.
+LOG_LEVEL = os.environ.get('FAJR_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('FAJR_LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.environ.get('FAJR_LOG_QUEUE_SIZE', '10000'))
+# Fraction of requests per endpoint whose below-WARNING records are kept,
+# e.g. FAJR_LOG_SAMPLING="login=0.1,place_order=0.5"
+LOG_SAMPLING = {
+    endpoint.strip(): float(rate)
+    for endpoint, _, rate in (item.partition('=') for item in os.environ.get('FAJR_LOG_SAMPLING', '').split(','))
+    if endpoint.strip() and rate.strip()
+}
+# Structured fields (logger.info(..., extra={...})) whose values are never written
+LOG_REDACTED_FIELDS = frozenset({
+    'password', 'password_hash', 'new_password', 'token', 'secret',
+    'authorization', 'cookie', 'session_id', 'idempotency_key',
+})
+LOG_REDACTED_PATTERN = re.compile(r'(?i)\b(password(?:_hash)?|token|secret|authorization|cookie)(\s*[=:]\s*)\S+')
+LOG_RECORD_FIELDS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+class LogContextFilter(logging.Filter):
+    """Samples per endpoint, adds the request context and redacts credentials"""
+
+    def filter(self, record):
+        if has_request_context():
+            endpoint = request.endpoint
+            if record.levelno < logging.WARNING and endpoint in LOG_SAMPLING:
+                # One decision per request, so a sampled request keeps all its records
+                sampled = g.get('_log_sampled')
+                if sampled is None:
+                    sampled = g._log_sampled = random.random() < LOG_SAMPLING[endpoint]
+                if not sampled:
+                    return False
+            record.endpoint = endpoint
+            record.method = request.method
+            record.path = request.path
+            record.remote_addr = request.remote_addr
+        for field in LOG_REDACTED_FIELDS.intersection(vars(record)):
+            setattr(record, field, '[REDACTED]')
+        record.msg = LOG_REDACTED_PATTERN.sub(r'\1\2[REDACTED]', record.getMessage())
+        record.args = None
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line, including any structured extra fields"""
+
+    def format(self, record):
+        created = datetime.fromtimestamp(record.created, timezone.utc)
+        entry = {
+            'ts': created.isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in LOG_RECORD_FIELDS)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: when the queue is full the record is dropped and counted"""
+
+    def __init__(self, target, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._pid = None
+
+    def _ensure_listener(self):
+        # Started lazily, and again in each worker after a fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(self.queue.maxsize)
+                self._listener = logging.handlers.QueueListener(self.queue, self.target)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Keep the traceback as its own field; formatting happens on the listener
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Flush what is queued; registered to run at exit"""
+        if self._listener is not None and self._pid == os.getpid():
+            try:
+                self._listener.stop()
+            except queue.Full:
+                pass  # no room for the stop sentinel; the daemon thread dies with us
+            self._listener = None
+            self._pid = None
+
+logger = logging.getLogger('fajr')
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+_log_output = logging.StreamHandler(sys.stdout)
+_log_output.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json'
+                         else logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+log_handler = QueueLogHandler(_log_output, LOG_QUEUE_SIZE)
+log_handler.addFilter(LogContextFilter())
+logger.addHandler(log_handler)
+atexit.register(log_handler.stop)
+
+# --- Request Metrics ---
+# Per-endpoint latency, status and in-flight counts plus the time each request
+# spends in SQLite and waiting for a pooled connection, served at /metrics in
+# the Prometheus text format. Under gunicorn, point FAJR_METRICS_DIR at a
+# directory shared by the workers (emptied before the server starts): each
+# worker writes its values there and /metrics sums them.
+METRICS_DIR = os.environ.get('FAJR_METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 1.0
+# name -> (type, help)
+METRICS = {
+    'fajr_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status code'),
+    'fajr_http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint'),
+    'fajr_http_requests_in_flight': ('gauge', 'HTTP requests currently being served'),
+    'fajr_db_seconds': ('histogram', 'Time per request spent inside SQLite calls'),
+    'fajr_db_statements_total': ('counter', 'SQL statements executed while serving requests'),
+    'fajr_db_pool_wait_seconds': ('histogram', 'Time per request spent waiting for a pooled connection'),
+    'fajr_compression_input_bytes_total': ('counter', 'Response bytes before compression, by endpoint and encoding'),
+    'fajr_compression_output_bytes_total': ('counter', 'Response bytes sent after compression, by endpoint and encoding'),
+    'fajr_compression_cpu_seconds_total': ('counter', 'CPU time spent compressing responses, by endpoint and encoding'),
+}
+METRIC_BUCKETS = {
+    'fajr_http_request_duration_seconds': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    'fajr_db_seconds': (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+    'fajr_db_pool_wait_seconds': (0.0001, 0.001, 0.01, 0.1, 1.0, 5.0),
+}
+
+class RequestDBTiming(threading.local):
+    """SQLite time for the request this thread is serving"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seconds = 0.0
+        self.statements = 0
+        self.pool_wait = 0.0
+
+db_timing = RequestDBTiming()
+
+def trace_statement(sql):
+    """sqlite3 trace callback: fires as each statement (including BEGIN/COMMIT) starts"""
+    db_timing.statements += 1
+
+def timed_db_call(method):
+    """Wrap a sqlite3 method so the time spent inside it counts toward db_timing"""
+    def timed(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            db_timing.seconds += time.perf_counter() - start
+    timed.__name__ = method.__name__
+    return timed
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor whose execute and fetch calls are timed, since rows are produced lazily"""
+    execute = timed_db_call(sqlite3.Cursor.execute)
+    executemany = timed_db_call(sqlite3.Cursor.executemany)
+    executescript = timed_db_call(sqlite3.Cursor.executescript)
+    fetchone = timed_db_call(sqlite3.Cursor.fetchone)
+    fetchmany = timed_db_call(sqlite3.Cursor.fetchmany)
+    fetchall = timed_db_call(sqlite3.Cursor.fetchall)
+    __next__ = timed_db_call(sqlite3.Cursor.__next__)
+
+def process_alive(pid):
     try:
-        conn = sqlite3.connect('fajr.db', timeout=30.0)
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def format_metric_labels(labels):
+    """{key="value",...} with the exposition format's escaping"""
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+class MetricsRegistry:
+    """Counters, gauges and histograms for this worker, optionally shared through a directory"""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # (name, labels) -> number, or per-bucket counts followed by the sum for histograms
+        self._values = {}
+        self._next_flush = 0.0
+
+    def _add(self, name, labels, value):
+        key = (name, labels)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def _observe(self, name, labels, value):
+        key = (name, labels)
+        buckets = METRIC_BUCKETS[name]
+        counts = self._values.get(key)
+        if counts is None:
+            counts = self._values[key] = [0] * (len(buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+    def request_started(self, endpoint):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()  # forked after import: the parent's values are not ours
+            self._add('fajr_http_requests_in_flight', (('endpoint', endpoint),), 1)
+
+    def request_finished(self, endpoint, method, status, duration, timing):
+        labels = (('endpoint', endpoint),)
+        with self._lock:
+            self._add('fajr_http_requests_in_flight', labels, -1)
+            self._add('fajr_http_requests_total', labels + (('method', method), ('status', str(status))), 1)
+            self._observe('fajr_http_request_duration_seconds', labels, duration)
+            self._observe('fajr_db_seconds', labels, timing.seconds)
+            self._add('fajr_db_statements_total', labels, timing.statements)
+            self._observe('fajr_db_pool_wait_seconds', labels, timing.pool_wait)
+        if self.directory and time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def response_compressed(self, endpoint, encoding, size, encoded_size, cpu_seconds):
+        labels = (('endpoint', endpoint), ('encoding', encoding))
+        with self._lock:
+            self._add('fajr_compression_input_bytes_total', labels, size)
+            self._add('fajr_compression_output_bytes_total', labels, encoded_size)
+            self._add('fajr_compression_cpu_seconds_total', labels, cpu_seconds)
+
+    def flush(self):
+        """Write this worker's values to <directory>/<pid>.json (atomically)"""
+        if not self.directory or self._pid != os.getpid():
+            return
+        with self._lock:
+            self._next_flush = time.monotonic() + METRICS_FLUSH_INTERVAL
+            snapshot = {'pid': self._pid, 'values': [[name, labels, value] for (name, labels), value in self._values.items()]}
+        path = os.path.join(self.directory, f'{self._pid}.json')
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning('Could not write metrics to %s: %s', path, e)
+
+    def _snapshots(self):
+        if not self.directory:
+            with self._lock:
+                yield self._pid, [[name, labels, value] for (name, labels), value in self._values.items()]
+            return
+        self.flush()
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield snapshot['pid'], snapshot['values']
+
+    def collect(self):
+        """Sum every worker's values; gauges only count workers that are still running"""
+        merged = {}
+        for pid, values in self._snapshots():
+            alive = pid == os.getpid() or process_alive(pid)
+            for name, labels, value in values:
+                if name not in METRICS or (METRICS[name][0] == 'gauge' and not alive):
+                    continue
+                key = (name, tuple(tuple(label) for label in labels))
+                if isinstance(value, list):
+                    total = merged.setdefault(key, [0] * len(value))
+                    merged[key] = [a + b for a, b in zip(total, value)]
+                else:
+                    merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        merged = self.collect()
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(merged.items()):
+                if metric != name:
+                    continue
+                if kind != 'histogram':
+                    lines.append(f'{name}{format_metric_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(METRIC_BUCKETS[name] + ('+Inf',), value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_metric_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_count{format_metric_labels(labels)} {cumulative}')
+                lines.append(f'{name}_sum{format_metric_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+request_metrics = MetricsRegistry(METRICS_DIR)
+if METRICS_DIR:
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    atexit.register(request_metrics.flush)
+
+def start_request_clock(wsgi_app):
+    """Start the duration and DB timing before Flask opens the session, so its lookup is counted"""
+    def timed_wsgi_app(environ, start_response):
+        environ['fajr.request_start'] = time.perf_counter()
+        db_timing.reset()
+        return wsgi_app(environ, start_response)
+    return timed_wsgi_app
+
+app.wsgi_app = start_request_clock(app.wsgi_app)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.endpoint or 'unmatched'
+    g.metrics_start = request.environ.get('fajr.request_start', time.perf_counter())
+    request_metrics.request_started(g.metrics_endpoint)
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    # Runs after the response (and session) is saved, so that work is included
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        request_metrics.request_finished(g.metrics_endpoint, request.method, g.get('metrics_status', 500),
+                                         time.perf_counter() - start, db_timing)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape target, summed over all workers when FAJR_METRICS_DIR is set"""
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# --- Database Setup ---
+DATABASE = os.environ.get('FAJR_DB', 'fajr.db')
+
+DB_POOL_SIZE = int(os.environ.get('FAJR_DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.environ.get('FAJR_DB_POOL_TIMEOUT', '30'))
+
+# Applied once when a pooled connection is opened
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL;',       # Better concurrent access
+    'PRAGMA busy_timeout=30000;',
+    'PRAGMA synchronous=NORMAL;',     # Safe with WAL, avoids an fsync per commit
+    'PRAGMA cache_size=-16000;',      # 16 MB page cache per connection
+    'PRAGMA mmap_size=268435456;',    # 256 MB memory-mapped reads
+    'PRAGMA temp_store=MEMORY;',
+)
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.checked_out = False
+        self.request_scoped = False
+
+    def close(self):
+        # Request-scoped connections are returned when the app context tears down
+        if self.request_scoped:
+            return
+        self.pool.release(self)
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # The C shortcuts build a plain cursor; route them through the timed one
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    commit = timed_db_call(sqlite3.Connection.commit)
+    rollback = timed_db_call(sqlite3.Connection.rollback)
+
+    def discard(self):
+        super().close()
+
+class ConnectionPool:
+    """Bounded per-process pool of SQLite connections, safe across threads"""
+
+    def __init__(self, database, size, timeout):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._created = 0
+        self._stats = {
+            'checkouts': 0, 'waits': 0, 'timeouts': 0, 'connections_opened': 0,
+            'total_wait_ms': 0.0, 'max_wait_ms': 0.0
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=30.0, check_same_thread=False,
+                               factory=PooledConnection)
         conn.row_factory = sqlite3.Row
-        # Enable WAL mode for better concurrent access
-        conn.execute('PRAGMA journal_mode=WAL;')
-        # Set busy timeout
-        conn.execute('PRAGMA busy_timeout=30000;')
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        conn.set_trace_callback(trace_statement)
+        conn.pool = self
         return conn
+
+    def acquire(self):
+        """Check out a connection, waiting up to `timeout` seconds for one to free up"""
+        if os.getpid() != self._pid:
+            # Forked (e.g. gunicorn --preload): never share SQLite handles with the parent
+            self._reset()
+        start = time.perf_counter()
+        conn = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                remaining = self.timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise sqlite3.OperationalError('Timed out waiting for a database connection')
+                self._cond.wait(remaining)
+            wait_ms = (time.perf_counter() - start) * 1000
+            self._stats['checkouts'] += 1
+            if wait_ms >= 1:
+                self._stats['waits'] += 1
+            self._stats['total_wait_ms'] += wait_ms
+            self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+        db_timing.pool_wait += wait_ms / 1000
+        if conn is None:
+            try:
+                conn = self._connect()
+            except sqlite3.Error:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats['connections_opened'] += 1
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back anything left uncommitted"""
+        if not conn.checked_out:
+            return
+        conn.checked_out = False
+        conn.request_scoped = False
+        if conn.pool is not self or os.getpid() != self._pid:
+            conn.discard()
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.discard()
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'pid': self._pid,
+                'size': self.size,
+                'open': self._created,
+                'idle': len(self._idle),
+                'in_use': self._created - len(self._idle),
+                'avg_wait_ms': stats['total_wait_ms'] / stats['checkouts'] if stats['checkouts'] else 0.0
+            })
+        return stats
+
+db_pool = ConnectionPool(DATABASE, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+
+def get_db_connection():
+    """Return a pooled connection.
+
+    Inside a request the same connection is reused until the app context tears
+    down, so handlers that open several connections only check out one.
+    """
+    try:
+        if has_app_context():
+            conn = g.get('db')
+            if conn is None:
+                conn = db_pool.acquire()
+                conn.request_scoped = True
+                g.db = conn
+            return conn
+        return db_pool.acquire()
     except sqlite3.Error as e:
-        print(f"Database connection error: {e}")
+        logger.error('Database connection error: %s', e)
+        raise
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+def normalize_gender(gender):
+    """Map free-text gender to 'him' / 'her' / 'unisex' (mirrors normalizeGender in script.js)"""
+    s = re.sub(r'[^a-z]', '', str(gender or '').lower())
+    if 'him' in s or s in ('male', 'men') or 'boy' in s:
+        return 'him'
+    if 'her' in s or s in ('female', 'women') or 'girl' in s:
+        return 'her'
+    return 'unisex'
+
+# --- Sales Rollups ---
+# Order count and revenue per (period, order_status), plus the same split by
+# product and by gender and category, kept in step with the orders table
+# inside the same transaction as every order write. Gender and category are
+# the product's at order time, snapshotted onto each order line.
+SALES_ROLLUPS = (
+    # (table, period column, SQL naming the period that contains a created_at value)
+    ('sales_daily', 'day', "substr({}, 1, 10)"),
+    ('sales_weekly', 'week', "date(substr({}, 1, 10), '-6 days', 'weekday 1')"),  # Monday of the week
+    ('sales_monthly', 'month', "substr({}, 1, 7)"),
+)
+PRODUCT_SALES_ROLLUPS = (
+    ('sales_product_daily', 'day', "substr({}, 1, 10)"),
+    ('sales_product_weekly', 'week', "date(substr({}, 1, 10), '-6 days', 'weekday 1')"),
+    ('sales_product_monthly', 'month', "substr({}, 1, 7)"),
+)
+GROUP_SALES_ROLLUPS = (
+    ('sales_group_daily', 'day', "substr({}, 1, 10)"),
+    ('sales_group_weekly', 'week', "date(substr({}, 1, 10), '-6 days', 'weekday 1')"),
+    ('sales_group_monthly', 'month', "substr({}, 1, 7)"),
+)
+# Order lines keyed by every group they fall in: (order_id, dimension, group_key, quantity, line_total)
+ORDER_LINE_GROUPS_SQL = '''
+    SELECT order_id, 'gender' AS dimension, COALESCE(gender_key, 'unknown') AS group_key, quantity, line_total
+    FROM order_items WHERE product_id IS NOT NULL {where}
+    UNION ALL
+    SELECT order_id, 'category', COALESCE(category, 'Uncategorized'), quantity, line_total
+    FROM order_items WHERE product_id IS NOT NULL {where}
+'''
+
+def record_sales(cursor, created_at, order_status, order_delta, revenue_delta):
+    """Add (or, with negative deltas, remove) orders from every rollup period they fall in"""
+    for table, column, period in SALES_ROLLUPS:
+        cursor.execute(f'''
+            INSERT INTO {table} ({column}, order_status, order_count, revenue)
+            VALUES ({period.format('?')}, ?, ?, ROUND(?, 2))
+            ON CONFLICT ({column}, order_status) DO UPDATE SET
+                order_count = order_count + excluded.order_count,
+                revenue = ROUND(revenue + excluded.revenue, 2)
+        ''', (str(created_at), order_status or 'pending', order_delta, revenue_delta or 0))
+
+def record_order_sales(cursor, order, sign, order_status=None):
+    """Apply one order (id, created_at, order_status, total_amount) to every rollup.
+
+    sign=-1 removes it; order_status overrides the status it is counted under.
+    Its items must still be in order_items.
+    """
+    order_status = order_status or order['order_status'] or 'pending'
+    record_sales(cursor, order['created_at'], order_status, sign, sign * (order['total_amount'] or 0))
+    lines = cursor.execute('''
+        SELECT product_id, SUM(quantity), SUM(line_total) FROM order_items
+        WHERE order_id = ? AND product_id IS NOT NULL
+        GROUP BY product_id
+    ''', (order['id'],)).fetchall()
+    for table, column, period in PRODUCT_SALES_ROLLUPS:
+        cursor.executemany(f'''
+            INSERT INTO {table} ({column}, order_status, product_id, order_count, units, revenue)
+            VALUES ({period.format('?')}, ?, ?, ?, ?, ROUND(?, 2))
+            ON CONFLICT ({column}, order_status, product_id) DO UPDATE SET
+                order_count = order_count + excluded.order_count,
+                units = units + excluded.units,
+                revenue = ROUND(revenue + excluded.revenue, 2)
+        ''', [(str(order['created_at']), order_status, product_id, sign, sign * units, sign * (revenue or 0))
+              for product_id, units, revenue in lines])
+    # One order counts once in each group it has lines in, however many lines that is
+    groups = cursor.execute(f'''
+        SELECT dimension, group_key, SUM(quantity), SUM(line_total)
+        FROM ({ORDER_LINE_GROUPS_SQL.format(where='AND order_id = ?')})
+        GROUP BY 1, 2
+    ''', (order['id'], order['id'])).fetchall()
+    for table, column, period in GROUP_SALES_ROLLUPS:
+        cursor.executemany(f'''
+            INSERT INTO {table} ({column}, order_status, dimension, group_key, order_count, units, revenue)
+            VALUES ({period.format('?')}, ?, ?, ?, ?, ?, ROUND(?, 2))
+            ON CONFLICT ({column}, order_status, dimension, group_key) DO UPDATE SET
+                order_count = order_count + excluded.order_count,
+                units = units + excluded.units,
+                revenue = ROUND(revenue + excluded.revenue, 2)
+        ''', [(str(order['created_at']), order_status, dimension, group_key, sign, sign * units,
+               sign * (revenue or 0)) for dimension, group_key, units, revenue in groups])
+
+def replace_rollup(cursor, table, columns, key_length, expected_sql):
+    """Overwrite a rollup table with expected_sql's rows; returns how many rows differed"""
+    expected = {tuple(row[:key_length]): tuple(row[key_length:]) for row in cursor.execute(expected_sql).fetchall()}
+    actual = {tuple(row[:key_length]): tuple(row[key_length:]) for row in cursor.execute(
+        f'SELECT {", ".join(columns)} FROM {table} WHERE order_count != 0').fetchall()}
+    mismatched = sum(1 for key in expected.keys() | actual.keys() if expected.get(key) != actual.get(key))
+    
+    cursor.execute(f'DELETE FROM {table}')
+    cursor.executemany(f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                       [key + value for key, value in expected.items()])
+    return mismatched
+
+def rebuild_sales_rollups(cursor, rollups=SALES_ROLLUPS):
+    """Recompute the order-level rollup rows from the orders table; returns how many rows were wrong"""
+    mismatched = 0
+    for table, column, period in rollups:
+        mismatched += replace_rollup(cursor, table, (column, 'order_status', 'order_count', 'revenue'), 2, f'''
+            SELECT {period.format('created_at')}, COALESCE(order_status, 'pending'),
+                   COUNT(*), ROUND(COALESCE(SUM(total_amount), 0), 2)
+            FROM orders
+            GROUP BY 1, 2
+        ''')
+    return mismatched
+
+def rebuild_product_sales_rollups(cursor, rollups=PRODUCT_SALES_ROLLUPS):
+    """Recompute the per-product rollup rows from orders and order_items; returns how many rows were wrong"""
+    mismatched = 0
+    for table, column, period in rollups:
+        columns = (column, 'order_status', 'product_id', 'order_count', 'units', 'revenue')
+        mismatched += replace_rollup(cursor, table, columns, 3, f'''
+            SELECT {period.format('o.created_at')}, COALESCE(o.order_status, 'pending'), i.product_id,
+                   COUNT(DISTINCT o.id), SUM(i.quantity), ROUND(COALESCE(SUM(i.line_total), 0), 2)
+            FROM order_items i
+            JOIN orders o ON o.id = i.order_id
+            WHERE i.product_id IS NOT NULL
+            GROUP BY 1, 2, 3
+        ''')
+    return mismatched
+
+def rebuild_group_sales_rollups(cursor, rollups=GROUP_SALES_ROLLUPS):
+    """Recompute the gender/category rollup rows from orders and order_items; returns how many rows were wrong"""
+    mismatched = 0
+    for table, column, period in rollups:
+        columns = (column, 'order_status', 'dimension', 'group_key', 'order_count', 'units', 'revenue')
+        mismatched += replace_rollup(cursor, table, columns, 4, f'''
+            SELECT {period.format('o.created_at')}, COALESCE(o.order_status, 'pending'), g.dimension, g.group_key,
+                   COUNT(DISTINCT o.id), SUM(g.quantity), ROUND(COALESCE(SUM(g.line_total), 0), 2)
+            FROM ({ORDER_LINE_GROUPS_SQL.format(where='')}) g
+            JOIN orders o ON o.id = g.order_id
+            GROUP BY 1, 2, 3, 4
+        ''')
+    return mismatched
+
+@app.cli.command('rebuild-sales-rollups')
+def rebuild_sales_rollups_command():
+    """Reconcile the sales rollup tables against the raw orders."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        mismatched = (rebuild_sales_rollups(cursor) + rebuild_product_sales_rollups(cursor)
+                      + rebuild_group_sales_rollups(cursor))
+        conn.commit()
+    except Exception:
+        conn.rollback()
         raise
+    finally:
+        conn.close()
+    click.echo(f"Sales rollups rebuilt; {mismatched} row(s) were out of date")
+
+# --- Schema Migrations ---
+# Each migration runs exactly once per database, in version order, and is
+# recorded in schema_migrations. Add new schema changes as new entries at the
+# end of MIGRATIONS; never edit one that has already shipped.
+def column_exists(cursor, table, column):
+    return any(row[1] == column for row in cursor.execute(f'PRAGMA table_info({table})').fetchall())
+
+def add_column_if_missing(cursor, table, column, definition):
+    if not column_exists(cursor, table, column):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def migration_initial_schema(cursor):
+    # Create users table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        email TEXT NOT NULL,
+        phone TEXT,
+        gender TEXT,
+        date_of_birth TEXT,
+        password_hash TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    
+    # Create products table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, category TEXT NOT NULL,
+        gender TEXT NOT NULL, price REAL NOT NULL, description TEXT NOT NULL, image_url TEXT,
+        fragrance_family TEXT, volume TEXT, concentration TEXT, longevity TEXT,
+        image_data BLOB, image_filename TEXT, image_mimetype TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    
+    # Create orders table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        total_amount REAL NOT NULL,
+        order_status TEXT DEFAULT 'pending',
+        payment_id TEXT,
+        product_id INTEGER,
+        quantity INTEGER DEFAULT 1,
+        price REAL,
+        product_title TEXT,
+        product_image TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )''')
+    
+    # Create addresses table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS addresses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        street_address TEXT NOT NULL,
+        landmark TEXT,
+        city TEXT NOT NULL,
+        state TEXT NOT NULL,
+        postal_code TEXT NOT NULL,
+        country TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        is_default BOOLEAN DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''')
+
+def migration_product_images(cursor):
+    # Image bytes are kept apart so catalog reads never touch BLOBs
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS product_images (
+        product_id INTEGER PRIMARY KEY,
+        image_data BLOB NOT NULL,
+        image_filename TEXT,
+        image_mimetype TEXT,
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )''')
+    
+    # Move any images still stored inline on products into product_images
+    cursor.execute('''
+        INSERT OR REPLACE INTO product_images (product_id, image_data, image_filename, image_mimetype)
+        SELECT id, image_data, image_filename, image_mimetype FROM products WHERE image_data IS NOT NULL
+    ''')
+    cursor.execute('UPDATE products SET image_data = NULL WHERE image_data IS NOT NULL')
+
+def migration_catalog_meta(cursor):
+    # Catalog version counter, bumped by every admin product write
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS catalog_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )''')
+    cursor.execute('INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 0)')
+
+def migration_product_image_hash(cursor):
+    # Content hash of the current product image, used for immutable image URLs
+    add_column_if_missing(cursor, 'products', 'image_hash', 'TEXT')
+    missing = cursor.execute('''
+        SELECT i.product_id, i.image_data FROM product_images i
+        JOIN products p ON p.id = i.product_id
+        WHERE p.image_hash IS NULL
+    ''').fetchall()
+    for product_id, image_data in missing:
+        cursor.execute('UPDATE products SET image_hash = ? WHERE id = ?',
+                       (hashlib.sha256(image_data).hexdigest(), product_id))
+
+def migration_missing_columns(cursor):
+    # Columns the routes already read or write but the original schema lacked
+    add_column_if_missing(cursor, 'users', 'preferred_fragrance', 'TEXT')
+    add_column_if_missing(cursor, 'orders', 'payment_method', 'TEXT')
+    add_column_if_missing(cursor, 'orders', 'payment_status', "TEXT DEFAULT 'pending'")
+    add_column_if_missing(cursor, 'orders', 'address_id', 'INTEGER')
+    # Databases created by older releases have title/first_name/last_name/apartment
+    # addresses; newer ones have name/landmark. Make sure both sets exist.
+    add_column_if_missing(cursor, 'addresses', 'title', 'TEXT')
+    add_column_if_missing(cursor, 'addresses', 'first_name', 'TEXT')
+    add_column_if_missing(cursor, 'addresses', 'last_name', 'TEXT')
+    add_column_if_missing(cursor, 'addresses', 'apartment', 'TEXT')
+    add_column_if_missing(cursor, 'addresses', 'name', 'TEXT')
+    add_column_if_missing(cursor, 'addresses', 'landmark', 'TEXT')
+
+def create_unique_index(cursor, name, table, columns, where=''):
+    """Create a unique index, falling back to a plain one if existing rows collide"""
+    try:
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table} ({columns}) {where}')
+    except sqlite3.IntegrityError:
+        logger.warning('Duplicate values in %s(%s); creating non-unique index %s', table, columns, name)
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns}) {where}')
+
+def migration_secondary_indexes(cursor):
+    # Empty phones would collide in the unique index below
+    cursor.execute("UPDATE users SET phone = NULL WHERE phone = ''")
+    create_unique_index(cursor, 'idx_users_email', 'users', 'email')
+    create_unique_index(cursor, 'idx_users_phone', 'users', 'phone', 'WHERE phone IS NOT NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_created_at ON products (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_product_id ON orders (product_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (order_status, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_addresses_user_default ON addresses (user_id, is_default, created_at)')
+
+def migration_orders_product_created_index(cursor):
+    # Lets the admin order list filter by product while keeping keyset order
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_product_created ON orders (product_id, created_at)')
+    cursor.execute('DROP INDEX IF EXISTS idx_orders_product_id')
+
+def migration_product_gender_key(cursor):
+    # Normalized gender ('him' / 'her' / 'unisex') so storefront filters can use an index
+    add_column_if_missing(cursor, 'products', 'gender_key', 'TEXT')
+    for product_id, gender in cursor.execute('SELECT id, gender FROM products').fetchall():
+        cursor.execute('UPDATE products SET gender_key = ? WHERE id = ?', (normalize_gender(gender), product_id))
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_gender_price ON products (gender_key, price)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_gender_created ON products (gender_key, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category, price)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_price ON products (price)')
+
+def migration_products_fts(cursor):
+    # Full-text index over the searchable product fields, kept in sync by triggers
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        title, description, fragrance_family, concentration, category,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts (rowid, title, description, fragrance_family, concentration, category)
+        VALUES (new.id, new.title, new.description, new.fragrance_family, new.concentration, new.category);
+    END''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, title, description, fragrance_family, concentration, category)
+        VALUES ('delete', old.id, old.title, old.description, old.fragrance_family, old.concentration, old.category);
+    END''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS products_fts_update
+    AFTER UPDATE OF title, description, fragrance_family, concentration, category ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, title, description, fragrance_family, concentration, category)
+        VALUES ('delete', old.id, old.title, old.description, old.fragrance_family, old.concentration, old.category);
+        INSERT INTO products_fts (rowid, title, description, fragrance_family, concentration, category)
+        VALUES (new.id, new.title, new.description, new.fragrance_family, new.concentration, new.category);
+    END''')
+    cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+def migration_related_products(cursor):
+    # Precomputed top-N related products per product, ordered by rank
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS related_products (
+        product_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        related_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY (product_id, rank)
+    ) WITHOUT ROWID''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_related_products_related ON related_products (related_id)')
+    # Products whose related list must be recomputed
+    cursor.execute('CREATE TABLE IF NOT EXISTS related_dirty (product_id INTEGER PRIMARY KEY)')
+    cursor.execute('INSERT OR IGNORE INTO related_dirty (product_id) SELECT id FROM products')
+
+def format_shipping_address(address):
+    """Multi-line shipping label for an addresses row, or None"""
+    if not address:
+        return None
+    address_dict = dict(address)
+    address_parts = []
+    
+    if address_dict.get('name'):
+        address_parts.append(f"Name: {address_dict['name']}")
+    
+    if address_dict.get('street_address'):
+        address_parts.append(address_dict['street_address'])
+    
+    if address_dict.get('landmark'):
+        address_parts.append(f"Near {address_dict['landmark']}")
+    
+    city_state = []
+    if address_dict.get('city'):
+        city_state.append(address_dict['city'])
+    if address_dict.get('state'):
+        city_state.append(address_dict['state'])
+    if city_state:
+        address_parts.append(', '.join(city_state))
+    
+    if address_dict.get('postal_code'):
+        address_parts.append(f"PIN: {address_dict['postal_code']}")
+    
+    if address_dict.get('country'):
+        address_parts.append(address_dict['country'])
+    
+    if address_dict.get('phone'):
+        address_parts.append(f"Phone: {address_dict['phone']}")
+    
+    return '\n'.join(address_parts) or None
+
+def find_shipping_address(cursor, user_id, address_id=None):
+    """The chosen address if it belongs to the user, else their default, else their latest"""
+    address = None
+    if address_id:
+        address = cursor.execute('SELECT * FROM addresses WHERE id = ? AND user_id = ?',
+                                 (address_id, user_id)).fetchone()
+    if not address:
+        address = cursor.execute('''
+            SELECT * FROM addresses WHERE user_id = ?
+            ORDER BY is_default DESC, created_at DESC LIMIT 1
+        ''', (user_id,)).fetchone()
+    return address
+
+def migration_order_items(cursor):
+    """Split orders into order headers and order_items, snapshotting product and address data.
+
+    Every existing row becomes a one-item order under its original id.
+    """
+    cursor.execute('''
+    CREATE TABLE orders_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        total_amount REAL NOT NULL,
+        item_count INTEGER NOT NULL DEFAULT 1,
+        order_status TEXT DEFAULT 'pending',
+        payment_method TEXT,
+        payment_status TEXT DEFAULT 'pending',
+        payment_id TEXT,
+        address_id INTEGER,
+        shipping_address TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''')
+    cursor.execute('''
+    CREATE TABLE order_items (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER NOT NULL,
+        product_id INTEGER,
+        product_title TEXT NOT NULL,
+        image_hash TEXT,
+        unit_price REAL NOT NULL,
+        quantity INTEGER NOT NULL,
+        line_total REAL NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders (id),
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )''')
+    
+    cursor.execute('''
+        INSERT INTO orders_new (id, user_id, total_amount, item_count, order_status, payment_method,
+                                payment_status, payment_id, address_id, created_at)
+        SELECT id, user_id, total_amount, 1, order_status, payment_method,
+               payment_status, payment_id, address_id, created_at
+        FROM orders
+    ''')
+    cursor.execute('''
+        INSERT INTO order_items (order_id, product_id, product_title, image_hash, unit_price, quantity, line_total)
+        SELECT o.id, o.product_id, COALESCE(p.title, o.product_title, 'Unknown Product'), p.image_hash,
+               COALESCE(o.price, o.total_amount / MAX(COALESCE(o.quantity, 1), 1), 0),
+               COALESCE(o.quantity, 1), o.total_amount
+        FROM orders o
+        LEFT JOIN products p ON p.id = o.product_id
+    ''')
+    # Old orders never stored an address: freeze what their detail page showed
+    labels = {}
+    for order_id, user_id, address_id in cursor.execute('SELECT id, user_id, address_id FROM orders').fetchall():
+        key = (user_id, address_id)
+        if key not in labels:
+            labels[key] = format_shipping_address(find_shipping_address(cursor, user_id, address_id))
+        if labels[key]:
+            cursor.execute('UPDATE orders_new SET shipping_address = ? WHERE id = ?', (labels[key], order_id))
+    
+    sequence = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'orders'").fetchone()
+    cursor.execute('DROP TABLE orders')
+    cursor.execute('ALTER TABLE orders_new RENAME TO orders')
+    if sequence:
+        # Never hand out an id that belonged to a deleted order
+        current = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'orders'").fetchone()
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'orders'")
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('orders', ?)",
+                       (max(sequence[0], current[0] if current else 0),))
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (order_status, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items (product_id, order_id)')
+
+def migration_idempotency_keys(cursor):
+    """Checkout idempotency keys, scoped per user"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id INTEGER NOT NULL,
+        idempotency_key TEXT NOT NULL,
+        request_hash TEXT NOT NULL,
+        order_id INTEGER NOT NULL,
+        total_amount REAL NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, idempotency_key)
+    ) WITHOUT ROWID''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)')
+
+def migration_sales_rollups(cursor):
+    """Daily and monthly order count / revenue rollups by status"""
+    # Tables are named here rather than taken from SALES_ROLLUPS, which has grown since
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        day TEXT NOT NULL,
+        order_status TEXT NOT NULL,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, order_status)
+    ) WITHOUT ROWID''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sales_monthly (
+        month TEXT NOT NULL,
+        order_status TEXT NOT NULL,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, order_status)
+    ) WITHOUT ROWID''')
+    rebuild_sales_rollups(cursor, [rollup for rollup in SALES_ROLLUPS if rollup[0] in ('sales_daily', 'sales_monthly')])
+
+def migration_report_rollups(cursor):
+    """Weekly order rollup and per-product daily/weekly/monthly rollups for reporting"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sales_weekly (
+        week TEXT NOT NULL,
+        order_status TEXT NOT NULL,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (week, order_status)
+    ) WITHOUT ROWID''')
+    for table, column in (('sales_product_daily', 'day'), ('sales_product_weekly', 'week'),
+                          ('sales_product_monthly', 'month')):
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            {column} TEXT NOT NULL,
+            order_status TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY ({column}, order_status, product_id)
+        ) WITHOUT ROWID''')
+    rebuild_sales_rollups(cursor, [rollup for rollup in SALES_ROLLUPS if rollup[0] == 'sales_weekly'])
+    rebuild_product_sales_rollups(cursor, [rollup for rollup in PRODUCT_SALES_ROLLUPS if rollup[0] in (
+        'sales_product_daily', 'sales_product_weekly', 'sales_product_monthly')])
+
+def migration_sessions(cursor):
+    """Server-side session store"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sessions (
+        sid TEXT PRIMARY KEY,
+        data BLOB NOT NULL,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)')
+
+def migration_rate_limits(cursor):
+    """Token buckets shared across workers (FAJR_RATE_LIMIT_BACKEND=sqlite)"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        bucket TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        allowed INTEGER NOT NULL DEFAULT 1
+    ) WITHOUT ROWID''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rate_limits_updated_at ON rate_limits (updated_at)')
+
+def migration_image_store(cursor):
+    """Keep image metadata on products; bytes move to the file store (flask migrate-images)"""
+    cursor.execute('''
+        UPDATE products SET
+            image_filename = (SELECT i.image_filename FROM product_images i WHERE i.product_id = products.id),
+            image_mimetype = (SELECT i.image_mimetype FROM product_images i WHERE i.product_id = products.id)
+        WHERE id IN (SELECT product_id FROM product_images)
+    ''')
+
+def migration_image_derivatives(cursor):
+    """Resized WebP/JPEG renditions of each stored image, plus the widths ready per product"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS image_derivatives (
+        image_hash TEXT NOT NULL,
+        format TEXT NOT NULL,
+        width INTEGER NOT NULL,
+        derivative_hash TEXT NOT NULL,
+        byte_size INTEGER NOT NULL,
+        PRIMARY KEY (image_hash, format, width)
+    ) WITHOUT ROWID''')
+    # NULL: not processed yet; '': no derivatives (not decodable); else e.g. '160,320,640'
+    add_column_if_missing(cursor, 'products', 'image_widths', 'TEXT')
+
+def migration_related_dirty_generation(cursor):
+    """Count re-marks, so a refresh computed outside the write lock can tell it went stale"""
+    add_column_if_missing(cursor, 'related_dirty', 'generation', 'INTEGER NOT NULL DEFAULT 0')
+
+def migration_group_sales_rollups(cursor):
+    """Gender and category on each order line, and daily/weekly/monthly rollups per group"""
+    add_column_if_missing(cursor, 'order_items', 'gender_key', 'TEXT')
+    add_column_if_missing(cursor, 'order_items', 'category', 'TEXT')
+    # Existing lines take the product's group as it is now; the best that can be recovered
+    cursor.execute('''
+        UPDATE order_items SET
+            gender_key = (SELECT p.gender_key FROM products p WHERE p.id = order_items.product_id),
+            category = (SELECT p.category FROM products p WHERE p.id = order_items.product_id)
+        WHERE product_id IS NOT NULL
+    ''')
+    for table, column in (('sales_group_daily', 'day'), ('sales_group_weekly', 'week'),
+                          ('sales_group_monthly', 'month')):
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            {column} TEXT NOT NULL,
+            order_status TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            group_key TEXT NOT NULL,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY ({column}, order_status, dimension, group_key)
+        ) WITHOUT ROWID''')
+    rebuild_group_sales_rollups(cursor, [rollup for rollup in GROUP_SALES_ROLLUPS if rollup[0] in (
+        'sales_group_daily', 'sales_group_weekly', 'sales_group_monthly')])
+
+MIGRATIONS = [
+    (1, 'initial_schema', migration_initial_schema),
+    (2, 'product_images', migration_product_images),
+    (3, 'catalog_meta', migration_catalog_meta),
+    (4, 'product_image_hash', migration_product_image_hash),
+    (5, 'missing_columns', migration_missing_columns),
+    (6, 'secondary_indexes', migration_secondary_indexes),
+    (7, 'orders_product_created_index', migration_orders_product_created_index),
+    (8, 'product_gender_key', migration_product_gender_key),
+    (9, 'products_fts', migration_products_fts),
+    (10, 'related_products', migration_related_products),
+    (11, 'order_items', migration_order_items),
+    (12, 'idempotency_keys', migration_idempotency_keys),
+    (13, 'sales_rollups', migration_sales_rollups),
+    (14, 'report_rollups', migration_report_rollups),
+    (15, 'sessions', migration_sessions),
+    (16, 'rate_limits', migration_rate_limits),
+    (17, 'image_store', migration_image_store),
+    (18, 'image_derivatives', migration_image_derivatives),
+    (19, 'related_dirty_generation', migration_related_dirty_generation),
+    (20, 'group_sales_rollups', migration_group_sales_rollups),
+]
 
 def init_db():
+    """Apply any pending migrations.
+
+    Runs under BEGIN IMMEDIATE so that when several gunicorn workers start at
+    once, one applies the migrations and the others see them as done.
+    """
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        
-        # Create users table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            email TEXT NOT NULL,
-            phone TEXT,
-            gender TEXT,
-            date_of_birth TEXT,
-            password_hash TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-        
-        # Create products table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, category TEXT NOT NULL,
-            gender TEXT NOT NULL, price REAL NOT NULL, description TEXT NOT NULL, image_url TEXT,
-            fragrance_family TEXT, volume TEXT, concentration TEXT, longevity TEXT,
-            image_data BLOB, image_filename TEXT, image_mimetype TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-        
-        # Create orders table
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            total_amount REAL NOT NULL,
-            order_status TEXT DEFAULT 'pending',
-            payment_id TEXT,
-            product_id INTEGER,
-            quantity INTEGER DEFAULT 1,
-            price REAL,
-            product_title TEXT,
-            product_image TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (product_id) REFERENCES products (id)
-        )''')
-        
-        # Create addresses table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS addresses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
             name TEXT NOT NULL,
-            street_address TEXT NOT NULL,
-            landmark TEXT,
-            city TEXT NOT NULL,
-            state TEXT NOT NULL,
-            postal_code TEXT NOT NULL,
-            country TEXT NOT NULL,
-            phone TEXT NOT NULL,
-            is_default BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )''')
+        conn.commit()
         
+        cursor.execute('BEGIN IMMEDIATE')
+        applied = {row[0] for row in cursor.execute('SELECT version FROM schema_migrations').fetchall()}
+        pending = [m for m in MIGRATIONS if m[0] not in applied]
+        for version, name, migrate in pending:
+            migrate(cursor)
+            cursor.execute('INSERT INTO schema_migrations (version, name) VALUES (?, ?)', (version, name))
+            logger.info('Applied migration %s: %s', version, name)
         conn.commit()
-        print("Database initialized successfully")
+        if pending:
+            logger.info('Database initialized successfully')
     except Exception as e:
-        print(f"Database initialization error: {e}")
+        logger.exception('Database initialization error')
         if conn:
             conn.rollback()
         raise
     finally:
-        if conn:
-            conn.close()
+        if conn:
+            conn.close()
+
+init_db()
+
+# --- Server-side Sessions ---
+# The cookie carries only a random session id and the data lives in a shared
+# store, so every gunicorn worker (and every deploy) sees the same sessions.
+# Stores speak the Redis subset get/setex/delete: SQLiteSessionStore is the
+# local stand-in, and FAJR_SESSION_BACKEND=redis plugs in a redis-py client.
+SESSION_BACKEND = os.environ.get('FAJR_SESSION_BACKEND', 'sqlite')
+SESSION_CACHE_SIZE = 10000
+SESSION_CACHE_TTL = float(os.environ.get('FAJR_SESSION_CACHE_TTL', 5))
+SESSION_SWEEP_INTERVAL = 300
+SESSION_SWEEP_BATCH = 1000
+# Session writes run after the request already holds a connection from db_pool
+SESSION_DB_POOL_SIZE = 2
+SESSION_KEY_PREFIX = 'session:'
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{32,64}$')
+
+class SQLiteSessionStore:
+    """Redis-style get/setex/delete over the sessions table.
+
+    Reads go through a per-process LRU that trusts an entry for cache_ttl
+    seconds; this process's own writes update it immediately, so a logout on
+    another worker is seen here within cache_ttl. Expired rows are ignored on
+    read and swept in batches from the write path. Writes commit on their own
+    small pool, so they neither wait on db_pool nor commit the request's work.
+    """
+
+    def __init__(self, cache_size=SESSION_CACHE_SIZE, cache_ttl=SESSION_CACHE_TTL,
+                 sweep_interval=SESSION_SWEEP_INTERVAL, pool_size=SESSION_DB_POOL_SIZE):
+        self.pool = ConnectionPool(DATABASE, pool_size, DB_POOL_TIMEOUT)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # key -> (value or None, expires_at, cached_at)
+        self._next_sweep = 0.0
+        self._stats = {'cache_hits': 0, 'cache_misses': 0, 'writes': 0, 'deletes': 0, 'swept': 0}
+
+    def _remember(self, name, value, expires_at, now):
+        with self._lock:
+            self._cache[name] = (value, expires_at, now)
+            self._cache.move_to_end(name)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def get(self, name):
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(name)
+            if entry and now - entry[2] < self.cache_ttl:
+                self._cache.move_to_end(name)
+                self._stats['cache_hits'] += 1
+                return entry[0] if entry[1] > now else None
+            self._stats['cache_misses'] += 1
+        conn = get_db_connection()
+        try:
+            row = conn.execute('SELECT data, expires_at FROM sessions WHERE sid = ?', (name,)).fetchone()
+        finally:
+            conn.close()
+        value, expires_at = (bytes(row[0]), row[1]) if row and row[1] > now else (None, 0.0)
+        self._remember(name, value, expires_at, now)
+        return value
+
+    def setex(self, name, time_, value):
+        seconds = time_.total_seconds() if isinstance(time_, timedelta) else time_
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        now = time.time()
+        expires_at = now + seconds
+        conn = self.pool.acquire()
+        try:
+            conn.execute('''
+                INSERT INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (sid) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+            ''', (name, value, expires_at))
+            self._sweep(conn, now)
+            conn.commit()
+        finally:
+            conn.close()
+        self._remember(name, value, expires_at, now)
+        with self._lock:
+            self._stats['writes'] += 1
+        return True
+
+    def delete(self, *names):
+        conn = self.pool.acquire()
+        try:
+            deleted = sum(conn.execute('DELETE FROM sessions WHERE sid = ?', (name,)).rowcount for name in names)
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            for name in names:
+                self._cache.pop(name, None)
+            self._stats['deletes'] += deleted
+        return deleted
+
+    def _sweep(self, conn, now):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        swept = conn.execute('''
+            DELETE FROM sessions WHERE sid IN (
+                SELECT sid FROM sessions WHERE expires_at <= ? LIMIT ?
+            )
+        ''', (now, SESSION_SWEEP_BATCH)).rowcount
+        with self._lock:
+            self._stats['swept'] += swept
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, cached=len(self._cache), pool=self.pool.stats())
+
+def create_session_store(backend=SESSION_BACKEND):
+    if backend == 'sqlite':
+        return SQLiteSessionStore()
+    if backend == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('FAJR_SESSION_BACKEND=redis requires the redis package (pip install redis)')
+        return redis.Redis.from_url(os.environ.get('FAJR_REDIS_URL', 'redis://localhost:6379/0'))
+    raise ValueError(f'Unknown FAJR_SESSION_BACKEND: {backend}')
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, stale=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.stale = stale  # past half its lifetime: rewrite to keep it alive
+        self.modified = False
+        self.loaded_user_id = super().get('user_id')
+        # Like SecureCookieSession: only responses that read the session vary on Cookie
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface backed by a Redis-style key/value store"""
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSideSession
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID_PATTERN.match(sid):
+            payload = self.store.get(SESSION_KEY_PREFIX + sid)
+            if payload is not None:
+                try:
+                    envelope = self.serializer.loads(payload.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError):
+                    envelope = None
+                if envelope:
+                    age = time.time() - envelope['written_at']
+                    stale = age > app.permanent_session_lifetime.total_seconds() / 2
+                    return self.session_class(envelope['data'], sid=sid, stale=stale)
+        return self.session_class(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+        
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(SESSION_KEY_PREFIX + session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite)
+            return
+        # Stale sessions are only renewed by requests that use them, so public
+        # (shared-cacheable) responses never carry a Set-Cookie
+        if not (session.modified or (session.stale and session.accessed)):
+            return
+        
+        if not session.new and session.get('user_id') != session.loaded_user_id:
+            # Signing in or switching user: issue a fresh id so a pre-login cookie can't be fixed
+            self.store.delete(SESSION_KEY_PREFIX + session.sid)
+            session.sid = secrets.token_urlsafe(32)
+        lifetime = app.permanent_session_lifetime
+        payload = self.serializer.dumps({'written_at': time.time(), 'data': dict(session)})
+        self.store.setex(SESSION_KEY_PREFIX + session.sid, int(lifetime.total_seconds()), payload)
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=secure, samesite=samesite)
+
+session_store = create_session_store()
+app.session_interface = ServerSideSessionInterface(session_store)
+
+# --- HTTP Caching Policy ---
+# Cache-Control values per route class. FAJR_CACHE_POLICY selects the set;
+# individual values can be overridden through app.config['CACHE_CONTROL'].
+CACHE_POLICIES = {
+    'development': {
+        'static': 'no-cache',
+        'immutable': 'no-cache',
+        'html': 'no-cache',
+        'catalog': 'no-cache',
+        'private': 'private, no-store',
+    },
+    'production': {
+        'static': 'public, max-age=86400',
+        'immutable': 'public, max-age=31536000, immutable',
+        'html': 'no-cache',
+        'catalog': 'public, max-age=60, stale-while-revalidate=300',
+        'private': 'private, no-store',
+    },
+}
+
+app.config['CACHE_POLICY'] = os.environ.get('FAJR_CACHE_POLICY', 'production')
+app.config['CACHE_CONTROL'] = dict(CACHE_POLICIES[app.config['CACHE_POLICY']])
+
+STATIC_ENDPOINTS = {'static', 'index', 'serve_admin_files'}
+# Content-hashed names written by build_assets.py (style.3f2a9c01de.css)
+FINGERPRINTED_ASSET = re.compile(r'\.[0-9a-f]{10}\.\w+$')
+PUBLIC_CATALOG_ENDPOINTS = {'get_products', 'get_product', 'search_products_route', 'get_related_products'}
+# Endpoints that set their own Cache-Control (e.g. content-hashed images)
+SELF_CACHED_ENDPOINTS = {'get_product_image'}
+
+def cache_class_for(response):
+    """Return the caching route class for the current request, or None to leave headers alone"""
+    endpoint = request.endpoint
+    if endpoint in SELF_CACHED_ENDPOINTS and response.status_code in (200, 304):
+        return None
+    if response.status_code not in (200, 304):
+        return 'private'
+    if endpoint in STATIC_ENDPOINTS:
+        if FINGERPRINTED_ASSET.search(request.path):
+            return 'immutable'
+        return 'html' if response.mimetype == 'text/html' else 'static'
+    if endpoint in PUBLIC_CATALOG_ENDPOINTS:
+        return 'catalog'
+    return 'private'
+
+# --- Response Compression ---
+# JSON and text responses of at least COMPRESSION_MIN_BYTES are sent gzip- or
+# brotli-encoded when Accept-Encoding allows. Responses built only from the
+# catalog snapshot are the same for every client at a given catalog version,
+# so their encoded bodies are cached per version instead of being recompressed
+# on every hit.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.environ.get('FAJR_COMPRESSION_MIN_BYTES', 1024))
+# On-the-fly levels are capped: the top levels (brotli 10-11 especially) cost
+# several times the CPU for a few percent less on the wire
+GZIP_LEVEL = min(max(int(os.environ.get('FAJR_GZIP_LEVEL', 6)), 1), 9)
+BROTLI_QUALITY = min(max(int(os.environ.get('FAJR_BROTLI_QUALITY', 4)), 0), 9)
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/plain', 'text/html', 'text/csv'}
+COMPRESSED_BODY_CACHE_SIZE = 256
+# Only endpoints whose body is fully determined by catalog_meta.version. Related
+# products are left out: orders change them without a version bump.
+VERSIONED_CATALOG_ENDPOINTS = {'get_products', 'get_product', 'search_products_route'}
+
+COMPRESSORS = {'gzip': lambda data: gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)}
+if brotli is not None:
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+# Server preference when the client accepts several at the same quality
+COMPRESSION_ENCODINGS = [encoding for encoding in ('br', 'gzip') if encoding in COMPRESSORS]
+
+class CompressedBodyCache:
+    """Encoded catalog bodies for the newest catalog version seen, LRU-bounded"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._version = None
+        self._bodies = OrderedDict()
+
+    def get(self, version, key):
+        with self._lock:
+            if version != self._version:
+                return None
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+            return body
+
+    def put(self, version, key, body):
+        with self._lock:
+            if self._version is not None and version < self._version:
+                return  # built from a snapshot that has since been replaced
+            if version != self._version:
+                self._version = version
+                self._bodies.clear()
+            self._bodies[key] = body
+            if len(self._bodies) > self.max_entries:
+                self._bodies.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
+
+compressed_bodies = CompressedBodyCache(COMPRESSED_BODY_CACHE_SIZE)
+
+def compress_response(response):
+    """Encode the response body for the client's Accept-Encoding when it is worth it"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(COMPRESSION_ENCODINGS)
+    if encoding is None:
+        return response
+    version = g.get('catalog_version') if request.endpoint in VERSIONED_CATALOG_ENDPOINTS else None
+    key = (request.full_path, encoding)
+    body = compressed_bodies.get(version, key) if version is not None else None
+    cpu_seconds = 0.0
+    if body is None:
+        start = time.thread_time()
+        body = COMPRESSORS[encoding](data)
+        cpu_seconds = time.thread_time() - start
+        if version is not None:
+            compressed_bodies.put(version, key, body)
+    if len(body) >= len(data):
+        return response
+    request_metrics.response_compressed(request.endpoint or 'unmatched', encoding, len(data), len(body), cpu_seconds)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# --- Helper Functions ---
+def row_get(row, key, default=None):
+    try:
+        return row[key] if key in row.keys() else default
+    except:
+        return default
+
+# --- Keyset Pagination ---
+# Cursors are opaque base64 tokens over the (created_at, id) sort key, so each
+# page is one index range scan no matter how deep into the history it is.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Counting stops here; beyond it the total is reported as a lower bound
+COUNT_HINT_LIMIT = 10000
+
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor, *types):
+    """Decode a cursor produced by encode_cursor into one value per type, raising ValueError if malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError('Invalid cursor')
+    for value, kind in zip(values, types):
+        # bool is an int subclass, but never a sort key
+        if isinstance(value, bool) or not isinstance(value, kind):
+            raise ValueError('Invalid cursor')
+    return values
+
+def parse_page_size(value):
+    """Parse a ?limit= value, clamped to MAX_PAGE_SIZE"""
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    limit = int(value)
+    if limit <= 0:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+def count_hint(cursor, from_where, params):
+    """Count matching rows up to COUNT_HINT_LIMIT; returns (count, capped)"""
+    count = cursor.execute(
+        f'SELECT COUNT(*) FROM (SELECT 1 {from_where} LIMIT {COUNT_HINT_LIMIT + 1})', params
+    ).fetchone()[0]
+    return min(count, COUNT_HINT_LIMIT), count > COUNT_HINT_LIMIT
+
+# --- Catalog Read Layer ---
+# Columns needed to render product JSON. Image bytes live in the image store and
+# are only read by the image endpoint, so listing cost scales with product count.
+PRODUCT_LIST_COLUMNS = (
+    'id', 'title', 'category', 'gender', 'price', 'description',
+    'fragrance_family', 'volume', 'concentration', 'longevity', 'image_hash', 'image_widths', 'created_at'
+)
+
+def fetch_catalog(conn, where='', params=()):
+    """Fetch product rows projected to PRODUCT_LIST_COLUMNS"""
+    query = f"SELECT {', '.join(PRODUCT_LIST_COLUMNS)} FROM products {where}"
+    return conn.execute(query, params).fetchall()
+
+def product_to_dict(product):
+    """Build the public JSON representation of a projected product row"""
+    return {
+        'id': product['id'],
+        'title': product['title'],
+        'category': product['category'],
+        'gender': product['gender'],
+        'price': product['price'],
+        'description': product['description'],
+        'image_url': product_image_url(product['id'], product['image_hash']),
+        'image_srcset': product_image_srcset(product['id'], product['image_hash'], product['image_widths']),
+        'fragrance_family': product['fragrance_family'],
+        'volume': product['volume'],
+        'concentration': product['concentration'],
+        'longevity': product['longevity'],
+        'is_new': False  # You can add logic to determine if product is new
+    }
+
+# Image URLs carry a prefix of the content hash, so a new upload yields a new URL
+# and the old one can be cached forever by browsers and CDNs.
+IMAGE_HASH_URL_LENGTH = 16
+
+def product_image_url(product_id, image_hash):
+    """Build the versioned image URL for a product"""
+    if not image_hash:
+        return f"/api/product-image/{product_id}"
+    return f"/api/product-image/{product_id}?v={image_hash[:IMAGE_HASH_URL_LENGTH]}"
+
+def product_image_srcset(product_id, image_hash, image_widths):
+    """srcset strings per derivative format, or None until derivatives exist"""
+    if not image_hash or not image_widths:
+        return None
+    url = product_image_url(product_id, image_hash)
+    widths = image_widths.split(',')
+    return {
+        image_format: ', '.join(f'{url}&size={width}&format={image_format} {width}w' for width in widths)
+        for image_format in IMAGE_DERIVATIVE_FORMATS
+    }
+
+def save_product_image(cursor, product_id, image_hash, image_filename, image_mimetype):
+    """Point a product at an image already in the store (see store_uploaded_image)"""
+    # Derivatives are rendered afterwards by the background worker (schedule_image_derivatives)
+    cursor.execute('''
+        UPDATE products SET image_hash = ?, image_filename = ?, image_mimetype = ?, image_widths = NULL WHERE id = ?
+    ''', (image_hash, image_filename, image_mimetype, product_id))
+    # Drop any BLOB left over from before the file store
+    cursor.execute('DELETE FROM product_images WHERE product_id = ?', (product_id,))
+
+# --- Image Store ---
+# Image bytes are files named by their SHA-256 under FAJR_IMAGE_DIR, so the
+# database only holds the hash and a re-upload of the same image is free.
+# Files are written to a temp name and renamed into place, and never change
+# once written. Images are served with send_file (sendfile() under gunicorn),
+# or handed to nginx when FAJR_IMAGE_ACCEL_PREFIX names an internal location:
+#     location /_images/ { internal; alias /path/to/product-images/; }
+IMAGE_STORE_DIR = os.environ.get('FAJR_IMAGE_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(DATABASE)), 'product-images')
+IMAGE_ACCEL_PREFIX = os.environ.get('FAJR_IMAGE_ACCEL_PREFIX')
+# Uploads are copied into the store in chunks, so memory per upload stays flat;
+# the request body as a whole is capped by MAX_CONTENT_LENGTH (413 beyond it)
+MAX_IMAGE_UPLOAD_BYTES = int(float(os.environ.get('FAJR_MAX_UPLOAD_MB', '10')) * 1024 * 1024)
+UPLOAD_CHUNK_SIZE = 64 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGE_UPLOAD_BYTES + 64 * 1024  # room for the other form fields
+# Unreferenced files younger than this are kept by --prune (uploads not yet committed)
+IMAGE_PRUNE_GRACE_SECONDS = 3600
+
+class ImageUploadError(ValueError):
+    """An upload that is not an acceptable image; the message is shown to the admin"""
+
+class ContentAddressedStore:
+    """Immutable files keyed by SHA-256, fanned out as <root>/<2 hex>/<digest>"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def relative_path(self, digest):
+        return f'{digest[:2]}/{digest}'
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    def put(self, data):
+        """Write data (if not already stored) and return its digest"""
+        return self.put_stream([data])[0]
+
+    def put_stream(self, chunks, max_bytes=None):
+        """Write byte chunks to a temp file while hashing them, then rename it into place.
+
+        Returns (digest, size); raises ImageUploadError past max_bytes.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        sha256 = hashlib.sha256()
+        size = 0
+        tmp = tempfile.NamedTemporaryFile(dir=self.root, prefix='upload-', suffix='.tmp', delete=False)
+        try:
+            with tmp:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise ImageUploadError(f'Image is larger than the {max_bytes / (1024 * 1024):g} MB limit')
+                    sha256.update(chunk)
+                    tmp.write(chunk)
+            digest = sha256.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                os.unlink(tmp.name)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp.name, path)
+        except BaseException:
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+            raise
+        return digest, size
+
+    def digests(self):
+        """Yield (digest, mtime) for every stored file"""
+        if not os.path.isdir(self.root):
+            return
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    yield entry.name, entry.stat().st_mtime
+
+    def delete(self, digest):
+        try:
+            os.unlink(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+image_store = ContentAddressedStore(IMAGE_STORE_DIR)
+
+def sniff_image_type(head):
+    """MIME type from an image's leading bytes, or None if it isn't a format we accept"""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def store_uploaded_image(file):
+    """Stream an uploaded file into the image store; returns (image_hash, mimetype)"""
+    head = file.stream.read(16)
+    mimetype = sniff_image_type(head)
+    if mimetype is None:
+        raise ImageUploadError('Invalid file type. Please upload a PNG, JPEG, GIF or WebP image.')
+    chunks = itertools.chain([head], iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b''))
+    image_hash, _ = image_store.put_stream(chunks, MAX_IMAGE_UPLOAD_BYTES)
+    return image_hash, mimetype
+
+def upload_too_large_response():
+    return jsonify({'success': False,
+                    'message': f'Upload too large (max {MAX_IMAGE_UPLOAD_BYTES / (1024 * 1024):g} MB)'}), 413
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    return upload_too_large_response()
+
+def image_file_response(image_hash, mimetype, filename):
+    """Response for a stored image: X-Accel-Redirect for nginx, otherwise send_file"""
+    if IMAGE_ACCEL_PREFIX:
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = IMAGE_ACCEL_PREFIX.rstrip('/') + '/' + image_store.relative_path(image_hash)
+    else:
+        response = send_file(image_store.path(image_hash), mimetype=mimetype, etag=False, conditional=False)
+    response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
+    return response
+
+@app.cli.command('migrate-images')
+@click.option('--batch-size', default=50, show_default=True, help='Images moved per transaction.')
+@click.option('--prune', is_flag=True, help='Also delete stored files no product refers to.')
+@click.option('--vacuum', is_flag=True, help='VACUUM afterwards to give the BLOB pages back to the filesystem.')
+def migrate_images_command(batch_size, prune, vacuum):
+    """Move product image BLOBs out of the database into the image store."""
+    conn = get_db_connection()
+    moved = 0
+    try:
+        while True:
+            # Rows are deleted as they move, so every batch starts from the top
+            rows = conn.execute('''
+                SELECT product_id, image_data, image_filename, image_mimetype FROM product_images LIMIT ?
+            ''', (batch_size,)).fetchall()
+            if not rows:
+                break
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            for product_id, image_data, image_filename, image_mimetype in rows:
+                image_hash = image_store.put(image_data)
+                cursor.execute('''
+                    UPDATE products SET image_hash = ?, image_filename = COALESCE(image_filename, ?),
+                        image_mimetype = COALESCE(image_mimetype, ?), image_widths = NULL
+                    WHERE id = ?
+                ''', (image_hash, image_filename, image_mimetype, product_id))
+                cursor.execute('DELETE FROM product_images WHERE product_id = ?', (product_id,))
+            catalog_cache.bump_version(cursor)
+            conn.commit()
+            moved += len(rows)
+        catalog_cache.publish()
+        click.echo(f"Moved {moved} image(s) to {IMAGE_STORE_DIR}")
+        
+        if prune:
+            conn.execute('''
+                DELETE FROM image_derivatives WHERE image_hash NOT IN
+                    (SELECT image_hash FROM products WHERE image_hash IS NOT NULL)
+            ''')
+            conn.commit()
+            referenced = {row[0] for row in conn.execute('''
+                SELECT image_hash FROM products WHERE image_hash IS NOT NULL
+                UNION SELECT derivative_hash FROM image_derivatives
+            ''')}
+            cutoff = time.time() - IMAGE_PRUNE_GRACE_SECONDS
+            pruned = 0
+            for digest, mtime in list(image_store.digests()):
+                if digest not in referenced and mtime < cutoff:
+                    image_store.delete(digest)
+                    pruned += 1
+            click.echo(f"Pruned {pruned} unreferenced file(s)")
+        if vacuum:
+            conn.execute('VACUUM')
+            click.echo("Database vacuumed")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# --- Image Derivatives ---
+# Each stored image gets resized WebP and JPEG renditions at a few fixed widths
+# (never wider than the original), rendered by a background thread after the
+# upload commits. Product JSON lists them as srcsets once they exist, and
+# /api/product-image serves them for ?size=<width>[&format=webp|jpeg].
+# Needs Pillow; without it products simply keep serving the original.
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+IMAGE_DERIVATIVE_WIDTHS = (160, 320, 640, 1024)
+# format -> (Pillow format, MIME type, save options)
+IMAGE_DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+def render_image_derivatives(path):
+    """Return [(format, width, bytes)] for the image file at path"""
+    renditions = []
+    with Image.open(path) as original:
+        original.seek(0)  # first frame of animations
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    widths = sorted({min(width, image.width) for width in IMAGE_DERIVATIVE_WIDTHS})
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    rgba = image.convert('RGBA' if has_alpha else 'RGB')
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = rgba if width == image.width else rgba.resize((width, height), Image.LANCZOS)
+        for image_format, (pillow_format, _, options) in IMAGE_DERIVATIVE_FORMATS.items():
+            frame = resized
+            if pillow_format == 'JPEG' and has_alpha:
+                # JPEG has no alpha channel; flatten onto white like the storefront background
+                frame = Image.new('RGB', resized.size, (255, 255, 255))
+                frame.paste(resized, mask=resized.getchannel('A'))
+            buffer = io.BytesIO()
+            frame.save(buffer, pillow_format, **options)
+            renditions.append((image_format, width, buffer.getvalue()))
+    return renditions
+
+def build_pending_image_derivatives(batch_size=10):
+    """Render derivatives for up to batch_size unprocessed images; returns how many were handled"""
+    if Image is None:
+        return 0
+    conn = get_db_connection()
+    try:
+        pending = [row[0] for row in conn.execute('''
+            SELECT DISTINCT image_hash FROM products WHERE image_hash IS NOT NULL AND image_widths IS NULL LIMIT ?
+        ''', (batch_size,)).fetchall()]
+        for image_hash in pending:
+            # Render outside any transaction; only the bookkeeping takes the write lock
+            renditions = []
+            if image_store.exists(image_hash):
+                try:
+                    renditions = render_image_derivatives(image_store.path(image_hash))
+                except Exception as e:
+                    logger.warning('Could not render derivatives for image %s: %s', image_hash, e)
+            rows = [(image_hash, image_format, width, image_store.put(data), len(data))
+                    for image_format, width, data in renditions]
+            widths = ','.join(str(width) for width in sorted({row[2] for row in rows}))
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('DELETE FROM image_derivatives WHERE image_hash = ?', (image_hash,))
+            cursor.executemany('''
+                INSERT INTO image_derivatives (image_hash, format, width, derivative_hash, byte_size)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            cursor.execute('UPDATE products SET image_widths = ? WHERE image_hash = ? AND image_widths IS NULL',
+                           (widths, image_hash))
+            catalog_cache.bump_version(cursor)
+            conn.commit()
+        if pending:
+            catalog_cache.publish()
+        return len(pending)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def choose_image_derivative(cursor, image_hash, image_format, size):
+    """Smallest derivative at least `size` wide, else the widest; None if there are none"""
+    derivatives = cursor.execute('''
+        SELECT width, derivative_hash FROM image_derivatives WHERE image_hash = ? AND format = ? ORDER BY width
+    ''', (image_hash, image_format)).fetchall()
+    for derivative in derivatives:
+        if derivative['width'] >= size:
+            return derivative
+    return derivatives[-1] if derivatives else None
+
+_image_derivative_event = threading.Event()
+_image_derivative_thread = {'pid': None}
+
+def _image_derivative_worker():
+    while True:
+        _image_derivative_event.wait()
+        _image_derivative_event.clear()
+        try:
+            while build_pending_image_derivatives():
+                pass
+        except Exception:
+            logger.exception('Error building image derivatives')
+
+def schedule_image_derivatives():
+    """Wake this worker's derivative renderer (starting it after a fork if needed)"""
+    if Image is None:
+        return
+    if _image_derivative_thread['pid'] != os.getpid():
+        _image_derivative_thread['pid'] = os.getpid()
+        threading.Thread(target=_image_derivative_worker, name='image-derivatives', daemon=True).start()
+    _image_derivative_event.set()
+
+@app.cli.command('build-image-derivatives')
+def build_image_derivatives_command():
+    """Render missing image derivatives now instead of in the server's background thread."""
+    if Image is None:
+        raise click.ClickException('Image derivatives need Pillow (pip install Pillow)')
+    built = 0
+    while True:
+        count = build_pending_image_derivatives()
+        if not count:
+            break
+        built += count
+    click.echo(f"Rendered derivatives for {built} image(s)")
+
+# --- Catalog Cache ---
+# Each worker keeps an in-memory snapshot of the catalog. Admin product writes
+# bump catalog_meta.version inside their transaction and then replace a small
+# stamp file next to the database; readers only stat() that file, so a cache
+# hit costs no DB round trip and every gunicorn worker sees writes promptly.
+CATALOG_STAMP_FILE = DATABASE + '.catalog-version'
+# Distinct filtered/paginated catalog queries remembered per snapshot
+CATALOG_QUERY_CACHE_SIZE = 256
+
+class CatalogCache:
+    """Versioned, process-local snapshot of the product catalog"""
+
+    def __init__(self, stamp_path):
+        self.stamp_path = stamp_path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._snapshot = None
+
+    def _read_stamp(self):
+        try:
+            st = os.stat(self.stamp_path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        conn = get_db_connection()
+        try:
+            version = conn.execute('SELECT version FROM catalog_meta WHERE id = 1').fetchone()[0]
+            products = [product_to_dict(row) for row in fetch_catalog(conn, 'ORDER BY id')]
+        finally:
+            conn.close()
+        return {
+            'version': version,
+            'products': products,
+            'by_id': {product['id']: product for product in products},
+            'queries': {}
+        }
+
+    def snapshot(self):
+        """Return the current snapshot, reloading it if another writer published a change"""
+        stamp = self._read_stamp()
+        snapshot = self._snapshot
+        if snapshot is None or stamp != self._stamp:
+            with self._lock:
+                if self._snapshot is None or stamp != self._stamp:
+                    # Stamp is read before loading so a concurrent write forces another reload
+                    self._snapshot = self._load()
+                    self._stamp = stamp
+                snapshot = self._snapshot
+        if has_request_context():
+            # The version this response was built from, for the compressed body cache;
+            # None if the request saw two different versions
+            version = snapshot['version']
+            if g.setdefault('catalog_version', version) != version:
+                g.catalog_version = None
+        return snapshot
+
+    def query(self, key, run):
+        """Memoize a catalog query result for the lifetime of the current snapshot"""
+        queries = self.snapshot()['queries']
+        result = queries.get(key)
+        if result is None:
+            result = run()
+            if len(queries) >= CATALOG_QUERY_CACHE_SIZE:
+                queries.clear()
+            queries[key] = result
+        return result
+
+    def bump_version(self, cursor):
+        """Increment the catalog version inside the caller's write transaction"""
+        cursor.execute('UPDATE catalog_meta SET version = version + 1 WHERE id = 1')
+
+    def publish(self):
+        """Announce a committed catalog change to every worker"""
+        conn = get_db_connection()
+        try:
+            version = conn.execute('SELECT version FROM catalog_meta WHERE id = 1').fetchone()[0]
+        finally:
+            conn.close()
+        tmp_path = f"{self.stamp_path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, 'w') as f:
+            f.write(str(version))
+        os.replace(tmp_path, self.stamp_path)
+        with self._lock:
+            self._snapshot = None
+
+catalog_cache = CatalogCache(CATALOG_STAMP_FILE)
+
+# --- Related Products Index ---
+# related_products holds the top RELATED_PRODUCTS_LIMIT neighbours of every
+# product. Writes that change similarity only mark products in related_dirty;
+# a background thread per worker recomputes just those lists, scoring from a
+# read snapshot and taking the write lock only to store the lists that changed.
+RELATED_PRODUCTS_LIMIT = 8
+RELATED_REFRESH_BATCH = 50
+
+def related_score(a, b, co_purchases):
+    """Similarity between two product rows; co_purchases is the number of shared buyers"""
+    score = 0.0
+    if a['fragrance_family'] and a['fragrance_family'] == b['fragrance_family']:
+        score += 3.0
+    if a['gender_key'] == b['gender_key']:
+        score += 2.0
+    if a['category'] == b['category']:
+        score += 1.0
+    if co_purchases:
+        score += 4.0 * math.log1p(co_purchases)
+    # Tie-breaker: closer prices rank higher
+    if a['price'] and b['price']:
+        score += 1.0 / (1.0 + abs(a['price'] - b['price']) / max(a['price'], b['price']))
+    return score
+
+def co_purchase_counts(cursor, product_id):
+    """Number of distinct customers who bought product_id together with each other product"""
+    rows = cursor.execute('''
+        SELECT i2.product_id, COUNT(DISTINCT o1.user_id)
+        FROM order_items i1
+        JOIN orders o1 ON o1.id = i1.order_id
+        JOIN orders o2 ON o2.user_id = o1.user_id
+        JOIN order_items i2 ON i2.order_id = o2.id AND i2.product_id != i1.product_id
+        WHERE i1.product_id = ?
+        GROUP BY i2.product_id
+    ''', (product_id,)).fetchall()
+    return dict(rows)
+
+def mark_related_dirty(cursor, product_ids):
+    cursor.executemany('''
+        INSERT INTO related_dirty (product_id) VALUES (?)
+        ON CONFLICT (product_id) DO UPDATE SET generation = generation + 1
+    ''', [(product_id,) for product_id in product_ids if product_id])
+
+def mark_user_purchases_related_dirty(cursor, user_id):
+    """Flag every product a customer bought, since their co-purchase pairs changed"""
+    cursor.execute('''
+        INSERT INTO related_dirty (product_id)
+        SELECT DISTINCT i.product_id
+        FROM orders o JOIN order_items i ON i.order_id = o.id
+        WHERE o.user_id = ? AND i.product_id IS NOT NULL
+        ON CONFLICT (product_id) DO UPDATE SET generation = generation + 1
+    ''', (user_id,))
+
+def sort_related(entries):
+    return sorted(entries, key=lambda entry: (-entry[0], entry[1]))[:RELATED_PRODUCTS_LIMIT]
+
+def write_related_list(cursor, product_id, entries):
+    cursor.execute('DELETE FROM related_products WHERE product_id = ?', (product_id,))
+    cursor.executemany(
+        'INSERT INTO related_products (product_id, rank, related_id, score) VALUES (?, ?, ?, ?)',
+        [(product_id, rank, related_id, score) for rank, (score, related_id) in enumerate(entries)]
+    )
+
+def build_related_list(product, products, co_counts):
+    """Compute one product's list from scratch"""
+    return sort_related(
+        (related_score(product, other, co_counts.get(other_id)), other_id)
+        for other_id, other in products.items() if other_id != product['id']
+    )
+
+def refresh_related_products(batch_size=RELATED_REFRESH_BATCH):
+    """Recompute related lists for up to batch_size dirty products; returns how many were processed
+
+    Scoring reads one snapshot and holds no lock, since it can take seconds on
+    a large catalog. Only storing the lists that changed runs under
+    BEGIN IMMEDIATE. A product marked again in between keeps its related_dirty
+    row (its generation moved on) and is redone by the next pass.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        dirty = [tuple(row) for row in cursor.execute(
+            'SELECT product_id, generation FROM related_dirty LIMIT ?', (batch_size,)).fetchall()]
+        if not dirty:
+            conn.commit()
+            return 0
+        
+        products = {row['id']: row for row in cursor.execute(
+            'SELECT id, gender_key, category, fragrance_family, price FROM products').fetchall()}
+        lists = {}
+        for product_id, related_id, score in cursor.execute(
+                'SELECT product_id, related_id, score FROM related_products ORDER BY product_id, rank'):
+            lists.setdefault(product_id, []).append((score, related_id))
+        
+        updated = {}  # product_id -> new list; an empty list deletes it
+        full_rebuild = set()
+        for changed_id, _ in dirty:
+            changed = products.get(changed_id)
+            if changed is None:
+                # Deleted product: drop its list and remove it from the others
+                updated[changed_id] = []
+                lists.pop(changed_id, None)
+                for other_id, entries in lists.items():
+                    if any(entry[1] == changed_id for entry in entries):
+                        full_rebuild.add(other_id)
+                continue
+            
+            co_counts = co_purchase_counts(cursor, changed_id)
+            lists[changed_id] = updated[changed_id] = build_related_list(changed, products, co_counts)
+            full_rebuild.discard(changed_id)
+            # Offer the changed product to every other list; co-purchase counts are symmetric
+            for other_id, other in products.items():
+                if other_id == changed_id or other_id in full_rebuild:
+                    continue
+                entries = lists.get(other_id, [])
+                score = related_score(other, changed, co_counts.get(other_id))
+                previous = next((entry for entry in entries if entry[1] == changed_id), None)
+                if previous and score < previous[0] and len(entries) >= RELATED_PRODUCTS_LIMIT:
+                    # It may drop out in favour of a product we never stored
+                    full_rebuild.add(other_id)
+                    continue
+                if not previous and len(entries) >= RELATED_PRODUCTS_LIMIT and score <= entries[-1][0]:
+                    continue
+                merged = sort_related([entry for entry in entries if entry[1] != changed_id] + [(score, changed_id)])
+                if merged != entries:
+                    lists[other_id] = updated[other_id] = merged
+        
+        for product_id in full_rebuild:
+            if product_id in products:
+                updated[product_id] = build_related_list(
+                    products[product_id], products, co_purchase_counts(cursor, product_id))
+        conn.commit()  # end the read snapshot
+        
+        cursor.execute('BEGIN IMMEDIATE')
+        for product_id, entries in updated.items():
+            write_related_list(cursor, product_id, entries)
+        cursor.executemany('DELETE FROM related_dirty WHERE product_id = ? AND generation = ?', dirty)
+        conn.commit()
+        return len(dirty)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
-init_db()
+_related_refresh_event = threading.Event()
+_related_refresh_thread = {'pid': None}
 
-# --- Helper Functions ---
-def row_get(row, key, default=None):
-    try:
-        return row[key] if key in row.keys() else default
-    except:
-        return default
+def _related_refresh_worker():
+    while True:
+        _related_refresh_event.wait()
+        _related_refresh_event.clear()
+        try:
+            while refresh_related_products():
+                pass
+        except Exception as e:
+            logger.exception('Error refreshing related products')
+
+def schedule_related_refresh():
+    """Wake this worker's background refresher (starting it after a fork if needed)"""
+    if _related_refresh_thread['pid'] != os.getpid():
+        _related_refresh_thread['pid'] = os.getpid()
+        threading.Thread(target=_related_refresh_worker, name='related-refresh', daemon=True).start()
+    _related_refresh_event.set()
 
 def convert_drive_link_to_direct_url(link):
     """
@@ -154,71 +2329,374 @@ def convert_drive_link_to_direct_url(link):
     # Return original link if we couldn't parse it
     return link
 
+# --- Order Read Layer ---
+# Orders are a header row plus order_items; titles, prices and the shipping
+# label are snapshots taken at checkout, so reads never touch products or addresses
+ORDER_ITEM_COLUMNS = 'order_id, product_id, product_title, image_hash, unit_price, quantity, line_total'
+
+def fetch_order_items(cursor, order_ids):
+    """Items for a set of orders in one indexed read, keyed by order id"""
+    items = {order_id: [] for order_id in order_ids}
+    if not items:
+        return items
+    placeholders = ','.join('?' * len(items))
+    for row in cursor.execute(
+            f'SELECT {ORDER_ITEM_COLUMNS} FROM order_items WHERE order_id IN ({placeholders}) ORDER BY order_id, id',
+            list(items)).fetchall():
+        items[row['order_id']].append(row)
+    return items
+
+def order_item_image(item):
+    if not item['product_id']:
+        return '/images/placeholder.svg'
+    return product_image_url(item['product_id'], item['image_hash'])
+
+def order_item_to_dict(item):
+    return {
+        'product_id': item['product_id'],
+        'product_title': item['product_title'],
+        'product_image': order_item_image(item),
+        'quantity': item['quantity'],
+        'price': float(item['unit_price']),
+        'line_total': float(item['line_total'])
+    }
+
+def order_summary(items):
+    """One-line product fields for order list views: first item plus a count"""
+    if not items:
+        return {'product_id': None, 'product_title': 'Unknown Product', 'product_image': '/images/placeholder.svg',
+                'quantity': 0, 'price': 0.0}
+    first = items[0]
+    title = first['product_title']
+    if len(items) > 1:
+        title = f"{title} + {len(items) - 1} more"
+    return {
+        'product_id': first['product_id'],
+        'product_title': title,
+        'product_image': order_item_image(first),
+        'quantity': sum(item['quantity'] for item in items),
+        'price': float(first['unit_price'])
+    }
+
+def delete_orders(cursor, order_ids):
+    """Delete orders and their items (foreign keys are not enforced), keeping the sales rollups in step"""
+    params = [(order_id,) for order_id in order_ids]
+    for order_id in order_ids:
+        order = cursor.execute('SELECT id, created_at, order_status, total_amount FROM orders WHERE id = ?', (order_id,)).fetchone()
+        if order:
+            record_order_sales(cursor, order, -1)
+    cursor.executemany('DELETE FROM order_items WHERE order_id = ?', params)
+    cursor.executemany('DELETE FROM orders WHERE id = ?', params)
+
+# --- Checkout Idempotency ---
+# A retried or double-submitted checkout carrying the same Idempotency-Key
+# gets the original order back instead of placing a second one
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('FAJR_IDEMPOTENCY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_PURGE_INTERVAL = 15 * 60
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+def checkout_fingerprint(cart, payment_method, address_id):
+    """Hash of what a checkout asks for, to catch a key reused for a different cart"""
+    payload = json.dumps([sorted(cart), payment_method, address_id], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def find_idempotent_order(cursor, user_id, idempotency_key):
+    """The unexpired checkout recorded under this key, or None"""
+    cutoff = (datetime.now() - timedelta(seconds=IDEMPOTENCY_KEY_TTL)).isoformat()
+    return cursor.execute('''
+        SELECT request_hash, order_id, total_amount FROM idempotency_keys
+        WHERE user_id = ? AND idempotency_key = ? AND created_at >= ?
+    ''', (user_id, idempotency_key, cutoff)).fetchone()
+
+def replay_idempotent_order(previous, fingerprint):
+    if previous['request_hash'] != fingerprint:
+        return jsonify({'success': False, 'message': 'Idempotency key was already used for a different order'}), 422
+    return jsonify({
+        'success': True,
+        'message': 'Order placed successfully!',
+        'order_id': previous['order_id'],
+        'order_ids': [previous['order_id']],
+        'total_orders': 1,
+        'total_amount': previous['total_amount'],
+        'replayed': True
+    })
+
+def purge_expired_idempotency_keys():
+    """Delete keys older than the replay window; returns how many were removed"""
+    cutoff = (datetime.now() - timedelta(seconds=IDEMPOTENCY_KEY_TTL)).isoformat()
+    conn = get_db_connection()
+    try:
+        deleted = conn.execute('DELETE FROM idempotency_keys WHERE created_at < ?', (cutoff,)).rowcount
+        conn.commit()
+        return deleted
+    finally:
+        conn.close()
+
+_idempotency_purge_thread = {'pid': None}
+
+def _idempotency_purge_worker():
+    while True:
+        try:
+            purge_expired_idempotency_keys()
+        except Exception as e:
+            logger.exception('Error purging idempotency keys')
+        time.sleep(IDEMPOTENCY_PURGE_INTERVAL)
+
+def schedule_idempotency_purge():
+    """Start this worker's periodic key purge (again after a fork)"""
+    if _idempotency_purge_thread['pid'] != os.getpid():
+        _idempotency_purge_thread['pid'] = os.getpid()
+        threading.Thread(target=_idempotency_purge_worker, name='idempotency-purge', daemon=True).start()
+
+# --- Static Assets ---
+# FAJR_ASSET_DIR points at the output of build_assets.py (minified, fingerprinted
+# and precompressed); without it client/ and admin/ are served as they are.
+ASSET_DIR = os.environ.get('FAJR_ASSET_DIR')
+if ASSET_DIR:
+    ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ASSET_DIR)
+    app.static_folder = os.path.join(ASSET_DIR, 'client')
+ADMIN_DIR = os.path.join(ASSET_DIR or os.path.dirname(os.path.abspath(__file__)), 'admin')
+# Precompressed siblings build_assets.py may write, in order of preference
+PRECOMPRESSED_SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+
+def send_asset(directory, path):
+    """Like send_from_directory, but sends a precompressed sibling the client accepts"""
+    full_path = safe_join(directory, path)
+    if full_path is None or not os.path.isfile(full_path):
+        return send_from_directory(directory, path)
+    variants = [(encoding, suffix) for encoding, suffix in PRECOMPRESSED_SUFFIXES
+                if os.path.isfile(full_path + suffix)]
+    for encoding, suffix in variants:
+        if request.accept_encodings.quality(encoding) > 0:
+            mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            response = send_from_directory(directory, path + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(directory, path)
+    if variants:
+        response.vary.add('Accept-Encoding')
+    return response
+
+def send_static_asset(filename):
+    return send_asset(app.static_folder, filename)
+
+app.view_functions['static'] = send_static_asset
+
 # --- Main Routes ---
 @app.route('/')
 def index():
-    return app.send_static_file('index.html')
+    return send_static_asset('index.html')
 
 # --- Admin File Serving ---
 @app.route('/admin/', defaults={'path': 'index.html'})
 @app.route('/admin/<path:path>')
 def serve_admin_files(path):
-    admin_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'admin')
-    return send_from_directory(admin_dir, path)
+    return send_asset(ADMIN_DIR, path)
 
 # --- Public API Routes (for client-side) ---
+# Storefront sort orders: (ORDER BY column, descending)
+PRODUCT_SORTS = {
+    'default': ('id', False),
+    'newest': ('created_at', True),
+    'price_asc': ('price', False),
+    'price_desc': ('price', True),
+}
+PRODUCT_QUERY_ARGS = ('gender', 'category', 'min_price', 'max_price', 'sort', 'limit', 'cursor')
+
+def query_products(args):
+    """Run a filtered, sorted, keyset-paginated catalog query.
+
+    Returns (products, next_cursor). Raises ValueError for bad arguments.
+    """
+    conditions = []
+    params = []
+    
+    gender = args.get('gender', '').strip()
+    if gender and gender != 'all':
+        conditions.append('gender_key = ?')
+        params.append(gender if gender in ('him', 'her', 'unisex') else normalize_gender(gender))
+    category = args.get('category', '').strip()
+    if category:
+        conditions.append('category = ?')
+        params.append(category)
+    for arg, op in (('min_price', '>='), ('max_price', '<=')):
+        value = args.get(arg, '').strip()
+        if value:
+            conditions.append(f'price {op} ?')
+            params.append(float(value))
+    
+    sort = args.get('sort', '').strip() or 'default'
+    if sort not in PRODUCT_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(PRODUCT_SORTS)}")
+    column, descending = PRODUCT_SORTS[sort]
+    limit = parse_page_size(args.get('limit'))
+    
+    page_cursor = args.get('cursor')
+    if page_cursor:
+        op = '<' if descending else '>'
+        if column == 'id':
+            (last_id,) = decode_cursor(page_cursor, int)
+            conditions.append(f'id {op} ?')
+            params.append(last_id)
+        else:
+            sort_value, last_id = decode_cursor(page_cursor, (int, float) if column == 'price' else str, int)
+            conditions.append(f'({column}, id) {op} (?, ?)')
+            params.extend([sort_value, last_id])
+    
+    direction = 'DESC' if descending else 'ASC'
+    order_by = f'id {direction}' if column == 'id' else f'{column} {direction}, id {direction}'
+    where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    
+    conn = get_db_connection()
+    rows = fetch_catalog(conn, f'{where} ORDER BY {order_by} LIMIT ?', params + [limit + 1])
+    conn.close()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(last['id']) if column == 'id' else encode_cursor(last[column], last['id'])
+    return [product_to_dict(row) for row in rows], next_cursor
+
 @app.route('/api/products', methods=['GET'])
 def get_products():
+    """List products.
+
+    Without query parameters the whole catalog is returned. Optional filters:
+    gender (him/her/unisex), category, min_price, max_price, sort
+    (default/newest/price_asc/price_desc), limit and cursor.
+    """
     try:
-        import time
-        conn = get_db_connection()
-        products = conn.execute('SELECT * FROM products').fetchall()
-        conn.close()
-        products_list = []
-        for product in products:
-            product_dict = {
-                'id': product[0],
-                'title': product[1],
-                'category': product[2],
-                'gender': product[3],
-                'price': product[4],
-                'description': product[5],
-                'image_url': f"/api/product-image/{product[0]}?t={int(time.time()*1000)}",  # Cache-bust per response
-                'volume': product[7] if len(product) > 7 else None,
-                'longevity': product[8] if len(product) > 8 else None,
-                'is_new': False  # You can add logic to determine if product is new
-            }
-            products_list.append(product_dict)
-        return jsonify({'success': True, 'products': products_list})
+        if not any(request.args.get(arg) for arg in PRODUCT_QUERY_ARGS):
+            return jsonify({'success': True, 'products': catalog_cache.snapshot()['products']})
+        
+        key = tuple(request.args.get(arg, '') for arg in PRODUCT_QUERY_ARGS)
+        try:
+            products, next_cursor = catalog_cache.query(('products',) + key, lambda: query_products(request.args))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': f'Invalid query parameter: {e}'}), 400
+        return jsonify({
+            'success': True,
+            'products': products,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# --- Product Search ---
+# bm25 weights for title, description, fragrance_family, concentration, category
+SEARCH_WEIGHTS = (10.0, 1.0, 4.0, 2.0, 2.0)
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+# Placeholder markers swapped for <mark> tags after HTML-escaping the text
+HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE = '\x02', '\x03'
+
+def build_fts_query(text):
+    """Turn user input into a safe FTS5 query; the last term is a prefix match for typeahead"""
+    terms = re.findall(r'\w+', text.lower())
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+def render_highlight(text):
+    if not text:
+        return text
+    return html.escape(text).replace(HIGHLIGHT_OPEN, '<mark>').replace(HIGHLIGHT_CLOSE, '</mark>')
+
+def search_products(fts_query, limit):
+    columns = ', '.join(f'p.{column}' for column in PRODUCT_LIST_COLUMNS)
+    rank_function = f"bm25({', '.join(str(weight) for weight in SEARCH_WEIGHTS)})"
+    conn = get_db_connection()
+    # Rank every match with FTS5's built-in rank (our weights, set per query),
+    # keep the best `limit`, and only then build highlights for those rows.
+    rows = conn.execute(f'''
+        WITH ranked AS (
+            SELECT rowid, rank AS score
+            FROM products_fts
+            WHERE products_fts MATCH ? AND rank MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        )
+        SELECT {columns},
+               highlight(products_fts, 0, ?, ?) AS title_highlight,
+               snippet(products_fts, 1, ?, ?, '…', 16) AS description_snippet
+        FROM ranked
+        JOIN products_fts ON products_fts.rowid = ranked.rowid
+        JOIN products p ON p.id = ranked.rowid
+        WHERE products_fts MATCH ?
+        ORDER BY ranked.score
+    ''', (fts_query, rank_function, limit, HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE,
+          fts_query)).fetchall()
+    conn.close()
+    
+    results = []
+    for row in rows:
+        product = product_to_dict(row)
+        product['title_highlight'] = render_highlight(row['title_highlight'])
+        product['description_snippet'] = render_highlight(row['description_snippet'])
+        results.append(product)
+    return results
+
+@app.route('/api/products/search', methods=['GET'])
+def search_products_route():
+    """Ranked full-text product search. Query parameters: q, limit"""
+    try:
+        fts_query = build_fts_query(request.args.get('q', ''))
+        if not fts_query:
+            return jsonify({'success': True, 'products': []})
+        try:
+            limit = min(int(request.args.get('limit') or SEARCH_DEFAULT_LIMIT), SEARCH_MAX_LIMIT)
+            if limit <= 0:
+                raise ValueError
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid query parameter: limit'}), 400
+        
+        products = catalog_cache.query(('search', fts_query, limit), lambda: search_products(fts_query, limit))
+        return jsonify({'success': True, 'products': products})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/products/<int:product_id>', methods=['GET'])
 def get_product(product_id):
     try:
-        import time
-        conn = get_db_connection()
-        product = conn.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
-        conn.close()
+        product = catalog_cache.snapshot()['by_id'].get(product_id)
         
         if product:
-            product_data = {
-                'id': product[0],
-                'title': product[1],
-                'category': product[2],
-                'gender': product[3],
-                'price': product[4],
-                'description': product[5],
-                'image_url': f"/api/product-image/{product[0]}?t={int(time.time()*1000)}",  # Cache-bust per response
-                'volume': product[7] if len(product) > 7 else None,
-                'longevity': product[8] if len(product) > 8 else None,
-            }
-            return jsonify({'success': True, 'product': product_data})
+            return jsonify({'success': True, 'product': product})
         else:
             return jsonify({'success': False, 'message': 'Product not found'}), 404
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/products/<int:product_id>/related', methods=['GET'])
+def get_related_products(product_id):
+    """Related products from the precomputed index"""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        related_ids = [row[0] for row in cursor.execute(
+            'SELECT related_id FROM related_products WHERE product_id = ? ORDER BY rank', (product_id,)).fetchall()]
+        pending = cursor.execute('SELECT 1 FROM related_dirty WHERE product_id = ?', (product_id,)).fetchone()
+        conn.close()
+        
+        if pending:
+            # Serve the previous list (or none yet) and let the background refresher
+            # catch up, e.g. on the backlog migration 10 marks after a deploy
+            schedule_related_refresh()
+        
+        by_id = catalog_cache.snapshot()['by_id']
+        if product_id not in by_id:
+            return jsonify({'success': False, 'message': 'Product not found'}), 404
+        related = [by_id[related_id] for related_id in related_ids if related_id in by_id]
+        return jsonify({'success': True, 'related_products': related})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 # --- Admin API Routes ---
 @app.route('/api/admin/stats', methods=['GET'])
 def get_admin_stats():
@@ -227,19 +2705,18 @@ def get_admin_stats():
         cursor = conn.cursor()
         total_products = cursor.execute('SELECT COUNT(*) FROM products').fetchone()[0]
         total_users = cursor.execute('SELECT COUNT(*) FROM users').fetchone()[0]
-        total_orders = cursor.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
-        total_revenue = cursor.execute('SELECT SUM(total_amount) FROM orders WHERE order_status = "delivered"').fetchone()[0] or 0
-        # Revenue for current month (delivered orders)
-        first_of_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
-        monthly_revenue = cursor.execute(
-            'SELECT SUM(total_amount) FROM orders WHERE order_status = "delivered" AND datetime(created_at) >= datetime(?)',
-            (first_of_month,)
-        ).fetchone()[0] or 0
-        recent_products = cursor.execute('SELECT * FROM products ORDER BY created_at DESC LIMIT 5').fetchall()
+        # Order totals come from the monthly rollup: a handful of rows per month
+        total_orders, total_revenue, monthly_revenue = cursor.execute('''
+            SELECT COALESCE(SUM(order_count), 0),
+                   COALESCE(SUM(CASE WHEN order_status = 'delivered' THEN revenue END), 0),
+                   COALESCE(SUM(CASE WHEN order_status = 'delivered' AND month = ? THEN revenue END), 0)
+            FROM sales_monthly
+        ''', (datetime.now().strftime('%Y-%m'),)).fetchone()
+        recent_products = cursor.execute('SELECT id, title, price, image_hash FROM products ORDER BY created_at DESC LIMIT 5').fetchall()
         recent_users = cursor.execute('SELECT * FROM users ORDER BY created_at DESC LIMIT 5').fetchall()
         conn.close()
         
-        recent_products_list = [{'id': p['id'], 'title': p['title'], 'price': p['price'], 'image_url': f"/api/product-image/{p['id']}?t={int(time.time()*1000)}"} for p in recent_products]
+        recent_products_list = [{'id': p['id'], 'title': p['title'], 'price': p['price'], 'image_url': product_image_url(p['id'], p['image_hash'])} for p in recent_products]
         recent_users_list = [{'id': u['id'], 'name': f"{u['first_name']} {u['last_name']}", 'email': u['email']} for u in recent_users]
         
         return jsonify({'success': True, 'stats': {
@@ -250,6 +2727,130 @@ def get_admin_stats():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# Time-series reports read only the rollup tables:
+# bucket -> (order table, product table, group table, period column, period SQL)
+REPORT_BUCKETS = {
+    column: (table, product_table, group_table, column, period)
+    for (table, column, period), (product_table, _, _), (group_table, _, _)
+    in zip(SALES_ROLLUPS, PRODUCT_SALES_ROLLUPS, GROUP_SALES_ROLLUPS)
+}
+# group_by -> (series SQL, source): the order-level, per-product or per-group rollups
+REPORT_GROUPS = {
+    'none': ("'all'", 'orders'),
+    'status': ('r.order_status', 'orders'),
+    'product': ('r.product_id', 'products'),
+    'gender': ('r.group_key', 'groups'),
+    'category': ('r.group_key', 'groups'),
+}
+REPORT_DEFAULT_SERIES = 10
+REPORT_MAX_SERIES = 100
+
+@app.route('/api/admin/reports/timeseries', methods=['GET'])
+def get_sales_timeseries():
+    """Order count and revenue per day, week or month, optionally split into series.
+
+    Query parameters: bucket (day, week, month), group_by (none, status,
+    product, gender, category), status (comma-separated filter), date_from
+    and date_to (YYYY-MM-DD, inclusive) and limit (series returned, largest
+    revenue first). Product, gender and category series count the distinct
+    orders that contain them (an order with two products of one category
+    counts once) and also report units. Gender and category are the
+    product's at the time of the order.
+    """
+    bucket = request.args.get('bucket', 'day').strip()
+    group_by = request.args.get('group_by', 'none').strip()
+    if bucket not in REPORT_BUCKETS:
+        return jsonify({'success': False, 'message': f"bucket must be one of {', '.join(REPORT_BUCKETS)}"}), 400
+    if group_by not in REPORT_GROUPS:
+        return jsonify({'success': False, 'message': f"group_by must be one of {', '.join(REPORT_GROUPS)}"}), 400
+    
+    table, product_table, group_table, column, period = REPORT_BUCKETS[bucket]
+    series_sql, source_kind = REPORT_GROUPS[group_by]
+    by_product = source_kind != 'orders'
+    conditions = []
+    params = []
+    try:
+        for arg, operator in (('date_from', '>='), ('date_to', '<=')):
+            value = request.args.get(arg, '').strip()
+            if value:
+                # Compare period keys, so a mid-week date_from still includes its week
+                conditions.append(f"r.{column} {operator} {period.format('?')}")
+                params.append(datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d'))
+        series_limit = min(max(int(request.args.get('limit', REPORT_DEFAULT_SERIES)), 1), REPORT_MAX_SERIES)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid query parameter: {e}'}), 400
+    statuses = [status for status in request.args.get('status', '').split(',') if status.strip()]
+    if statuses:
+        conditions.append(f"r.order_status IN ({','.join('?' * len(statuses))})")
+        params.extend(status.strip() for status in statuses)
+    
+    if source_kind == 'groups':
+        source = f'{group_table} r'
+        conditions.append('r.dimension = ?')
+        params.append(group_by)
+    else:
+        source = f'{product_table} r' if source_kind == 'products' else f'{table} r'
+    units_sql = 'SUM(r.units)' if by_product else 'NULL'
+    where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        # Rank series first so points are only aggregated for the ones returned
+        totals = cursor.execute(f'''
+            SELECT {series_sql} AS series, SUM(r.order_count) AS order_count, {units_sql} AS units,
+                   ROUND(SUM(r.revenue), 2) AS revenue
+            FROM {source}
+            {where}
+            GROUP BY 1
+            HAVING SUM(r.order_count) != 0
+            ORDER BY 4 DESC, 1
+        ''', params).fetchall()
+        top = totals[:series_limit]
+        rows = []
+        if top:
+            placeholders = ','.join('?' * len(top))
+            rows = cursor.execute(f'''
+                SELECT {series_sql} AS series, r.{column} AS period,
+                       SUM(r.order_count) AS order_count, {units_sql} AS units, ROUND(SUM(r.revenue), 2) AS revenue
+                FROM {source}
+                {where} {'AND' if where else 'WHERE'} {series_sql} IN ({placeholders})
+                GROUP BY 1, 2
+                HAVING SUM(r.order_count) != 0
+                ORDER BY 2
+            ''', params + [row['series'] for row in top]).fetchall()
+        conn.close()
+        
+        series = {}
+        for total in top:
+            entry = {'key': total['series'], 'label': total['series'], 'points': [],
+                     'totals': {'order_count': total['order_count'], 'revenue': total['revenue']}}
+            if by_product:
+                entry['totals']['units'] = total['units']
+            series[total['series']] = entry
+        for row in rows:
+            point = {'period': row['period'], 'order_count': row['order_count'], 'revenue': row['revenue']}
+            if by_product:
+                point['units'] = row['units']
+            series[row['series']]['points'].append(point)
+        
+        if group_by == 'product':
+            by_id = catalog_cache.snapshot()['by_id']
+            for entry in series.values():
+                product = by_id.get(entry['key'])
+                entry['label'] = product['title'] if product else f"Product {entry['key']}"
+        
+        return jsonify({
+            'success': True,
+            'bucket': bucket,
+            'group_by': group_by,
+            'periods': sorted({row['period'] for row in rows}),
+            'series': list(series.values()),
+            'total_series': len(totals)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/api/admin/products', methods=['POST'])
 def add_product():
     """Add a new product"""
@@ -274,33 +2875,40 @@ def add_product():
         except ValueError:
             return jsonify({'success': False, 'message': 'Invalid price format'}), 400
         
-        # Handle image upload
-        image_data = None
+        # Handle image upload: streamed into the image store before any DB work
+        image_hash = None
         image_filename = None
         image_mimetype = None
         
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename != '':
-                # Check if it's an image file
-                allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-                if '.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions:
-                    image_data = file.read()
-                    image_filename = file.filename
-                    image_mimetype = file.mimetype or mimetypes.guess_type(file.filename)[0] or 'image/jpeg'
+                try:
+                    image_hash, image_mimetype = store_uploaded_image(file)
+                except ImageUploadError as e:
+                    return jsonify({'success': False, 'message': str(e)}), 400
+                image_filename = file.filename
         
         # Insert product into database
         conn = get_db_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
-            INSERT INTO products (title, category, gender, price, description, volume, longevity, image_data, image_filename, image_mimetype)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (title, category, gender, price, description, volume, longevity, image_data, image_filename, image_mimetype))
+            INSERT INTO products (title, category, gender, gender_key, price, description, volume, longevity)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (title, category, gender, normalize_gender(gender), price, description, volume, longevity))
         
         product_id = cursor.lastrowid
+        if image_hash:
+            save_product_image(cursor, product_id, image_hash, image_filename, image_mimetype)
+        mark_related_dirty(cursor, [product_id])
+        catalog_cache.bump_version(cursor)
         conn.commit()
         conn.close()
+        catalog_cache.publish()
+        schedule_related_refresh()
+        if image_hash:
+            schedule_image_derivatives()
         
         return jsonify({
             'success': True, 
@@ -308,8 +2916,10 @@ def add_product():
             'product_id': product_id
         })
         
+    except RequestEntityTooLarge:
+        return upload_too_large_response()
     except Exception as e:
-        print(f"Error adding product: {e}")
+        logger.exception('Error adding product')
         return jsonify({'success': False, 'message': 'Failed to add product'}), 500
 
 @app.route('/api/admin/products/<int:product_id>', methods=['PUT'])
@@ -336,6 +2946,16 @@ def update_product_admin(product_id):
         except ValueError:
             return jsonify({'success': False, 'message': 'Invalid price format'}), 400
         
+        # Handle image upload if provided: streamed into the image store before any DB work
+        image_hash = None
+        if 'image' in request.files:
+            file = request.files['image']
+            if file and file.filename != '':
+                try:
+                    image_hash, image_mimetype = store_uploaded_image(file)
+                except ImageUploadError as e:
+                    return jsonify({'success': False, 'message': str(e)}), 400
+        
         # Update product in database
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -346,52 +2966,24 @@ def update_product_admin(product_id):
             conn.close()
             return jsonify({'success': False, 'message': 'Product not found'}), 404
         
-        # Handle image upload if provided
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename != '':
-                # Check if it's an image file
-                allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-                if '.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions:
-                    image_data = file.read()
-                    image_filename = file.filename
-                    image_mimetype = file.mimetype or mimetypes.guess_type(file.filename)[0] or 'image/jpeg'
-                    
-                    # Update with image
-                    cursor.execute('''
-                        UPDATE products 
-                        SET title = ?, category = ?, gender = ?, price = ?, description = ?,
-                            volume = ?, longevity = ?,
-                            image_data = ?, image_filename = ?, image_mimetype = ?
-                        WHERE id = ?
-                    ''', (title, category, gender, price, description, volume, longevity, image_data, image_filename, image_mimetype, product_id))
-                else:
-                    # Update without image (invalid file type)
-                    cursor.execute('''
-                        UPDATE products 
-                        SET title = ?, category = ?, gender = ?, price = ?, description = ?,
-                            volume = ?, longevity = ?
-                        WHERE id = ?
-                    ''', (title, category, gender, price, description, volume, longevity, product_id))
-            else:
-                # Update without image (no file selected)
-                cursor.execute('''
-                    UPDATE products 
-                    SET title = ?, category = ?, gender = ?, price = ?, description = ?,
-                        volume = ?, longevity = ?
-                    WHERE id = ?
-                ''', (title, category, gender, price, description, volume, longevity, product_id))
-        else:
-            # Update without image (no image field)
-            cursor.execute('''
-                UPDATE products 
-                SET title = ?, category = ?, gender = ?, price = ?, description = ?,
-                    volume = ?, longevity = ?
-                WHERE id = ?
-            ''', (title, category, gender, price, description, volume, longevity, product_id))
+        cursor.execute('''
+            UPDATE products 
+            SET title = ?, category = ?, gender = ?, gender_key = ?, price = ?, description = ?,
+                volume = ?, longevity = ?
+            WHERE id = ?
+        ''', (title, category, gender, normalize_gender(gender), price, description, volume, longevity, product_id))
+        
+        if image_hash:
+            save_product_image(cursor, product_id, image_hash, file.filename, image_mimetype)
         
+        mark_related_dirty(cursor, [product_id])
+        catalog_cache.bump_version(cursor)
         conn.commit()
         conn.close()
+        catalog_cache.publish()
+        schedule_related_refresh()
+        if image_hash:
+            schedule_image_derivatives()
         
         return jsonify({
             'success': True, 
@@ -399,8 +2991,10 @@ def update_product_admin(product_id):
             'product_id': product_id
         })
         
+    except RequestEntityTooLarge:
+        return upload_too_large_response()
     except Exception as e:
-        print(f"Error updating product: {e}")
+        logger.exception('Error updating product %s', product_id)
         return jsonify({'success': False, 'message': 'Failed to update product'}), 500
 
 @app.route('/api/admin/products/<int:product_id>', methods=['DELETE'])
@@ -411,13 +3005,13 @@ def delete_product_admin(product_id):
         cursor = conn.cursor()
         
         # Check if product exists
-        product = cursor.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
+        product = cursor.execute('SELECT id FROM products WHERE id = ?', (product_id,)).fetchone()
         if not product:
             conn.close()
             return jsonify({'success': False, 'message': 'Product not found'}), 404
         
         # Check if product has any orders (optional - you might want to prevent deletion if orders exist)
-        orders = cursor.execute('SELECT COUNT(*) FROM orders WHERE product_id = ?', (product_id,)).fetchone()
+        orders = cursor.execute('SELECT COUNT(DISTINCT order_id) FROM order_items WHERE product_id = ?', (product_id,)).fetchone()
         order_count = orders[0] if orders else 0
         
         if order_count > 0:
@@ -427,17 +3021,35 @@ def delete_product_admin(product_id):
                 'message': f'Cannot delete product. It has {order_count} associated order(s). Please cancel or complete those orders first.'
             }), 400
         
-        # Delete the product
+        # Delete the product and its image
+        cursor.execute('DELETE FROM product_images WHERE product_id = ?', (product_id,))
         cursor.execute('DELETE FROM products WHERE id = ?', (product_id,))
+        mark_related_dirty(cursor, [product_id])
+        catalog_cache.bump_version(cursor)
         
         conn.commit()
         conn.close()
+        catalog_cache.publish()
+        schedule_related_refresh()
         
         return jsonify({'success': True, 'message': 'Product deleted successfully'})
     except Exception as e:
-        print(f"Error deleting product: {e}")
+        logger.exception('Error deleting product %s', product_id)
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/admin/db-pool', methods=['GET'])
+def get_db_pool_stats():
+    """Connection pool (and local session store) statistics for this worker process"""
+    stats = {'success': True, 'pool': db_pool.stats()}
+    if isinstance(session_store, SQLiteSessionStore):
+        stats['sessions'] = session_store.stats()
+    return jsonify(stats)
+
+@app.route('/api/admin/auth-metrics', methods=['GET'])
+def get_auth_metrics():
+    """Password hashing pool and login statistics for this worker process"""
+    return jsonify({'success': True, 'auth': password_hasher.stats(), 'rate_limits': rate_limiter.stats()})
+
 @app.route('/api/admin/users', methods=['GET'])
 def get_users_admin():
     try:
@@ -464,77 +3076,107 @@ def get_users_admin():
 
 @app.route('/api/admin/orders', methods=['GET'])
 def get_admin_orders():
-    """Get all orders for admin with user and product details"""
+    """Get a page of orders for admin with user and product details.
+
+    Query parameters: status, user_id, product_id, date_from, date_to
+    (YYYY-MM-DD, inclusive), limit and cursor (from the previous page's
+    next_cursor).
+    """
+    try:
+        conditions = []
+        params = []
+        
+        status = request.args.get('status', '').strip()
+        if status:
+            conditions.append('o.order_status = ?')
+            params.append(status)
+        user_id = request.args.get('user_id', '').strip()
+        if user_id:
+            conditions.append('o.user_id = ?')
+            params.append(int(user_id))
+        product_id = request.args.get('product_id', '').strip()
+        if product_id:
+            conditions.append('o.id IN (SELECT order_id FROM order_items WHERE product_id = ?)')
+            params.append(int(product_id))
+        date_from = request.args.get('date_from', '').strip()
+        if date_from:
+            conditions.append('o.created_at >= ?')
+            params.append(datetime.strptime(date_from, '%Y-%m-%d').strftime('%Y-%m-%d'))
+        date_to = request.args.get('date_to', '').strip()
+        if date_to:
+            conditions.append('o.created_at < ?')
+            params.append((datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d'))
+        
+        limit = parse_page_size(request.args.get('limit'))
+        filter_where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        filter_params = list(params)
+        
+        page_cursor = request.args.get('cursor')
+        if page_cursor:
+            created_at, order_id = decode_cursor(page_cursor, str, int)
+            conditions.append('(o.created_at, o.id) < (?, ?)')
+            params.extend([created_at, order_id])
+        page_where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid query parameter: {e}'}), 400
+    
     try:
-        print("DEBUG: Admin orders endpoint called")
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Get all orders with user details AND product details from products table
-        orders = cursor.execute('''
-            SELECT o.*, 
-                   u.first_name, u.last_name, u.email,
-                   p.title as product_title_from_products,
-                   p.image_filename as product_image_from_products
+        orders = cursor.execute(f'''
+            SELECT o.id, o.user_id, o.total_amount, o.item_count, o.order_status, o.created_at,
+                   u.first_name, u.last_name, u.email
             FROM orders o
             LEFT JOIN users u ON o.user_id = u.id
-            LEFT JOIN products p ON o.product_id = p.id
-            ORDER BY o.created_at DESC
-        ''').fetchall()
-        
+            {page_where}
+            ORDER BY o.created_at DESC, o.id DESC
+            LIMIT ?
+        ''', params + [limit + 1]).fetchall()
+        
+        # Only count on the first page; later pages reuse the client's hint
+        total_count, total_capped = (None, False)
+        if not page_cursor:
+            total_count, total_capped = count_hint(cursor, f'FROM orders o {filter_where}', filter_params)
+        
+        has_more = len(orders) > limit
+        orders = orders[:limit]
+        items = fetch_order_items(cursor, [order['id'] for order in orders])
         conn.close()
-        print(f"DEBUG: Found {len(orders)} orders")
         
         orders_list = []
         for order in orders:
-            try:
-                # Convert row to dict for easier access
-                order_dict = dict(order)
-                print(f"DEBUG: Processing order {order_dict.get('id', 'unknown')}")
-                
-                # Get user name safely
-                first_name = order_dict.get('first_name') or 'Unknown'
-                last_name = order_dict.get('last_name') or 'User'
-                email = order_dict.get('email') or 'No email'
-                
-                # Get product info - try from products table first, then from order table
-                product_title = (order_dict.get('product_title_from_products') or 
-                               order_dict.get('product_title') or 
-                               'Unknown Product')
-                
-                # For product image, use database image endpoint if product_id exists
-                product_id = order_dict.get('product_id')
-                if product_id:
-                    product_image = f"/api/product-image/{product_id}?t={int(time.time()*1000)}"
-                else:
-                    product_image = order_dict.get('product_image') or '/images/placeholder.svg'
-                
-                order_data = {
-                    'id': order_dict.get('id'),
-                    'user_id': order_dict.get('user_id'),
-                    'user_name': f"{first_name} {last_name}",
-                    'user_email': email,
-                    'total_amount': float(order_dict.get('total_amount', 0)),
-                    'order_status': order_dict.get('order_status', 'pending'),
-                    'created_at': order_dict.get('created_at', ''),
-                    'product_title': product_title,
-                    'quantity': order_dict.get('quantity', 1),
-                    'price': float(order_dict.get('price', 0)),
-                    'product_image': product_image,
-                    'product_id': product_id
-                }
-                orders_list.append(order_data)
-                print(f"DEBUG: Order {order_dict.get('id')} - Product: {product_title}")
-                
-            except Exception as order_error:
-                print(f"DEBUG: Error processing order: {order_error}")
-                continue
+            order_dict = dict(order)
+            
+            # Get user name safely
+            first_name = order_dict.get('first_name') or 'Unknown'
+            last_name = order_dict.get('last_name') or 'User'
+            email = order_dict.get('email') or 'No email'
+            
+            orders_list.append({
+                'id': order_dict.get('id'),
+                'user_id': order_dict.get('user_id'),
+                'user_name': f"{first_name} {last_name}",
+                'user_email': email,
+                'total_amount': float(order_dict.get('total_amount') or 0),
+                'order_status': order_dict.get('order_status') or 'pending',
+                'created_at': order_dict.get('created_at') or '',
+                'item_count': order_dict.get('item_count') or 0,
+                **order_summary(items[order['id']])
+            })
         
-        print(f"DEBUG: Returning {len(orders_list)} orders")
-        return jsonify({'success': True, 'orders': orders_list})
+        next_cursor = encode_cursor(orders[-1]['created_at'], orders[-1]['id']) if has_more else None
+        return jsonify({
+            'success': True,
+            'orders': orders_list,
+            'next_cursor': next_cursor,
+            'has_more': has_more,
+            'total_count': total_count,
+            'total_count_capped': total_capped
+        })
         
     except Exception as e:
-        print(f"ERROR: Admin orders failed: {e}")
+        logger.exception('Admin orders failed')
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/admin/orders/<int:order_id>/status', methods=['PUT'])
@@ -551,15 +3193,21 @@ def update_order_status(order_id):
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
+        # Lock before reading the old status so the rollups move it exactly once
+        cursor.execute('BEGIN IMMEDIATE')
         
         # Check if order exists
-        order = cursor.execute('SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
+        order = cursor.execute('SELECT id, order_status, total_amount, created_at FROM orders WHERE id = ?', (order_id,)).fetchone()
         if not order:
+            conn.rollback()
             conn.close()
             return jsonify({'success': False, 'message': 'Order not found'}), 404
         
         # Update order status
-        cursor.execute('UPDATE orders SET order_status = ? WHERE id = ?', (new_status, order_id))
+        if order['order_status'] != new_status:
+            cursor.execute('UPDATE orders SET order_status = ? WHERE id = ?', (new_status, order_id))
+            record_order_sales(cursor, order, -1)
+            record_order_sales(cursor, order, 1, new_status)
         conn.commit()
         conn.close()
         
@@ -573,15 +3221,11 @@ def get_order_details(order_id):
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Fetch the order with user details AND product details
+        # Fetch the order header with user details, then its items
         order = cursor.execute('''
-            SELECT o.*, 
-                   u.first_name, u.last_name, u.email,
-                   p.title as product_title_from_products,
-                   p.image_filename as product_image_from_products
+            SELECT o.*, u.first_name, u.last_name, u.email
             FROM orders o
             LEFT JOIN users u ON o.user_id = u.id
-            LEFT JOIN products p ON o.product_id = p.id
             WHERE o.id = ?
         ''', (order_id,)).fetchone()
 
@@ -589,105 +3233,34 @@ def get_order_details(order_id):
             conn.close()
             return jsonify({'success': False, 'message': 'Order not found'}), 404
 
+        items = fetch_order_items(cursor, [order_id])[order_id]
+        conn.close()
+
         # Convert to dict for easier access
         order_dict = dict(order)
-        user_id = order_dict.get('user_id')
 
         # Get user name safely
         first_name = order_dict.get('first_name') or 'Unknown'
         last_name = order_dict.get('last_name') or 'User'
         user_name = f"{first_name} {last_name}".strip()
-        
-        # Get user's address (try default first, then any address)
-        shipping_address = 'Address will be collected during delivery'  # Default fallback
-        if user_id:
-            # Try to get default address first
-            address = cursor.execute('''
-                SELECT * FROM addresses 
-                WHERE user_id = ? AND is_default = 1 
-                ORDER BY created_at DESC LIMIT 1
-            ''', (user_id,)).fetchone()
-            
-            # If no default address, get the most recent address
-            if not address:
-                address = cursor.execute('''
-                    SELECT * FROM addresses 
-                    WHERE user_id = ? 
-                    ORDER BY created_at DESC LIMIT 1
-                ''', (user_id,)).fetchone()
-            
-            # Format address if found
-            if address:
-                address_dict = dict(address)
-                address_parts = []
-                
-                if address_dict.get('name'):
-                    address_parts.append(f"Name: {address_dict['name']}")
-                
-                if address_dict.get('street_address'):
-                    address_parts.append(address_dict['street_address'])
-                
-                if address_dict.get('landmark'):
-                    address_parts.append(f"Near {address_dict['landmark']}")
-                
-                city_state = []
-                if address_dict.get('city'):
-                    city_state.append(address_dict['city'])
-                if address_dict.get('state'):
-                    city_state.append(address_dict['state'])
-                if city_state:
-                    address_parts.append(', '.join(city_state))
-                
-                if address_dict.get('postal_code'):
-                    address_parts.append(f"PIN: {address_dict['postal_code']}")
-                
-                if address_dict.get('country'):
-                    address_parts.append(address_dict['country'])
-                
-                if address_dict.get('phone'):
-                    address_parts.append(f"Phone: {address_dict['phone']}")
-                
-                if address_parts:
-                    shipping_address = '\n'.join(address_parts)
-        
-        # Get product info - try from products table first, then from order table
-        product_title = (order_dict.get('product_title_from_products') or 
-                        order_dict.get('product_title') or 
-                        'Unknown Product')
-        
-        # For product image, use database image endpoint if product_id exists
-        product_id = order_dict.get('product_id')
-        if product_id:
-            product_image = f"/api/product-image/{product_id}?t={int(time.time()*1000)}"
-        else:
-            product_image = order_dict.get('product_image') or '/images/placeholder.svg'
-
-        # Create items list from order data
-        items_list = [{
-            'product_title': product_title,
-            'product_image': product_image,
-            'quantity': order_dict.get('quantity', 1),
-            'price': float(order_dict.get('price', 0))
-        }]
 
         order_data = {
             'id': order_dict.get('id'),
             'user_id': order_dict.get('user_id'),
             'user_name': user_name,
             'user_email': order_dict.get('email') or 'No email',
-            'total_amount': float(order_dict.get('total_amount', 0)),
+            'total_amount': float(order_dict.get('total_amount') or 0),
             'payment_method': 'Cash on Delivery',  # Default payment method
             'status': order_dict.get('order_status', 'pending'),
-            'shipping_address': shipping_address,
+            'shipping_address': order_dict.get('shipping_address') or 'Address will be collected during delivery',
             'created_at': order_dict.get('created_at', ''),
-            'items': items_list
+            'items': [order_item_to_dict(item) for item in items]
         }
 
-        conn.close()
         return jsonify({'success': True, 'order': order_data})
         
     except Exception as e:
-        print(f"Error getting order details: {e}")
+        logger.exception('Error getting order details')
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/admin/users/<int:user_id>', methods=['GET'])
@@ -707,7 +3280,7 @@ def get_user_details(user_id):
         addresses = cursor.execute('SELECT * FROM addresses WHERE user_id = ?', (user_id,)).fetchall()
         
         # Get user's orders
-        orders = cursor.execute('SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC', (user_id,)).fetchall()
+        orders = cursor.execute('SELECT id, total_amount, order_status, created_at FROM orders WHERE user_id = ? ORDER BY created_at DESC', (user_id,)).fetchall()
         
         # Format addresses
         address_list = []
@@ -762,6 +3335,266 @@ def get_user_details(user_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# --- Rate Limiting ---
+# Token buckets for the credential endpoints, checked before any user lookup
+# or password hash. Buckets live in a bounded per-process LRU; with
+# FAJR_RATE_LIMIT_BACKEND=sqlite they are also shared across workers through
+# the rate_limits table, with the local bucket as a prefilter.
+RATE_LIMIT_BACKEND = os.environ.get('FAJR_RATE_LIMIT_BACKEND', 'memory')
+# Reverse proxies in front of the app whose X-Forwarded-For can be trusted
+TRUSTED_PROXIES = int(os.environ.get('FAJR_TRUSTED_PROXIES', 0))
+# name -> (bucket capacity, tokens refilled per second)
+RATE_LIMITS = {
+    'login_ip': (20, 20 / 60),
+    'login_identifier': (10, 10 / 600),
+    'register_ip': (10, 10 / 3600),
+}
+RATE_LIMIT_MAX_KEYS = 100000
+RATE_LIMIT_SWEEP_INTERVAL = 300
+# Shared buckets are taken while the request may already hold a db_pool connection
+RATE_LIMIT_DB_POOL_SIZE = 2
+
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+class TokenBucketLimiter:
+    """Per-key token buckets; take() returns 0 when allowed, else seconds to wait"""
+
+    def __init__(self, limits, max_keys=RATE_LIMIT_MAX_KEYS, shared=False, pool_size=RATE_LIMIT_DB_POOL_SIZE):
+        self.limits = limits
+        self.max_keys = max_keys
+        self.shared = shared
+        self.pool = ConnectionPool(DATABASE, pool_size, DB_POOL_TIMEOUT) if shared else None
+        # A bucket untouched this long is full again and can be forgotten
+        self.idle_seconds = max(capacity / rate for capacity, rate in limits.values())
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # 'name:key' -> [tokens, updated_at]
+        self._next_sweep = 0.0
+        self._stats = {name: {'allowed': 0, 'rejected': 0} for name in limits}
+
+    def _take_local(self, bucket, capacity, rate, now):
+        with self._lock:
+            state = self._buckets.get(bucket)
+            if state is None:
+                state = self._buckets[bucket] = [float(capacity), now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(bucket)
+            state[0] = min(capacity, state[0] + max(0.0, now - state[1]) * rate)
+            state[1] = now
+            if state[0] >= 1:
+                state[0] -= 1
+                return True, state[0]
+            return False, state[0]
+
+    def _take_shared(self, bucket, capacity, rate, now):
+        # Refill and take in one statement; SET expressions all see the old row
+        conn = self.pool.acquire()
+        try:
+            refilled = 'MIN(:capacity, tokens + MAX(0, :now - updated_at) * :rate)'
+            allowed, tokens = conn.execute(f'''
+                INSERT INTO rate_limits (bucket, tokens, updated_at, allowed) VALUES (:bucket, :capacity - 1, :now, 1)
+                ON CONFLICT (bucket) DO UPDATE SET
+                    tokens = CASE WHEN {refilled} >= 1 THEN {refilled} - 1 ELSE {refilled} END,
+                    allowed = {refilled} >= 1,
+                    updated_at = MAX(updated_at, :now)
+                RETURNING allowed, tokens
+            ''', {'bucket': bucket, 'capacity': capacity, 'rate': rate, 'now': now}).fetchone()
+            if now >= self._next_sweep:
+                self._next_sweep = now + RATE_LIMIT_SWEEP_INTERVAL
+                conn.execute('DELETE FROM rate_limits WHERE updated_at < ?', (now - self.idle_seconds,))
+            conn.commit()
+        finally:
+            conn.close()
+        return bool(allowed), tokens
+
+    def take(self, name, key):
+        capacity, rate = self.limits[name]
+        bucket = f'{name}:{key}'
+        now = time.time()
+        allowed, tokens = self._take_local(bucket, capacity, rate, now)
+        if allowed and self.shared:
+            allowed, tokens = self._take_shared(bucket, capacity, rate, now)
+        with self._lock:
+            self._stats[name]['allowed' if allowed else 'rejected'] += 1
+        return 0 if allowed else max(1, math.ceil((1 - tokens) / rate))
+
+    def stats(self):
+        with self._lock:
+            stats = {'backend': 'sqlite' if self.shared else 'memory', 'tracked_keys': len(self._buckets),
+                     'limits': {name: dict(counts) for name, counts in self._stats.items()}}
+        if self.pool:
+            stats['pool'] = self.pool.stats()
+        return stats
+
+rate_limiter = TokenBucketLimiter(RATE_LIMITS, shared=RATE_LIMIT_BACKEND == 'sqlite')
+
+def rate_limited(*checks):
+    """Take a token from each (limit name, key) bucket; returns a 429 response if any is empty"""
+    retry_after = 0
+    for name, key in checks:
+        if key:
+            retry_after = rate_limiter.take(name, str(key).strip().lower())
+            if retry_after:
+                break
+    if not retry_after:
+        return None
+    response = jsonify({'success': False, 'message': 'Too many attempts, please try again later'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+# --- Password Hashing ---
+# Stored as scheme$cost...$salt$key. The scheme and cost for new hashes come
+# from the environment; older hashes (including the legacy unsalted SHA-256
+# hex digests) still verify and are upgraded on the next successful login.
+PASSWORD_SCHEME = os.environ.get('FAJR_PASSWORD_SCHEME', 'scrypt')
+SCRYPT_N = int(os.environ.get('FAJR_SCRYPT_N', 2 ** 14))
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = int(os.environ.get('FAJR_PBKDF2_ITERATIONS', 600000))
+PASSWORD_SALT_BYTES = 16
+PASSWORD_WORKERS = int(os.environ.get('FAJR_PASSWORD_WORKERS', min(4, os.cpu_count() or 1)))
+PASSWORD_MAX_PENDING = int(os.environ.get('FAJR_PASSWORD_MAX_PENDING', 32))
+LEGACY_PASSWORD_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+def current_password_params():
+    if PASSWORD_SCHEME == 'scrypt':
+        return 'scrypt', (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    if PASSWORD_SCHEME == 'pbkdf2_sha256':
+        return 'pbkdf2_sha256', (PBKDF2_ITERATIONS,)
+    raise ValueError(f'Unknown FAJR_PASSWORD_SCHEME: {PASSWORD_SCHEME}')
+
+def derive_password_key(scheme, params, password, salt):
+    if scheme == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * r * (n + p) + (1 << 20), dklen=32)
+    if scheme == 'pbkdf2_sha256':
+        (iterations,) = params
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    raise ValueError(f'Unknown password scheme: {scheme}')
+
+def hash_password_sync(password):
+    scheme, params = current_password_params()
+    salt = secrets.token_bytes(PASSWORD_SALT_BYTES)
+    key = derive_password_key(scheme, params, password, salt)
+    return '$'.join([scheme, *map(str, params),
+                     base64.b64encode(salt).decode('ascii'), base64.b64encode(key).decode('ascii')])
+
+def verify_password_sync(password, stored_hash):
+    """Check a password against a stored hash; returns (matches, needs_rehash)"""
+    if not stored_hash:
+        return False, False
+    if LEGACY_PASSWORD_HASH.match(stored_hash):
+        matches = hmac.compare_digest(hashlib.sha256(password.encode('utf-8')).hexdigest(), stored_hash)
+        return matches, matches
+    try:
+        scheme, *fields = stored_hash.split('$')
+        params = tuple(int(field) for field in fields[:-2])
+        salt = base64.b64decode(fields[-2])
+        expected = base64.b64decode(fields[-1])
+        key = derive_password_key(scheme, params, password, salt)
+    except (ValueError, IndexError):
+        return False, False
+    matches = hmac.compare_digest(key, expected)
+    return matches, matches and (scheme, params) != current_password_params()
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool's queue is full"""
+
+class PasswordHasher:
+    """Runs password hashing on a bounded thread pool and keeps latency figures.
+
+    The calling request thread still waits for its result. What the pool adds
+    is a cap: at most `workers` hashes run at once per process, and at most
+    `max_pending` may be running or queued; beyond that callers get
+    PasswordHasherBusy (503) instead of piling up behind a slow queue. With
+    threaded gunicorn workers (--threads), other requests keep being served
+    meanwhile since hashlib's scrypt and pbkdf2 release the GIL; a sync worker
+    is busy for the whole hash either way.
+    """
+
+    def __init__(self, workers, max_pending, sample_size=1000):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.sample_size = sample_size
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._timings = {'hash': deque(maxlen=self.sample_size), 'verify': deque(maxlen=self.sample_size)}
+        self._logins = deque(maxlen=self.sample_size)  # completion times, for throughput
+        self._stats = {'hashes': 0, 'verifies': 0, 'rejected': 0, 'login_success': 0,
+                       'login_failure': 0, 'rehashed': 0}
+
+    def _run(self, operation, fn, *args):
+        """Run fn on the pool; operation is 'hash' or 'verify', or None to leave the statistics alone"""
+        if os.getpid() != self._pid:
+            # Forked: the parent's pool threads don't exist here
+            self._reset()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise PasswordHasherBusy()
+        start = time.perf_counter()
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+            if operation:
+                with self._lock:
+                    self._timings[operation].append((time.perf_counter() - start) * 1000)
+                    self._stats['hashes' if operation == 'hash' else 'verifies'] += 1
+
+    def hash(self, password):
+        return self._run('hash', hash_password_sync, password)
+
+    def verify(self, password, stored_hash):
+        return self._run('verify', verify_password_sync, password, stored_hash)
+
+    def hash_uncounted(self, password):
+        """Hash on the pool without counting it in the login statistics (startup work)"""
+        return self._run(None, hash_password_sync, password)
+
+    def record_login(self, success, rehashed=False):
+        with self._lock:
+            self._stats['login_success' if success else 'login_failure'] += 1
+            self._stats['rehashed'] += int(rehashed)
+            self._logins.append(time.time())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            timings = {operation: sorted(samples) for operation, samples in self._timings.items()}
+            recent = [t for t in self._logins if t >= time.time() - 60]
+        scheme, params = current_password_params()
+        stats.update({'pid': self._pid, 'workers': self.workers, 'max_pending': self.max_pending,
+                      'scheme': scheme, 'params': params, 'logins_last_minute': len(recent)})
+        for operation, samples in timings.items():
+            stats[f'{operation}_ms'] = {
+                'samples': len(samples),
+                'p50': samples[len(samples) // 2] if samples else None,
+                'p95': samples[int(len(samples) * 0.95)] if samples else None,
+                'max': samples[-1] if samples else None
+            }
+        return stats
+
+password_hasher = PasswordHasher(PASSWORD_WORKERS, PASSWORD_MAX_PENDING)
+# A real hash to verify against when the account doesn't exist, so both paths
+# cost the same. Computed once at startup, on the pool like every other hash.
+DUMMY_PASSWORD_HASH = password_hasher.hash_uncounted(secrets.token_hex(16))
+
+def password_pool_busy_response():
+    response = jsonify({'success': False, 'message': 'Server is busy, please try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 # Authentication API Routes
 @app.route('/api/register', methods=['POST'])
 def register():
@@ -769,7 +3602,7 @@ def register():
     first_name = data.get('first_name')
     last_name = data.get('last_name')
     email = data.get('email')
-    phone = data.get('phone')
+    phone = data.get('phone') or None
     password = data.get('password')
     gender = data.get('gender')
     date_of_birth = data.get('date_of_birth')
@@ -777,6 +3610,10 @@ def register():
     if not first_name or not last_name or not email or not password:
         return jsonify({'success': False, 'message': 'Missing required fields'}), 400
     
+    limited = rate_limited(('register_ip', request.remote_addr))
+    if limited:
+        return limited
+    
     conn = None
     try:
         conn = get_db_connection()
@@ -803,8 +3640,8 @@ def register():
                     'message': 'Phone number is already registered'
                 }), 400
         
-        # Hash password
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
+        # Hash password (on the bounded hashing pool)
+        password_hash = password_hasher.hash(password)
         
         # Insert new user
         cursor.execute('''
@@ -830,8 +3667,15 @@ def register():
                 'email': email
             }
         })
+    except PasswordHasherBusy:
+        return password_pool_busy_response()
+    except sqlite3.IntegrityError:
+        # Lost a race with a concurrent registration (unique email/phone index)
+        if conn:
+            conn.rollback()
+        return jsonify({'success': False, 'message': 'Email or phone number is already registered'}), 400
     except Exception as e:
-        print(f"Registration error: {e}")
+        logger.exception('Registration error')
         if conn:
             conn.rollback()
         return jsonify({'success': False, 'message': f'Registration failed: {str(e)}'}), 500
@@ -850,6 +3694,10 @@ def login():
     if (not email and not phone) or not password:
         return jsonify({'success': False, 'message': 'Provide email or phone, and password'}), 400
     
+    limited = rate_limited(('login_ip', request.remote_addr), ('login_identifier', email or phone))
+    if limited:
+        return limited
+    
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -862,54 +3710,56 @@ def login():
         
         if not user:
             conn.close()
-            print(f"DEBUG - No user found with identifier: {email or phone}")
+            logger.debug('Login failed, no user found for %s', email or phone)
+            # Same cost as a wrong password, so response times don't reveal which accounts exist
+            password_hasher.verify(password, DUMMY_PASSWORD_HASH)
+            password_hasher.record_login(False)
             return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
         
-        # Hash the entered password
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
         stored_hash = row_get(user, 'password_hash')
-        
-        print(f"DEBUG - Login attempt for: {email or phone}")
-        print(f"DEBUG - Entered password hash: {password_hash}")
-        print(f"DEBUG - Stored password hash: {stored_hash}")
-        print(f"DEBUG - Hashes match: {stored_hash == password_hash}")
+        logger.debug('Login attempt for %s', email or phone)
         
         # Check if password_hash column exists and has value
         if not stored_hash:
             # Try to check if old 'password' column exists for migration
             try:
                 old_password = row_get(user, 'password')
-                if old_password:
-                    print(f"DEBUG - Found old password column, checking against it...")
-                    # Check if the entered password matches the old plain text password
-                    if old_password == password:
-                        # Migrate: Hash the old password and update
-                        new_hash = hashlib.sha256(old_password.encode()).hexdigest()
-                        cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_hash, row_get(user, 'id')))
-                        conn.commit()
-                        stored_hash = new_hash
-                        print(f"DEBUG - Migrated password hash for {email or phone}")
-                    else:
-                        conn.close()
-                        print(f"DEBUG - Password verification failed during migration for {email or phone}")
-                        return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
+                if old_password and hmac.compare_digest(str(old_password).encode('utf-8'), password.encode('utf-8')):
+                    # Migrate: hash the old plain text password with the current scheme
+                    stored_hash = password_hasher.hash(old_password)
+                    cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (stored_hash, row_get(user, 'id')))
+                    conn.commit()
+                    logger.info('Migrated plain-text password to a hash', extra={'user_id': row_get(user, 'id')})
                 else:
                     conn.close()
-                    print(f"DEBUG - No password found for user {email or phone}")
+                    logger.debug('Login failed, no usable password for %s', email or phone)
+                    password_hasher.record_login(False)
                     return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
+            except PasswordHasherBusy:
+                raise
             except Exception as migrate_error:
-                print(f"DEBUG - Migration error: {migrate_error}")
+                logger.warning('Password migration failed: %s', migrate_error)
                 conn.close()
                 return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
         
         # Verify password hash
-        if stored_hash != password_hash:
+        matches, needs_rehash = password_hasher.verify(password, stored_hash)
+        if not matches:
             conn.close()
-            print(f"DEBUG - Password verification failed for {email or phone}")
+            logger.debug('Login failed, wrong password for %s', email or phone)
+            password_hasher.record_login(False)
             return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
         
+        if needs_rehash:
+            # Legacy or outdated cost: upgrade now that we have the plain text.
+            # Only if nobody changed the hash in the meantime.
+            cursor.execute('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                           (password_hasher.hash(password), row_get(user, 'id'), stored_hash))
+            conn.commit()
+        password_hasher.record_login(True, rehashed=needs_rehash)
+        
         conn.close()
-        print(f"DEBUG - Login successful for {email or phone}")
+        logger.debug('Login successful for %s', email or phone)
         
         # Set session
         session['user_id'] = row_get(user, 'id')
@@ -926,8 +3776,10 @@ def login():
                 'email': row_get(user, 'email')
             }
         })
+    except PasswordHasherBusy:
+        return password_pool_busy_response()
     except Exception as e:
-        print(f"DEBUG - Login error: {str(e)}")
+        logger.exception('Login error')
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/logout', methods=['POST'])
@@ -1011,7 +3863,7 @@ def update_user():
                 date_of_birth = ?, gender = ?, preferred_fragrance = ?
             WHERE id = ?
         ''', (
-            data.get('first_name'), data.get('last_name'), data.get('phone'),
+            data.get('first_name'), data.get('last_name'), data.get('phone') or None,
             data.get('date_of_birth'), data.get('gender'), data.get('preferred_fragrance'),
             user_id
         ))
@@ -1022,18 +3874,19 @@ def update_user():
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
-            cursor.execute('''
-                DELETE FROM orders 
-                WHERE user_id = ? 
-                  AND id NOT IN (
-                      SELECT id FROM orders 
-                      WHERE user_id = ? 
-                      ORDER BY datetime(created_at) DESC, id DESC 
-                      LIMIT 50
-                  )
-            ''', (user_id, user_id))
+            stale = [row[0] for row in cursor.execute('''
+                SELECT id FROM orders
+                WHERE user_id = ?
+                ORDER BY created_at DESC, id DESC
+                LIMIT -1 OFFSET 50
+            ''', (user_id,)).fetchall()]
+            if stale:
+                mark_user_purchases_related_dirty(cursor, user_id)
+                delete_orders(cursor, stale)
             conn.commit()
             conn.close()
+            if stale:
+                schedule_related_refresh()
         except Exception as _cleanup_err:
             # Best-effort cleanup; do not fail the request
             pass
@@ -1053,14 +3906,16 @@ def delete_user():
         user_id = session['user_id']
         conn = get_db_connection()
         cursor = conn.cursor()
-        # Delete user's orders
-        cursor.execute('DELETE FROM orders WHERE user_id = ?', (user_id,))
+        # Delete user's orders (their co-purchase pairs go with them)
+        mark_user_purchases_related_dirty(cursor, user_id)
+        delete_orders(cursor, [row[0] for row in cursor.execute('SELECT id FROM orders WHERE user_id = ?', (user_id,))])
         # Delete user's addresses
         cursor.execute('DELETE FROM addresses WHERE user_id = ?', (user_id,))
         # Finally delete the user
         cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
         conn.commit()
         conn.close()
+        schedule_related_refresh()
         session.clear()
         return jsonify({'success': True, 'message': 'Account deleted successfully'})
     except Exception as e:
@@ -1075,14 +3930,14 @@ def get_user_orders():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Get orders with product details
+        # Get order headers, then all their items in one read
         orders = cursor.execute('''
-            SELECT o.*, p.title, p.price as product_price, p.image_url
-            FROM orders o
-            LEFT JOIN products p ON o.product_id = p.id
-            WHERE o.user_id = ?
-            ORDER BY o.created_at DESC
+            SELECT id, total_amount, item_count, payment_method, payment_status, order_status, created_at
+            FROM orders
+            WHERE user_id = ?
+            ORDER BY created_at DESC
         ''', (session['user_id'],)).fetchall()
+        items = fetch_order_items(cursor, [order['id'] for order in orders])
         
         conn.close()
         
@@ -1090,10 +3945,9 @@ def get_user_orders():
         for order in orders:
             orders_list.append({
                 'id': order['id'],
-                'product_id': order['product_id'],
-                'product_title': order['title'],
-                'product_image': f"/api/product-image/{order['product_id']}?t={int(time.time()*1000)}",
-                'quantity': order['quantity'],
+                **order_summary(items[order['id']]),
+                'item_count': order['item_count'],
+                'items': [order_item_to_dict(item) for item in items[order['id']]],
                 'total_amount': order['total_amount'],
                 'payment_method': order['payment_method'],
                 'payment_status': order['payment_status'],
@@ -1104,7 +3958,7 @@ def get_user_orders():
         return jsonify({'success': True, 'orders': orders_list})
         
     except Exception as e:
-        print(f"Error fetching orders: {e}")
+        logger.exception('Error fetching orders')
         # Return empty list if orders table doesn't exist or other error
         return jsonify({'success': True, 'orders': []})
 
@@ -1181,12 +4035,12 @@ def add_address():
 
         # Insert new address
         cursor.execute('''
-            INSERT INTO addresses (user_id, title, first_name, last_name, street_address, apartment, 
+            INSERT INTO addresses (user_id, title, name, first_name, last_name, street_address, landmark, apartment, 
                                  city, state, postal_code, country, phone, is_default, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
-            user_id, title, first_name, last_name,
-            data['street_address'], apartment, data['city'],
+            user_id, title, name, first_name, last_name,
+            data['street_address'], apartment, apartment, data['city'],
             data['state'], data['postal_code'], data['country'], data['phone'],
             1 if data.get('is_default') else 0, datetime.now().isoformat()
         ))
@@ -1237,14 +4091,16 @@ def update_address(address_id):
         # Update address
         cursor.execute('''
             UPDATE addresses SET 
-                title = ?, first_name = ?, last_name = ?, street_address = ?, apartment = ?,
+                title = ?, name = ?, first_name = ?, last_name = ?, street_address = ?, landmark = ?, apartment = ?,
                 city = ?, state = ?, postal_code = ?, country = ?, phone = ?, is_default = ?
             WHERE id = ? AND user_id = ?
         ''', (
             (title if title is not None else address['title']),
+            (name.strip() if name is not None else address['name']),
             (first_name if first_name is not None else address['first_name']),
             (last_name if last_name is not None else address['last_name']),
             data.get('street_address', address['street_address']),
+            (apartment if apartment is not None else address['landmark']),
             (apartment if apartment is not None else address['apartment']),
             data.get('city', address['city']),
             data.get('state', address['state']),
@@ -1322,144 +4178,209 @@ def get_address(address_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# Upper bound on cart lines per checkout, keeps the IN (...) lookup bounded
+MAX_ORDER_ITEMS = 100
+
 @app.route('/api/place-order', methods=['POST'])
 def place_order():
-    """Place a new order"""
+    """Place a new order: one header plus an order_items row per cart line, priced from the catalog"""
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         user_id = session['user_id']
         
-        print(f"DEBUG - Place order data received: {data}")
-        print(f"DEBUG - User ID: {user_id}")
-        
-        # Validate required fields for cart-based orders
-        items = data.get('items', [])
-        total_amount = data.get('total_amount') or data.get('totalAmount')
+        # Validate required fields for cart-based orders; client prices and
+        # totals are ignored, the catalog is the source of truth
+        items = data.get('items') or []
         payment_method = data.get('payment_method') or data.get('paymentMethod')
+        payment_id = data.get('payment_id') or data.get('paymentId')
         address_id = data.get('address_id') or data.get('addressId')
+        idempotency_key = (request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '').strip() or None
         
-        print(f"DEBUG - Parsed data: items={items}, total_amount={total_amount}, payment_method={payment_method}, address_id={address_id}")
-        
-        if not items:
-            print("DEBUG - Error: No items in cart")
+        if idempotency_key and len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return jsonify({'success': False, 'message': 'Idempotency key is too long'}), 400
+        if not items or not isinstance(items, list):
             return jsonify({'success': False, 'message': 'Cart items are required'}), 400
-        if not total_amount:
-            print("DEBUG - Error: No total amount")
-            return jsonify({'success': False, 'message': 'Total amount is required'}), 400
+        if len(items) > MAX_ORDER_ITEMS:
+            return jsonify({'success': False, 'message': f'At most {MAX_ORDER_ITEMS} items per order'}), 400
         if not payment_method:
-            print("DEBUG - Error: No payment method")
             return jsonify({'success': False, 'message': 'Payment method is required'}), 400
         
+        cart = []
+        for item in items:
+            try:
+                product_id = int(item.get('product_id'))
+                quantity = int(item.get('quantity', 1))
+            except (TypeError, ValueError, AttributeError):
+                return jsonify({'success': False, 'message': 'Product ID is required for all items'}), 400
+            if quantity < 1:
+                return jsonify({'success': False, 'message': 'Quantity must be at least 1'}), 400
+            cart.append((product_id, quantity))
+        
         conn = get_db_connection()
         cursor = conn.cursor()
-        
-        # Process each item in the cart
-        order_ids = []
-        for i, item in enumerate(items):
-            print(f"DEBUG - Processing item {i+1}: {item}")
-            
-            product_id = item.get('product_id')
-            quantity = item.get('quantity', 1)
-            price = item.get('price', 0)
-            
-            print(f"DEBUG - Item details: product_id={product_id}, quantity={quantity}, price={price}")
-            
-            if not product_id:
+        fingerprint = None
+        if idempotency_key:
+            schedule_idempotency_purge()
+            fingerprint = checkout_fingerprint(cart, payment_method, address_id)
+            # Retries are answered from the key table without taking the write lock
+            previous = find_idempotent_order(cursor, user_id, idempotency_key)
+            if previous:
                 conn.close()
-                print("DEBUG - Error: Missing product_id")
-                return jsonify({'success': False, 'message': 'Product ID is required for all items'}), 400
-            
-            # Verify product exists
-            print(f"DEBUG - Checking if product {product_id} exists...")
-            product = cursor.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
-            if not product:
+                return replay_idempotent_order(previous, fingerprint)
+        try:
+            # Take the write lock up front so pricing and inserts see one snapshot
+            cursor.execute('BEGIN IMMEDIATE')
+            if idempotency_key:
+                # A parallel duplicate may have committed while we waited for the lock
+                previous = find_idempotent_order(cursor, user_id, idempotency_key)
+                if previous:
+                    conn.rollback()
+                    return replay_idempotent_order(previous, fingerprint)
+            product_ids = sorted({product_id for product_id, _ in cart})
+            placeholders = ','.join('?' * len(product_ids))
+            products = {row['id']: row for row in cursor.execute(
+                f'SELECT id, title, price, image_hash, gender_key, category FROM products WHERE id IN ({placeholders})',
+                product_ids).fetchall()}
+            missing = [product_id for product_id in product_ids if product_id not in products]
+            if missing:
+                conn.rollback()
                 conn.close()
-                print(f"DEBUG - Error: Product {product_id} not found")
-                return jsonify({'success': False, 'message': f'Product {product_id} not found'}), 404
-            
-            print(f"DEBUG - Product found: {product[1] if product else 'None'}")
+                return jsonify({'success': False, 'message': f'Product {missing[0]} not found'}), 404
             
-            # Calculate item total
-            item_total = price * quantity
-            print(f"DEBUG - Item total: {price} * {quantity} = {item_total}")
+            # Snapshot what the customer saw so later catalog or address edits don't rewrite history
+            lines = []
+            for product_id, quantity in cart:
+                product = products[product_id]
+                unit_price = product['price'] or 0
+                lines.append((product_id, product['title'], product['image_hash'], unit_price, quantity,
+                              round(unit_price * quantity, 2), product['gender_key'], product['category']))
+            total_amount = round(sum(line[5] for line in lines), 2)
+            shipping_address = format_shipping_address(find_shipping_address(cursor, user_id, address_id))
+            created_at = datetime.now().isoformat()
             
-            # Insert order for this item
-            print(f"DEBUG - Inserting order: user_id={user_id}, product_id={product_id}, quantity={quantity}, total_amount={item_total}")
-            try:
+            cursor.execute('''
+                INSERT INTO orders (user_id, total_amount, item_count, payment_method, payment_id, address_id,
+                                  shipping_address, payment_status, order_status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, total_amount, len(lines), payment_method, payment_id, address_id,
+                  shipping_address, 'pending', 'placed', created_at))
+            order_id = cursor.lastrowid
+            cursor.executemany('''
+                INSERT INTO order_items (order_id, product_id, product_title, image_hash, unit_price, quantity,
+                                         line_total, gender_key, category)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(order_id,) + line for line in lines])
+            record_order_sales(cursor, {'id': order_id, 'created_at': created_at, 'order_status': 'placed',
+                                        'total_amount': total_amount}, 1)
+            if idempotency_key:
+                # REPLACE reclaims an expired key the purge hasn't removed yet
                 cursor.execute('''
-                    INSERT INTO orders (user_id, product_id, quantity, total_amount, payment_method, 
-                                      address_id, payment_status, order_status, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    user_id, product_id, quantity, item_total,
-                    payment_method, address_id, 'pending', 'placed', datetime.now().isoformat()
-                ))
-                
-                order_id = cursor.lastrowid
-                order_ids.append(order_id)
-                print(f"DEBUG - Order created with ID: {order_id}")
-                
-            except Exception as insert_error:
-                conn.close()
-                print(f"DEBUG - Insert error: {insert_error}")
-                return jsonify({'success': False, 'message': f'Database error: {str(insert_error)}'}), 500
-        
-        conn.commit()
-        conn.close()
-        
-        print(f"DEBUG - All orders created successfully: {order_ids}")
+                    INSERT OR REPLACE INTO idempotency_keys
+                        (user_id, idempotency_key, request_hash, order_id, total_amount, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (user_id, idempotency_key, fingerprint, order_id, total_amount, datetime.now().isoformat()))
+            
+            # New co-purchase pairs for this customer
+            mark_user_purchases_related_dirty(cursor, user_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        schedule_related_refresh()
         
         return jsonify({
             'success': True, 
             'message': 'Order placed successfully!',
-            'order_ids': order_ids,
-            'total_orders': len(order_ids)
+            'order_id': order_id,
+            'order_ids': [order_id],
+            'total_orders': 1,
+            'total_amount': total_amount
         })
         
     except Exception as e:
-        print(f"DEBUG - Place order error: {str(e)}")
+        logger.exception('Place order error')
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # --- Image Serving Route ---
 @app.route('/api/product-image/<int:product_id>')
 def get_product_image(product_id):
-    """Serve product image from database"""
+    """Serve product image from the image store with content-hash validators"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Get image data from database
-        cursor.execute('SELECT image_data, image_mimetype, image_filename FROM products WHERE id = ?', (product_id,))
-        result = cursor.fetchone()
-        conn.close()
-        
-        if not result or not result[0]:
+        # Check the hash first so revalidations never touch the image bytes
+        product = cursor.execute('''
+            SELECT image_hash, image_mimetype, image_filename, image_widths FROM products WHERE id = ?
+        ''', (product_id,)).fetchone()
+        image_hash = product['image_hash'] if product else None
+        if not image_hash:
+            conn.close()
             # Return placeholder image if no image found
             return send_from_directory('client/img', 'placeholder.svg')
         
-        image_data, mimetype, filename = result
-        
-        # Create response with image data
-        from flask import Response
-        response = Response(image_data, mimetype=mimetype or 'image/jpeg')
-        response.headers['Content-Disposition'] = f'inline; filename="{filename or "product.jpg"}"'
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'  # Prevent caching for instant updates
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
+        mimetype = product['image_mimetype'] or 'image/jpeg'
+        filename = product['image_filename'] or 'product.jpg'
+        # ?size=<width> picks a derivative; without &format the Accept header decides
+        size = request.args.get('size', type=int)
+        image_format = request.args.get('format')
+        negotiated = size and image_format not in IMAGE_DERIVATIVE_FORMATS
+        if negotiated:
+            # Only an explicit image/webp counts; */* is sent by clients that can't decode it
+            accepts_webp = any(value == 'image/webp' and quality for value, quality in request.accept_mimetypes)
+            image_format = 'webp' if accepts_webp else 'jpeg'
+        derivative = choose_image_derivative(cursor, image_hash, image_format, size) if size else None
+        if size and product['image_widths'] is None:
+            schedule_image_derivatives()
+        served_hash = image_hash
+        if derivative:
+            served_hash = derivative['derivative_hash']
+            mimetype = IMAGE_DERIVATIVE_FORMATS[image_format][1]
+            filename = f"{os.path.splitext(filename)[0]}-{derivative['width']}.{image_format}"
+        
+        if served_hash in request.if_none_match:
+            conn.close()
+            response = Response(status=304)
+        elif image_store.exists(served_hash):
+            conn.close()
+            response = image_file_response(served_hash, mimetype, filename)
+        else:
+            # Not moved out of the database yet (flask migrate-images)
+            cursor.execute('SELECT image_data FROM product_images WHERE product_id = ?', (product_id,))
+            result = cursor.fetchone()
+            conn.close()
+            
+            if not result or not result[0]:
+                return send_from_directory('client/img', 'placeholder.svg')
+            
+            response = Response(result[0], mimetype=mimetype)
+            response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
+        
+        response.set_etag(served_hash)
+        if negotiated:
+            response.vary.add('Accept')
+        if request.args.get('v') == image_hash[:IMAGE_HASH_URL_LENGTH] and not (size and product['image_widths'] is None):
+            # Versioned URL (with its derivatives settled): the bytes behind it can never change
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            # Unversioned or stale URL, or derivatives still pending: allow caching but always revalidate
+            response.headers['Cache-Control'] = 'no-cache'
         
         return response
         
     except Exception as e:
-        print(f"Error serving image for product {product_id}: {e}")
+        logger.exception('Error serving image for product %s', product_id)
         return send_from_directory('client/img', 'placeholder.svg')
 
 # --- Admin Image Upload Route ---
 @app.route('/api/admin/upload-product-image/<int:product_id>', methods=['POST'])
 def upload_product_image(product_id):
-    """Upload and store product image in database"""
+    """Upload and store a product image in the image store"""
     try:
         # Check if file was uploaded
         if 'image' not in request.files:
@@ -1469,18 +4390,6 @@ def upload_product_image(product_id):
         if file.filename == '':
             return jsonify({'success': False, 'message': 'No file selected'}), 400
         
-        # Check if it's an image file
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-        if not ('.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
-            return jsonify({'success': False, 'message': 'Invalid file type. Please upload an image.'}), 400
-        
-        # Read file data
-        image_data = file.read()
-        
-        # Get MIME type
-        mimetype = file.mimetype or mimetypes.guess_type(file.filename)[0] or 'image/jpeg'
-        
-        # Store in database
         conn = get_db_connection()
         cursor = conn.cursor()
         
@@ -1490,23 +4399,30 @@ def upload_product_image(product_id):
             conn.close()
             return jsonify({'success': False, 'message': 'Product not found'}), 404
         
-        # Update product with image data
-        cursor.execute('''
-            UPDATE products 
-            SET image_data = ?, image_filename = ?, image_mimetype = ?
-            WHERE id = ?
-        ''', (image_data, file.filename, mimetype, product_id))
+        # Stream the file into the image store (type sniffed from its first bytes)
+        try:
+            image_hash, mimetype = store_uploaded_image(file)
+        except ImageUploadError as e:
+            conn.close()
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        save_product_image(cursor, product_id, image_hash, file.filename, mimetype)
+        catalog_cache.bump_version(cursor)
         
         conn.commit()
         conn.close()
+        catalog_cache.publish()
+        schedule_image_derivatives()
         
         return jsonify({
             'success': True, 
             'message': 'Image uploaded successfully',
-            'image_url': f"/api/product-image/{product_id}?t={int(time.time()*1000)}"
+            'image_url': product_image_url(product_id, image_hash)
         })
+    except RequestEntityTooLarge:
+        return upload_too_large_response()
     except Exception as e:
-        print(f"Error uploading image for product {product_id}: {e}")
+        logger.exception('Error uploading image for product %s', product_id)
         return jsonify({'success': False, 'message': 'Failed to upload image'}), 500
 
 # Address management endpoints
@@ -1534,7 +4450,7 @@ def get_user_admin(user_id):
         
         return jsonify({'success': True, 'user': user_data})
     except Exception as e:
-        print(f"Error getting user: {e}")
+        logger.exception('Error getting user')
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/admin/users/<int:user_id>/addresses', methods=['GET'])
@@ -1567,7 +4483,7 @@ def get_user_addresses_admin(user_id):
         
         return jsonify({'success': True, 'addresses': address_list})
     except Exception as e:
-        print(f"Error getting user addresses: {e}")
+        logger.exception('Error getting user addresses')
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/admin/users/<int:user_id>/orders', methods=['GET'])
@@ -1577,36 +4493,38 @@ def get_user_orders_admin(user_id):
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Get orders with product information
+        # Get orders with their item snapshots
         orders = cursor.execute('''
-            SELECT o.*, p.title as product_title
-            FROM orders o
-            LEFT JOIN products p ON o.product_id = p.id
-            WHERE o.user_id = ? 
-            ORDER BY o.created_at DESC 
+            SELECT id, user_id, total_amount, item_count, order_status, created_at
+            FROM orders
+            WHERE user_id = ? 
+            ORDER BY created_at DESC 
             LIMIT 10
         ''', (user_id,)).fetchall()
+        items = fetch_order_items(cursor, [order['id'] for order in orders])
         
         conn.close()
         
         order_list = []
         for order in orders:
             order_dict = dict(order)
+            summary = order_summary(items[order['id']])
             order_data = {
                 'id': order_dict.get('id'),
                 'user_id': order_dict.get('user_id'),
-                'total_amount': float(order_dict.get('total_amount', 0)),
+                'total_amount': float(order_dict.get('total_amount') or 0),
                 'order_status': order_dict.get('order_status', 'pending'),
                 'created_at': order_dict.get('created_at', ''),
-                'product_title': order_dict.get('product_title') or order_dict.get('product_title', 'Unknown Product'),
-                'quantity': order_dict.get('quantity', 1),
-                'price': float(order_dict.get('price', 0))
+                'item_count': order_dict.get('item_count'),
+                'product_title': summary['product_title'],
+                'quantity': summary['quantity'],
+                'price': summary['price']
             }
             order_list.append(order_data)
         
         return jsonify({'success': True, 'orders': order_list})
     except Exception as e:
-        print(f"Error getting user orders: {e}")
+        logger.exception('Error getting user orders')
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/admin/users/<int:user_id>', methods=['DELETE'])
@@ -1625,18 +4543,20 @@ def delete_user_admin(user_id):
         # Delete user's addresses first (foreign key constraint)
         cursor.execute('DELETE FROM addresses WHERE user_id = ?', (user_id,))
         
-        # Delete user's orders
-        cursor.execute('DELETE FROM orders WHERE user_id = ?', (user_id,))
+        # Delete user's orders (their co-purchase pairs go with them)
+        mark_user_purchases_related_dirty(cursor, user_id)
+        delete_orders(cursor, [row[0] for row in cursor.execute('SELECT id FROM orders WHERE user_id = ?', (user_id,))])
         
         # Delete the user
         cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
         
         conn.commit()
         conn.close()
+        schedule_related_refresh()
         
         return jsonify({'success': True, 'message': 'User deleted successfully'})
     except Exception as e:
-        print(f"Error deleting user: {e}")
+        logger.exception('Error deleting user')
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/admin/orders/<int:order_id>', methods=['DELETE'])
@@ -1647,31 +4567,46 @@ def delete_order_admin(order_id):
         cursor = conn.cursor()
         
         # Check if order exists
-        order = cursor.execute('SELECT id FROM orders WHERE id = ?', (order_id,)).fetchone()
+        order = cursor.execute('SELECT id, user_id FROM orders WHERE id = ?', (order_id,)).fetchone()
         if not order:
             conn.close()
             return jsonify({'success': False, 'message': 'Order not found'}), 404
         
         # Delete the order
-        cursor.execute('DELETE FROM orders WHERE id = ?', (order_id,))
+        mark_user_purchases_related_dirty(cursor, order['user_id'])
+        delete_orders(cursor, [order_id])
         
         conn.commit()
         conn.close()
+        schedule_related_refresh()
         
         return jsonify({'success': True, 'message': 'Order deleted successfully'})
     except Exception as e:
-        print(f"Error deleting order: {e}")
+        logger.exception('Error deleting order')
         return jsonify({'success': False, 'message': str(e)}), 500
 
-# Add cache-busting headers for development
+# Compress and apply the HTTP caching policy for the route class of each response
 @app.after_request
 def after_request(response):
-    # Disable caching for development
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
+    # Compress first, so the catalog ETag below is per encoding
+    response = compress_response(response)
+    cache_class = cache_class_for(response)
+    if cache_class is None:
+        return response
+    
+    response.headers['Cache-Control'] = app.config['CACHE_CONTROL'][cache_class]
+    if cache_class == 'private':
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+    elif cache_class == 'catalog' and response.status_code == 200:
+        # Give catalog JSON a validator so shared caches can revalidate cheaply
+        response.add_etag()
+        response.make_conditional(request)
     return response
 
 if __name__ == '__main__':
-    init_db()
+    if 'FAJR_CACHE_POLICY' not in os.environ:
+        app.config['CACHE_CONTROL'] = dict(CACHE_POLICIES['development'])
+    if 'FAJR_LOG_LEVEL' not in os.environ:
+        logger.setLevel(logging.DEBUG)
     app.run(debug=True, host='0.0.0.0', port=5000)